@@ -1,17 +1,42 @@
+import argparse
 import collections
+import concurrent.futures
+import contextlib
 import fcntl
-import io
+import fnmatch
+import json
 import logging
 import collections.abc
 import os
 import pickle
+import sqlite3
+import sys
+import time
 import typing
 import xdg.BaseDirectory
 
+from musictoolbox import tagreader
+
+from mutagen._file import File
+from mutagen.easyid3 import EasyID3
+from mutagen.easymp4 import EasyMP4Tags
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4Tags
+
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def cache_directory() -> str:
+    """Return the directory where caches are stored, creating it if needed."""
+    return typing.cast(str, xdg.BaseDirectory.save_cache_path("musictoolbox"))
+
+
+def cache_path(cache_name: str) -> str:
+    """Return the path to the file of the named cache."""
+    return os.path.join(cache_directory(), cache_name.replace(os.path.sep, "_"))
+
+
 class OnDiskCacheable(typing.Protocol):
     """
     The protocol for on-disk cacheable objects.
@@ -39,48 +64,525 @@ class OnDiskCacheable(typing.Protocol):
 C = typing.TypeVar("C")
 
 
+CacheEntry = tuple[float, C]
+
+# Maps each old cache version to a function that upgrades an item cached
+# under that version to the next version.
+Migrations = collections.abc.Mapping[
+    int, collections.abc.Callable[[typing.Any], typing.Any]
+]
+
+
+def _migration_steps(
+    migrations: Migrations, from_version: int, to_version: int
+) -> list[collections.abc.Callable[[typing.Any], typing.Any]] | None:
+    """
+    Return the functions that upgrade items from one cache version to
+    another, or None if there is no way to do it.
+    """
+    if from_version >= to_version:
+        return None
+    steps = []
+    for version in range(from_version, to_version):
+        if version not in migrations:
+            return None
+        steps.append(migrations[version])
+    return steps
+
+
+class CacheStats(object):
+    """
+    Counters and timers of the work done by a cache.
+
+    The counters are the number of files whose entries were up to date
+    (hits), the number of files handed to the cache item factory (misses),
+    the number of files or entries that could not be examined or loaded
+    (errors), and the number of bytes of cache data read from and written
+    to disk.  The timers accumulate the seconds spent examining files
+    (stat), running the cache item factory (parse), and loading and saving
+    cache data (load and save).
+    """
+
+    PHASES = ("stat", "parse", "load", "save")
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.seconds: dict[str, float] = dict.fromkeys(self.PHASES, 0.0)
+
+    @contextlib.contextmanager
+    def timing(self, phase: str) -> collections.abc.Generator[None, None, None]:
+        """Add the time spent within the context manager to a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - start
+
+    def as_dict(self) -> dict[str, int | float]:
+        """Return the counters and timers as a flat dictionary."""
+        d: dict[str, int | float] = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+        for phase in self.PHASES:
+            d[phase + "_seconds"] = round(self.seconds[phase], 6)
+        return d
+
+    def format(self, style: str = "text") -> str:
+        """Return the statistics as human-readable text, or as JSON."""
+        if style == "json":
+            return json.dumps(self.as_dict())
+        return (
+            "Cache: %s hits, %s misses, %s errors, %s bytes read, %s bytes written\n"
+            "Time: %s"
+        ) % (
+            self.hits,
+            self.misses,
+            self.errors,
+            self.bytes_read,
+            self.bytes_written,
+            ", ".join(
+                "%s %.3fs" % (phase, self.seconds[phase]) for phase in self.PHASES
+            ),
+        )
+
+    @contextlib.contextmanager
+    def reported(
+        self, style: str | None, stream: typing.TextIO | None = None
+    ) -> collections.abc.Generator[None, None, None]:
+        """
+        Print the statistics to stream (standard error by default) when the
+        scope of the context manager ends, unless style is None.
+        """
+        try:
+            yield
+        finally:
+            if style is not None:
+                print(self.format(style), file=stream or sys.stderr)
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add to a command line parser the options that control how the metadata
+    cache is updated (-j/--jobs and -q/--quick) and whether the statistics
+    of the cache are printed (--stats and --stats-json).
+    """
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="how many processes to use to read metadata from files that are"
+        " not yet cached (default %(default)s)",
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "-q",
+        "--quick",
+        action="store_true",
+        help="do not examine cached files individually when the folder that"
+        " contains them has not been modified since they were cached; faster"
+        " on network file systems, but files modified in place by other"
+        " programs will not be noticed",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_const",
+        const="text",
+        help="when done, print to standard error how much work the metadata cache"
+        " did and how long it took",
+    )
+    parser.add_argument(
+        "--stats-json",
+        dest="stats",
+        action="store_const",
+        const="json",
+        help="like --stats, but print the statistics as a JSON object",
+    )
+
+
+def report_stats(
+    args: argparse.Namespace, stats: CacheStats
+) -> contextlib.AbstractContextManager[None]:
+    """
+    Return a context manager that prints the statistics when its scope ends,
+    in the style asked for by the options added by add_cache_arguments().
+    """
+    return stats.reported(args.stats)
+
+
+class SQLiteMetadataStore(collections.abc.MutableMapping[str, CacheEntry[C]]):
+    """
+    A mapping of cache entries backed by a table in an SQLite database.
+
+    Entries are loaded lazily, one row at a time, the first time their key is
+    looked up.  Modifications are kept in memory until flush() is called, at
+    which point only the rows that changed are written to the database, in a
+    single transaction.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        table: str = "entries",
+        stats: CacheStats | None = None,
+    ) -> None:
+        self.__conn = conn
+        self.__table = table
+        self.__stats = stats if stats is not None else CacheStats()
+        # Maps keys to loaded entries, or to None if the key is known
+        # to be absent from the database.
+        self.__loaded: dict[str, CacheEntry[C] | None] = {}
+        self.__dirty: set[str] = set()
+
+    def __getitem__(self, key: str) -> CacheEntry[C]:
+        try:
+            entry = self.__loaded[key]
+        except KeyError:
+            entry = None
+            with self.__stats.timing("load"):
+                row = self.__conn.execute(
+                    f"SELECT mtime, data FROM {self.__table} WHERE path = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self.__stats.bytes_read += len(row[1])
+                    try:
+                        entry = (row[0], typing.cast(C, pickle.loads(row[1])))
+                    except Exception as exc:
+                        _LOGGER.error("Error loading cache entry for %s: %s", key, exc)
+                        self.__stats.errors += 1
+            self.__loaded[key] = entry
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key: str, value: CacheEntry[C]) -> None:
+        self.__loaded[key] = value
+        self.__dirty.add(key)
+
+    def __delitem__(self, key: str) -> None:
+        self[key]
+        self.__loaded[key] = None
+        self.__dirty.add(key)
+
+    def __iter__(self) -> collections.abc.Iterator[str]:
+        seen: set[str] = set()
+        for (key,) in self.__conn.execute(f"SELECT path FROM {self.__table}"):
+            seen.add(key)
+            if key in self.__loaded and self.__loaded[key] is None:
+                continue
+            yield key
+        for key, entry in list(self.__loaded.items()):
+            if entry is not None and key not in seen:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def is_dirty(self) -> bool:
+        """Return whether any entries remain to be written to the database."""
+        return bool(self.__dirty)
+
+    def flush(self) -> None:
+        """
+        Write the modified entries to the database in one transaction.
+
+        An entry is not written if another process wrote a newer entry for
+        the same key to the database meanwhile.
+        """
+        if not self.__dirty:
+            return
+        with self.__stats.timing("save"):
+            upserts = []
+            deletes = []
+            for key in self.__dirty:
+                entry = self.__loaded[key]
+                if entry is None:
+                    deletes.append((key,))
+                else:
+                    data = pickle.dumps(entry[1], pickle.HIGHEST_PROTOCOL)
+                    self.__stats.bytes_written += len(data)
+                    upserts.append((key, entry[0], data))
+            with self.__conn:
+                self.__conn.executemany(
+                    f"INSERT INTO {self.__table} (path, mtime, data) VALUES (?, ?, ?)"
+                    " ON CONFLICT (path) DO UPDATE"
+                    " SET mtime = excluded.mtime, data = excluded.data"
+                    f" WHERE excluded.mtime >= {self.__table}.mtime",
+                    upserts,
+                )
+                self.__conn.executemany(
+                    f"DELETE FROM {self.__table} WHERE path = ?", deletes
+                )
+        self.__dirty.clear()
+
+
+def file_identity(st: os.stat_result) -> str:
+    """
+    Return a key that identifies a file with the passed status regardless
+    of its path: its device, inode, size and modification time.
+    """
+    return "%s:%s:%s:%s" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
 class FileMetadataCache(OnDiskCacheable, typing.Generic[C]):
-    def __init__(self, cache_item_factory: collections.abc.Callable[[str], C]) -> None:
+    # While new entries are being computed, the checkpoint callable is
+    # called every time this many have been computed, or this many seconds
+    # have passed since the last checkpoint, whichever comes first.
+    checkpoint_entries = 500
+    checkpoint_interval = 60.0
+
+    def __init__(
+        self,
+        cache_item_factory: collections.abc.Callable[[str], C],
+        store: collections.abc.MutableMapping[str, CacheEntry[C]] | None = None,
+        directories: (
+            collections.abc.MutableMapping[str, CacheEntry[frozenset[str]]] | None
+        ) = None,
+        stats: CacheStats | None = None,
+        checkpoint: collections.abc.Callable[[], None] | None = None,
+        identities: collections.abc.MutableMapping[str, CacheEntry[str]] | None = None,
+    ) -> None:
         """
         Initializes a cache.
 
         The cache_item_factory takes a path (in string form) and must return a cache
         item, or None if the factory cannot produce an item.
 
+        The store is the mapping where cache entries are kept, and directories
+        is the mapping where the modification times and the cached file names
+        of directories are kept.  By default, both are dictionaries held in
+        memory.
+
+        The stats object, a new one by default, is where the cache counts its
+        work; it is available as self.stats, and it is not pickled.
+
+        The checkpoint callable, if any, is called periodically while
+        update_metadata_for() computes new entries, so that whoever persists
+        the store can save them before the update is done; this way a long
+        update that is interrupted does not lose all of its work.  It is not
+        pickled either.
+
+        The identities are the mapping where the path of each file cached is
+        kept under the identity of the file (see file_identity()), a
+        dictionary held in memory by default.  When a file is not in the
+        cache under its path, but a file with its identity was cached under
+        another path, the entry of the latter is reused instead of calling
+        the cache_item_factory, so files that were moved or renamed do not
+        need to be examined again.
+
         Cache keys are absolute paths internally.  This is an implementation detail,
         and it is subject to change in the future.  For convenience, the cache store
         is exposed as self._store, but your code will break if you use this directly,
         so limit yourself to the methods exposed by this class.
         """
         self.__factory = cache_item_factory
-        self._store: dict[str, tuple[float, C]] = {}
+        self._store: collections.abc.MutableMapping[str, CacheEntry[C]] = (
+            store if store is not None else {}
+        )
+        self._directories: collections.abc.MutableMapping[
+            str, CacheEntry[frozenset[str]]
+        ] = (directories if directories is not None else {})
+        self._identities: collections.abc.MutableMapping[str, CacheEntry[str]] = (
+            identities if identities is not None else {}
+        )
+        self.stats = stats if stats is not None else CacheStats()
+        self.__checkpoint = checkpoint
         self.__dirty = False
 
-    def update_metadata_for(self, allfiles: list[str]) -> None:
+    def __getstate__(self) -> dict[str, typing.Any]:
+        state = self.__dict__.copy()
+        del state["stats"]
+        del state["_FileMetadataCache__checkpoint"]
+        return state
+
+    def __setstate__(self, state: dict[str, typing.Any]) -> None:
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_identities", {})
+        self.stats = CacheStats()
+        self.__checkpoint = None
+
+    def update_metadata_for(
+        self,
+        allfiles: list[str],
+        jobs: int = 1,
+        trust_directory_mtimes: bool = False,
+        statuses: collections.abc.Mapping[str, os.stat_result] | None = None,
+    ) -> None:
         """
         Instruct the cache to update itself for the passed files.
 
+        The statuses, if passed, map some of the files to their status (as
+        found by musictoolbox.files.walk_files), and those files are not
+        examined again.
+
+        If jobs is greater than one, the cache item factory is run for the
+        files missing from the cache in a pool of that many processes, so
+        the factory must be pickleable (a module-level function or a class
+        method will do).  Entries are stored in the order of the passed
+        files regardless of the order in which the workers finish.
+
+        If trust_directory_mtimes is True, files are not examined one by one
+        when their directory has the same modification time it had when they
+        were last cached.  This takes one stat per directory rather than one
+        per file, but files modified in place (rather than replaced) since
+        then will not be noticed, as that does not update the modification
+        time of their directory.
+
         is_dirty() will return True after this, if any of the files passed
         had its corresponding cache entry updated.
         """
-        dirty = False
+        allfiles = [os.path.abspath(ff) for ff in allfiles]
+        known = {os.path.abspath(ff): st for ff, st in (statuses or {}).items()}
+        directories: dict[str, tuple[float, set[str]]] = {}
+        if trust_directory_mtimes:
+            allfiles = self.__files_in_changed_directories(allfiles, directories)
+
+        stats = self.stats
+        misses: list[tuple[str, float, str]] = []
         for ff in allfiles:
-            ff = os.path.abspath(ff)
             try:
-                modtime = os.stat(ff).st_mtime
+                with stats.timing("stat"):
+                    st = known[ff] if ff in known else os.stat(ff)
             except Exception as exc:
                 _LOGGER.error("Error examining %s: %s", ff, exc)
+                stats.errors += 1
                 continue
-            if ff in self._store and self._store[ff][0] >= modtime:
+            modtime = st.st_mtime
+            d, name = os.path.split(ff)
+            if d in directories:
+                directories[d][1].add(name)
+            entry = self._store.get(ff)
+            if entry is not None and entry[0] >= modtime:
                 if _LOGGER.level <= logging.DEBUG:
                     _LOGGER.debug("No need to update cache for file %s", ff)
+                stats.hits += 1
                 continue
-            if _LOGGER.level <= logging.DEBUG:
-                _LOGGER.debug("Updated cache for file %s at mod time %s", ff, modtime)
-            metadata = self.__factory(ff)
-            self._store[ff] = (modtime, metadata)
-            dirty = True
-        self.__dirty = dirty
+            identity = file_identity(st)
+            moved = self.__moved_entry(identity, ff, modtime)
+            if moved is not None:
+                self._store[ff] = moved
+                self._identities[identity] = (modtime, ff)
+                self.__dirty = True
+                stats.hits += 1
+                continue
+            misses.append((ff, modtime, identity))
+        stats.misses += len(misses)
+
+        paths = [ff for ff, _, _ in misses]
+        with contextlib.ExitStack() as stack:
+            results: collections.abc.Iterator[C]
+            if jobs > 1 and len(misses) > 1:
+                jobs = min(jobs, len(misses))
+                executor = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+                )
+
+                def cancel_pending(
+                    exc_type: type[BaseException] | None, *_: object
+                ) -> None:
+                    # Interrupted or failed: drop the queued work rather than
+                    # wait for it, keeping what was already checkpointed.
+                    if exc_type is not None:
+                        executor.shutdown(wait=False, cancel_futures=True)
+
+                stack.push(cancel_pending)
+                results = executor.map(
+                    self.__factory,
+                    paths,
+                    chunksize=max(1, min(64, len(paths) // (jobs * 4))),
+                )
+            else:
+                results = (self.__factory(ff) for ff in paths)
+
+            pending = 0
+            last_checkpoint = time.monotonic()
+            for ff, modtime, identity in misses:
+                with stats.timing("parse"):
+                    metadata = next(results)
+                if _LOGGER.level <= logging.DEBUG:
+                    _LOGGER.debug(
+                        "Updated cache for file %s at mod time %s", ff, modtime
+                    )
+                self._store[ff] = (modtime, metadata)
+                self._identities[identity] = (modtime, ff)
+                pending += 1
+                if self.__checkpoint is not None and (
+                    pending >= self.checkpoint_entries
+                    or time.monotonic() - last_checkpoint >= self.checkpoint_interval
+                ):
+                    if _LOGGER.level <= logging.DEBUG:
+                        _LOGGER.debug("Checkpointing %s new cache entries", pending)
+                    self.__checkpoint()
+                    pending = 0
+                    last_checkpoint = time.monotonic()
+
+        for d, (dirmtime, names) in directories.items():
+            self._directories[d] = (dirmtime, frozenset(names))
+        self.__dirty = self.__dirty or bool(misses or directories)
+
+    def __moved_entry(
+        self, identity: str, ff: str, modtime: float
+    ) -> CacheEntry[C] | None:
+        """
+        Return the entry cached for the file with the identity under another
+        path, if there is one and it is up to date.
+        """
+        record = self._identities.get(identity)
+        if record is None or record[1] == ff:
+            return None
+        entry = self._store.get(record[1])
+        if entry is None or entry[0] < modtime:
+            return None
+        if _LOGGER.level <= logging.DEBUG:
+            _LOGGER.debug("Reusing cache entry of %s for file %s", record[1], ff)
+        return entry
+
+    def __files_in_changed_directories(
+        self,
+        allfiles: list[str],
+        directories: dict[str, tuple[float, set[str]]],
+    ) -> list[str]:
+        """
+        Return the files whose directories changed since they were cached.
+
+        The directories that must be recorded again once their files are
+        examined are added to the passed directories dictionary, with their
+        current modification time and the names already known to be cached.
+        """
+        by_directory: dict[str, list[str]] = collections.defaultdict(list)
+        for ff in allfiles:
+            by_directory[os.path.dirname(ff)].append(ff)
+
+        unchanged: set[str] = set()
+        for d, ffs in by_directory.items():
+            try:
+                with self.stats.timing("stat"):
+                    dirmtime = os.stat(d).st_mtime
+            except Exception as exc:
+                _LOGGER.error("Error examining %s: %s", d, exc)
+                self.stats.errors += 1
+                continue
+            record = self._directories.get(d)
+            if record is None or record[0] != dirmtime:
+                directories[d] = (dirmtime, set())
+            elif all(
+                os.path.basename(ff) in record[1] and ff in self._store for ff in ffs
+            ):
+                if _LOGGER.level <= logging.DEBUG:
+                    _LOGGER.debug("No need to examine files in directory %s", d)
+                self.stats.hits += len(ffs)
+                unchanged.add(d)
+            else:
+                directories[d] = (dirmtime, set(record[1]))
+
+        return [ff for ff in allfiles if os.path.dirname(ff) not in unchanged]
 
     def __getitem__(self, key: str) -> C:
         key = os.path.abspath(key)
@@ -99,6 +601,47 @@ class FileMetadataCache(OnDiskCacheable, typing.Generic[C]):
             return None
         return m[1]
 
+    def evict_missing(self, roots: list[str], present: list[str]) -> int:
+        """
+        Remove entries for files that no longer exist beneath the roots.
+
+        The present files are known to exist, so they are not examined;
+        any other entry beneath the roots (or for a root itself) is evicted
+        if its path does not exist anymore.  Directory records are treated
+        the same way, and so are the identities of the files evicted, so a
+        file that later reuses an identity is never given a stale entry.
+        Returns the number of file entries evicted.
+
+        is_dirty() will return True after this, if any entry was evicted.
+        """
+        prefixes = tuple(
+            os.path.join(os.path.abspath(root), "") for root in roots
+        )
+        exact = set(os.path.abspath(root) for root in roots)
+        known = set(os.path.abspath(ff) for ff in present)
+
+        def stale(path: str) -> bool:
+            if path in known:
+                return False
+            if path not in exact and not path.startswith(prefixes):
+                return False
+            return not os.path.lexists(path)
+
+        evicted: set[str] = set()
+        for mapping in (self._store, self._directories):
+            for key in [key for key in mapping if stale(key)]:
+                if _LOGGER.level <= logging.DEBUG:
+                    _LOGGER.debug("Evicting cache entry for %s", key)
+                del mapping[key]
+                if mapping is self._store:
+                    evicted.add(key)
+                self.__dirty = True
+        if evicted:
+            for identity, (_, path) in list(self._identities.items()):
+                if path in evicted:
+                    del self._identities[identity]
+        return len(evicted)
+
     def mark_clean(self) -> None:
         """Mark the cache as clean again."""
         self.__dirty = False
@@ -108,6 +651,295 @@ class FileMetadataCache(OnDiskCacheable, typing.Generic[C]):
         return self.__dirty
 
 
+# Tags kept in snapshots, named as mutagen's easy interfaces name them.
+SNAPSHOT_KEYS = (
+    "album",
+    "artist",
+    "albumartist",
+    "musicbrainz_albumid",
+    "musicbrainz_albumartistid",
+    "musicbrainz_artistid",
+    "replaygain_track_gain",
+    "replaygain_track_peak",
+    "replaygain_album_gain",
+    "replaygain_album_peak",
+    "replaygain_reference_loudness",
+)
+
+# ID3 TXXX frames without an easy name, kept in snapshots as TXXX:<description>.
+SNAPSHOT_TXXX_DESCRIPTIONS = (
+    "MUSICBRAINZ_ALBUMID",
+    "MUSICBRAINZ_ALBUMARTISTID",
+    "albumartist",
+    "QuodLibet::albumartist",
+    "ALBUM ARTIST",
+    "replaygain_track_gain",
+    "replaygain_track_peak",
+    "replaygain_album_gain",
+    "replaygain_album_peak",
+    "replaygain_reference_loudness",
+    "QuodLibet::replaygain_reference_loudness",
+)
+
+# MP4 freeform atoms kept in snapshots under their easy names.
+SNAPSHOT_MP4_FREEFORM = {
+    "replaygain_track_gain": "----:com.apple.iTunes:replaygain_track_gain",
+    "replaygain_track_peak": "----:com.apple.iTunes:replaygain_track_peak",
+    "replaygain_album_gain": "----:com.apple.iTunes:replaygain_album_gain",
+    "replaygain_album_peak": "----:com.apple.iTunes:replaygain_album_peak",
+}
+
+# Tag names in pickled snapshots are replaced by their index in this tuple.
+_SNAPSHOT_TAG_NAMES = SNAPSHOT_KEYS + tuple(
+    "TXXX:" + desc for desc in SNAPSHOT_TXXX_DESCRIPTIONS
+)
+_SNAPSHOT_TAG_INDEXES = {name: n for n, name in enumerate(_SNAPSHOT_TAG_NAMES)}
+
+_SnapshotState = tuple[bool, tuple[tuple[int | str, tuple[str, ...]], ...]]
+
+TM = typing.TypeVar("TM", bound="TagSnapshot")
+
+
+def _easy_getters(getters: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """
+    Return the getter of an easy interface for each key kept in snapshots,
+    matching the key patterns of the interface once rather than per file.
+    """
+    resolved = {}
+    for key in SNAPSHOT_KEYS:
+        for pattern, getter in getters.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                resolved[key] = getter
+                break
+    return resolved
+
+
+_EASYID3_GETTERS = _easy_getters(EasyID3.Get)
+_EASYMP4_GETTERS = _easy_getters(EasyMP4Tags.Get)
+
+
+def _easy_get(
+    getters: dict[str, typing.Any], tags: typing.Any, key: str
+) -> list[str] | None:
+    """Look up a key in raw tags using the resolved getters of an easy interface."""
+    getter = getters.get(key)
+    if getter is None:
+        return None
+    try:
+        return [str(v) for v in getter(tags, key)]
+    except KeyError:
+        return None
+
+
+def _text_values(values: typing.Any) -> list[str]:
+    if isinstance(values, (list, tuple)):
+        return [str(v) for v in values]
+    return str(values).split("\x00")
+
+
+class TagSnapshot(object):
+    """
+    The tags of a file that the programs in this package care about.
+
+    Snapshots are read with a single parse of the file, so that every
+    program can derive what it needs (album identifiers, ReplayGain
+    information, artists...) from the same cached snapshot.  Tags are
+    named as mutagen's easy interfaces name them, regardless of format;
+    in addition, ID3 TXXX frames with no easy name are named TXXX:<desc>.
+
+    Snapshots are kept compact, as caches hold one per file in a library:
+    they have no instance dictionary, tag names and values are interned
+    shared, and they pickle to a flat tuple where known tag names are
+    replaced by small integers.
+    """
+
+    __slots__ = ("valid", "_tags")
+
+    valid: bool
+    _tags: dict[str, tuple[str, ...]]
+
+    def __init__(
+        self,
+        valid: bool,
+        tags: collections.abc.Mapping[str, collections.abc.Iterable[str]],
+    ) -> None:
+        self.valid = valid
+        self._tags = {
+            sys.intern(key): tuple(sys.intern(v) for v in values)
+            for key, values in tags.items()
+        }
+
+    def __getstate__(self) -> _SnapshotState:
+        return self.valid, tuple(
+            (_SNAPSHOT_TAG_INDEXES.get(key, key), values)
+            for key, values in self._tags.items()
+        )
+
+    def __setstate__(self, state: _SnapshotState | dict[str, typing.Any]) -> None:
+        if isinstance(state, dict):
+            # Snapshots pickled by cache version 1, with an instance dictionary.
+            TagSnapshot.__init__(self, state["valid"], state["tags"])
+            return
+        valid, tags = state
+        TagSnapshot.__init__(
+            self,
+            valid,
+            {
+                _SNAPSHOT_TAG_NAMES[key] if isinstance(key, int) else key: values
+                for key, values in tags
+            },
+        )
+
+    @property
+    def tags(self) -> dict[str, list[str]]:
+        """Return all the tags in the snapshot."""
+        return {key: list(values) for key, values in self._tags.items()}
+
+    def get(self, key: str) -> list[str] | None:
+        """Return the values of a tag, or None if the file lacks it."""
+        values = self._tags.get(key)
+        return list(values) if values is not None else None
+
+    def first(self, *keys: str) -> str | None:
+        """Return the first value of the first of the keys the file has."""
+        for key in keys:
+            values = self._tags.get(key)
+            if values:
+                return values[0]
+        return None
+
+    @classmethod
+    def from_file(klass: typing.Type[TM], ff: str) -> TM:
+        """
+        Read the snapshot of a file.
+
+        The tags of MP3, FLAC, Ogg and MP4 files are read with the fast
+        readers in musictoolbox.tagreader; other files, and files those
+        readers cannot handle, are read with mutagen.
+        """
+        try:
+            kind, raw = tagreader.read_tags(ff, SNAPSHOT_KEYS)
+        except Exception as exc:
+            if _LOGGER.level <= logging.DEBUG:
+                _LOGGER.debug("Reading %s with mutagen: %s", ff, exc)
+            return klass.__from_mutagen(ff)
+        return klass(True, _snapshot_tags(kind, raw))
+
+    @classmethod
+    def __from_mutagen(klass: typing.Type[TM], ff: str) -> TM:
+        try:
+            from_disk_metadata = File(ff)
+        except Exception as exc:
+            _LOGGER.error("Error identifying %s: %s:", ff, exc)
+            return klass(False, {})
+        if from_disk_metadata is None:
+            return klass(False, {})
+        raw = from_disk_metadata.tags
+        if raw is None:
+            return klass(True, {})
+        if isinstance(raw, ID3):
+            kind = tagreader.ID3_TAGS
+        elif isinstance(raw, MP4Tags):
+            kind = tagreader.MP4_TAGS
+        else:
+            kind = tagreader.VORBIS_TAGS
+        return klass(True, _snapshot_tags(kind, raw))
+
+
+def _snapshot_tags(kind: str, raw: typing.Any) -> dict[str, list[str]]:
+    """
+    Return the tags kept in snapshots out of the tags of a file, which are
+    of one of the kinds returned by tagreader.read_tags().  The tags may
+    also be the corresponding mutagen tags objects.
+    """
+    tags: dict[str, list[str]] = {}
+    if kind == tagreader.ID3_TAGS:
+        for key in SNAPSHOT_KEYS:
+            values = _easy_get(_EASYID3_GETTERS, raw, key)
+            if values:
+                tags[key] = values
+        for desc in SNAPSHOT_TXXX_DESCRIPTIONS:
+            if "TXXX:" + desc in raw:
+                frame = raw["TXXX:" + desc]
+                if frame.text:
+                    tags["TXXX:" + desc] = [str(v) for v in frame.text]
+    elif kind == tagreader.MP4_TAGS:
+        for key in SNAPSHOT_KEYS:
+            if key in SNAPSHOT_MP4_FREEFORM:
+                atom = SNAPSHOT_MP4_FREEFORM[key]
+                values = (
+                    [bytes(v).decode("utf-8", "replace") for v in raw[atom]]
+                    if atom in raw
+                    else None
+                )
+            else:
+                values = _easy_get(_EASYMP4_GETTERS, raw, key)
+            if values:
+                tags[key] = values
+    else:
+        for key in SNAPSHOT_KEYS:
+            try:
+                v = raw.get(key)
+            except Exception:
+                v = None
+            if v:
+                tags[key] = _text_values(v)
+    return tags
+
+
+# How long to wait, in seconds, for other processes writing to a cache database.
+SQLITE_BUSY_TIMEOUT = 60.0
+
+TAG_SNAPSHOT_CACHE_NAME = "tags.sqlite"
+TAG_SNAPSHOT_CACHE_VERSION = 2
+
+# Upgrades of cached snapshots from each past TAG_SNAPSHOT_CACHE_VERSION.
+TAG_SNAPSHOT_CACHE_MIGRATIONS: dict[
+    int, collections.abc.Callable[[typing.Any], typing.Any]
+] = {
+    # Version 2 only changed how snapshots are pickled; TagSnapshot still
+    # loads version 1 pickles, and the upgrade saves them in the new form.
+    1: lambda snapshot: snapshot,
+}
+
+
+# The pickled caches doreplaygain and scanalbumartists used to keep, which the
+# tag snapshot cache replaces.
+LEGACY_CACHE_NAMES = ("doreplaygain.pickle", "scanalbumartists.pickle")
+
+
+def remove_legacy_caches() -> list[str]:
+    """Remove the caches the tag snapshot cache replaces, and return their names."""
+    removed = []
+    for name in LEGACY_CACHE_NAMES:
+        try:
+            os.unlink(cache_path(name))
+        except FileNotFoundError:
+            continue
+        except OSError as exc:
+            _LOGGER.warning("Cannot remove old cache %s: %s", name, exc)
+            continue
+        _LOGGER.info("Removed old cache %s", name)
+        removed.append(name)
+    return removed
+
+
+def tag_snapshot_cache() -> "SQLiteMetadataCache[TagSnapshot]":
+    """
+    Return the cache of tag snapshots shared by the programs in this package,
+    removing the caches it replaces, if they are still around.
+
+    Use the returned object as a context manager.
+    """
+    remove_legacy_caches()
+    return SQLiteMetadataCache(
+        TAG_SNAPSHOT_CACHE_NAME,
+        TAG_SNAPSHOT_CACHE_VERSION,
+        TagSnapshot.from_file,
+        TAG_SNAPSHOT_CACHE_MIGRATIONS,
+    )
+
+
 D = typing.TypeVar("D", bound="OnDiskCacheable")
 
 
@@ -125,6 +957,9 @@ class OnDiskMetadataCache(typing.Generic[D]):
     Failing to lead the cache is never an error (it defaults to the
     empty cache object created by the factory), but failing to save the
     cache will raise the appropriate exception.
+
+    The time spent loading and saving the cache file, and its size, are
+    counted in self.stats.
     """
 
     def __init__(
@@ -132,6 +967,7 @@ class OnDiskMetadataCache(typing.Generic[D]):
         cache_name: str,
         cache_version: int,
         cache_factory: collections.abc.Callable[[], D],
+        migrations: Migrations | None = None,
     ):
         """
         Context manager that initializes an on-disk cache.
@@ -141,58 +977,342 @@ class OnDiskMetadataCache(typing.Generic[D]):
 
         The cache_factory will be called to produce an empty cache in case
         the cache cannot be loaded from disk.
+
+        A cache saved under an older cache_version is upgraded with the
+        migrations, each of which takes the whole cache object saved under
+        a version and returns it upgraded to the next one.  If any is
+        missing, the cache is ignored as if it could not be loaded.
         """
         self.__cache_version = cache_version
         self.__cache_factory = cache_factory
-        self.__f: io.BufferedRandom | None = None
+        self.__migrations = migrations or {}
+        self.__f: typing.BinaryIO | None = None
         self.__metadata: D = None  # type: ignore
-        p = xdg.BaseDirectory.save_cache_path("musictoolbox")
-        self.__path = os.path.join(p, cache_name.replace(os.path.sep, "_"))
+        self.__path = cache_path(cache_name)
+        self.stats = CacheStats()
 
-    def __enter__(self) -> D:
-        f: io.BufferedRandom
+    def __load(self, f: typing.BinaryIO) -> D | None:
+        """Load the cache from an open and locked file, if possible."""
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return None
+        f.seek(0, 0)
+        try:
+            with self.stats.timing("load"):
+                version, loaded_metadata = typing.cast(
+                    tuple[int, D], pickle.load(f)
+                )
+            self.stats.bytes_read += size
+        except Exception as exc:
+            _LOGGER.error("Error opening cache from %s: %s", self.__path, exc)
+            self.stats.errors += 1
+            return None
+        if version != self.__cache_version:
+            steps = _migration_steps(self.__migrations, version, self.__cache_version)
+            if steps is None:
+                _LOGGER.debug(
+                    "Expected cache version was %s, loaded cache version was %s,"
+                    " ignoring cache",
+                    self.__cache_version,
+                    version,
+                )
+                return None
+            try:
+                for step in steps:
+                    loaded_metadata = step(loaded_metadata)
+            except Exception as exc:
+                _LOGGER.error(
+                    "Error upgrading cache from %s: %s", self.__path, exc
+                )
+                return None
+            _LOGGER.debug(
+                "Upgraded cache from version %s to version %s",
+                version,
+                self.__cache_version,
+            )
+        return loaded_metadata
 
+    def __enter__(self) -> D:
         metadata = self.__cache_factory()
-        fsize = 0
+        self.__f = None
         try:
             if _LOGGER.level <= logging.DEBUG:
                 _LOGGER.debug("Loading cache from %s", self.__path)
             f = open(self.__path, "a+b")
             fcntl.flock(f, fcntl.LOCK_EX)
-            fsize = os.stat(self.__path).st_size
-            f.seek(0, 0)
+            self.__f = f
         except Exception as exc:
             if not isinstance(exc, FileNotFoundError):
                 _LOGGER.error("Error opening cache from %s: %s", self.__path, exc)
 
-        if f and fsize:
-            try:
-                version, loaded_metadata = typing.cast(tuple[int, D], pickle.load(f))
-                if version == self.__cache_version:
-                    metadata = loaded_metadata
-                else:
-                    _LOGGER.debug(
-                        "Expected cache version was %s, loaded cache version was %s,"
-                        " ignoring cache",
-                        self.__cache_version,
-                        version,
-                    )
-            except Exception as exc:
-                _LOGGER.error("Error opening cache from %s: %s", self.__path, exc)
+        if self.__f:
+            loaded_metadata = self.__load(self.__f)
+            if loaded_metadata is not None:
+                metadata = loaded_metadata
 
-        self.__f = f
         self.__metadata = metadata
         return metadata
 
     def __exit__(self, *unused_args: typing.Any, **unused_kw: typing.Any) -> None:
-        if self.__f and self.__metadata.is_dirty():
-            try:
+        if not self.__f:
+            return
+        try:
+            if self.__metadata.is_dirty():
                 self.__metadata.mark_clean()
                 if _LOGGER.level <= logging.DEBUG:
                     _LOGGER.debug("Saving cache to %s", self.__path)
                 self.__f.seek(0, 0)
                 self.__f.truncate()
-                pickle.dump((self.__cache_version, self.__metadata), self.__f)
-                self.__f.flush()
-            finally:
-                self.__f.close()
+                with self.stats.timing("save"):
+                    pickle.dump(
+                        (self.__cache_version, self.__metadata),
+                        self.__f,
+                        pickle.HIGHEST_PROTOCOL,
+                    )
+                    self.__f.flush()
+                self.stats.bytes_written += self.__f.tell()
+        finally:
+            self.__f.close()
+            self.__f = None
+
+
+class SQLiteMetadataCache(typing.Generic[C]):
+    """
+    Cache utility that persists a FileMetadataCache to an SQLite database.
+
+    The FileMetadataCache is returned when called as a context manager.  Its
+    entries are read from the database lazily as they are looked up, and
+    only the entries that changed are written back to the database when the
+    scope of the context manager ends.  File entries are committed before
+    directory records, so a directory is never recorded as unchanged
+    without the entries of its files.
+
+    Several processes can use the same cache at once.  The database uses
+    write-ahead logging, so readers never wait for writers, and writes only
+    happen in the short transactions that flush changed rows.  When two
+    processes cache the same file, the newest entry is kept.
+
+    Failing to open the database is never an error (the cache then lives
+    in memory only), but failing to save the cache will raise the
+    appropriate exception.
+
+    While the FileMetadataCache computes many new entries, they are saved
+    periodically, so an update that crashes or is killed resumes from the
+    last checkpoint the next time.
+
+    The work done by the cache, including saving it when the scope of the
+    context manager ends, is counted in self.stats, which is also the
+    stats object of the returned FileMetadataCache.
+    """
+
+    def __init__(
+        self,
+        cache_name: str,
+        cache_version: int,
+        cache_item_factory: collections.abc.Callable[[str], C],
+        migrations: Migrations | None = None,
+    ):
+        """
+        Context manager that initializes an SQLite-backed cache.
+
+        Caches are stored in $XDG_CACHE_HOME/musictoolbox, in a database
+        file named after cache_name.
+
+        Entries stored under an older cache_version are upgraded when the
+        database is opened, by passing each cached item through the
+        migrations from its version onwards; a migration may return None to
+        discard an entry, so that its file is examined again.  Entries
+        stored under a newer cache_version, or under a version with no
+        migration, are discarded.
+        """
+        self.__cache_version = cache_version
+        self.__cache_item_factory = cache_item_factory
+        self.__migrations = migrations or {}
+        self.__conn: sqlite3.Connection | None = None
+        self.__stores: list[SQLiteMetadataStore[typing.Any]] = []
+        self.__path = cache_path(cache_name)
+        self.stats = CacheStats()
+
+    def __open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.__path, timeout=SQLITE_BUSY_TIMEOUT)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta"
+                    " (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+                )
+                for table in ("entries", "directories", "identities"):
+                    conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table} (path TEXT PRIMARY KEY,"
+                        " mtime REAL NOT NULL, data BLOB NOT NULL)"
+                    )
+            if self.__stored_version(conn) != self.__cache_version:
+                with conn:
+                    # Check again under the write lock, in case another
+                    # process upgraded the database meanwhile.
+                    conn.execute("BEGIN IMMEDIATE")
+                    version = self.__stored_version(conn)
+                    if version != self.__cache_version:
+                        self.__upgrade(conn, version)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def __stored_version(self, conn: sqlite3.Connection) -> int | None:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return typing.cast(int, row[0]) if row is not None else None
+
+    def __upgrade(self, conn: sqlite3.Connection, version: int | None) -> None:
+        """Upgrade or discard the entries of the database, within a transaction."""
+        steps = (
+            _migration_steps(self.__migrations, version, self.__cache_version)
+            if version is not None
+            else None
+        )
+        if steps is None:
+            if version is not None:
+                _LOGGER.debug(
+                    "Expected cache version was %s, loaded cache version"
+                    " was %s, ignoring cache",
+                    self.__cache_version,
+                    version,
+                )
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM directories")
+            conn.execute("DELETE FROM identities")
+        else:
+            updates = []
+            deletes = []
+            for path, data in conn.execute("SELECT path, data FROM entries"):
+                try:
+                    item = pickle.loads(data)
+                    for step in steps:
+                        if item is None:
+                            break
+                        item = step(item)
+                except Exception as exc:
+                    _LOGGER.error("Error upgrading cache entry for %s: %s", path, exc)
+                    item = None
+                if item is None:
+                    deletes.append((path,))
+                else:
+                    updates.append((pickle.dumps(item, pickle.HIGHEST_PROTOCOL), path))
+            conn.executemany("UPDATE entries SET data = ? WHERE path = ?", updates)
+            conn.executemany("DELETE FROM entries WHERE path = ?", deletes)
+            _LOGGER.info(
+                "Upgraded %s entries of cache %s from version %s to version %s,"
+                " discarded %s",
+                len(updates),
+                self.__path,
+                version,
+                self.__cache_version,
+                len(deletes),
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+            (self.__cache_version,),
+        )
+
+    def __enter__(self) -> FileMetadataCache[C]:
+        try:
+            if _LOGGER.level <= logging.DEBUG:
+                _LOGGER.debug("Opening cache database %s", self.__path)
+            self.__conn = self.__open()
+        except Exception as exc:
+            _LOGGER.error("Error opening cache from %s: %s", self.__path, exc)
+            return FileMetadataCache(self.__cache_item_factory, stats=self.stats)
+
+        store: SQLiteMetadataStore[C] = SQLiteMetadataStore(
+            self.__conn, stats=self.stats
+        )
+        directories: SQLiteMetadataStore[frozenset[str]] = SQLiteMetadataStore(
+            self.__conn, "directories", self.stats
+        )
+        identities: SQLiteMetadataStore[str] = SQLiteMetadataStore(
+            self.__conn, "identities", self.stats
+        )
+        self.__stores = [store, directories, identities]
+        return FileMetadataCache(
+            self.__cache_item_factory,
+            store,
+            directories,
+            self.stats,
+            self.__flush,
+            identities,
+        )
+
+    def __flush(self) -> None:
+        if any(store.is_dirty() for store in self.__stores):
+            if _LOGGER.level <= logging.DEBUG:
+                _LOGGER.debug("Saving cache to %s", self.__path)
+            for store in self.__stores:
+                store.flush()
+
+    def __exit__(self, *unused_args: typing.Any, **unused_kw: typing.Any) -> None:
+        if not self.__conn:
+            return
+        try:
+            self.__flush()
+        finally:
+            self.__conn.close()
+            self.__conn = None
+
+
+def compact_sqlite_cache(cache_name: str) -> tuple[int, int]:
+    """
+    Compact the database of an SQLiteMetadataCache.
+
+    Removes every file entry, directory record and file identity whose path
+    does not exist anymore, then rebuilds the database file to release the space they
+    used.  Returns the number of file entries removed and the number of
+    bytes reclaimed.
+    """
+    path = cache_path(cache_name)
+
+    def size() -> int:
+        total = 0
+        for suffix in ("", "-wal"):
+            try:
+                total += os.stat(path + suffix).st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    before = size()
+    removed = 0
+    conn = sqlite3.connect(path)
+    try:
+        for table in ("entries", "directories"):
+            stale = [
+                (p,)
+                for (p,) in conn.execute(f"SELECT path FROM {table}")
+                if not os.path.lexists(p)
+            ]
+            with conn:
+                conn.executemany(f"DELETE FROM {table} WHERE path = ?", stale)
+            if table == "entries":
+                removed = len(stale)
+        # Identities are keyed by file identity, and hold the path of the file.
+        # Databases last opened by older versions of this module lack them.
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'identities'"
+        ).fetchone():
+            stale = []
+            for key, data in conn.execute("SELECT path, data FROM identities"):
+                try:
+                    exists = os.path.lexists(pickle.loads(data))
+                except Exception:
+                    exists = False
+                if not exists:
+                    stale.append((key,))
+            with conn:
+                conn.executemany("DELETE FROM identities WHERE path = ?", stale)
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return removed, before - size()
@@ -0,0 +1,63 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+
+from musictoolbox.cache import (
+    cache_directory,
+    compact_sqlite_cache,
+    remove_legacy_caches,
+)
+from musictoolbox.logging import basicConfig
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(
+        description="Remove stale entries from the metadata caches of"
+        " doreplaygain and scanalbumartists, and reclaim the space they used."
+        "  Caches left by older versions of those programs are removed.",
+    )
+    p.add_argument(
+        "CACHE",
+        type=str,
+        nargs="*",
+        help="name of the cache to compact (default: all caches in %s)"
+        % cache_directory(),
+    )
+    p.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="enable verbose operation",
+    )
+    args = p.parse_args()
+    basicConfig(
+        main_module_name=__name__, level=logging.DEBUG if args.verbose else logging.INFO
+    )
+
+    remove_legacy_caches()
+    names = args.CACHE or sorted(
+        os.path.basename(f)
+        for f in glob.glob(os.path.join(cache_directory(), "*.sqlite"))
+    )
+
+    ret = 0
+    for name in names:
+        try:
+            entries, reclaimed = compact_sqlite_cache(name)
+        except Exception as exc:
+            _LOGGER.error("Cannot compact cache %s: %s", name, exc)
+            ret = 1
+            continue
+        _LOGGER.info(
+            "%s: removed %s stale entries, reclaimed %s bytes",
+            name,
+            entries,
+            reclaimed,
+        )
+
+    sys.exit(ret)
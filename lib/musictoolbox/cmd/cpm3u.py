@@ -3,6 +3,7 @@ import logging
 import os
 import sys
 
+from .. import m3u
 from ..logging import basicConfig
 
 
@@ -25,7 +26,6 @@ def main() -> None:
 
     for in_file in args.IN:
         new = []
-        in_basedir = os.path.dirname(in_file)
         out_file = args.OUT[0]
         if os.path.isdir(out_file):
             out_basedir = out_file
@@ -35,32 +35,19 @@ def main() -> None:
                 "Error: multiple source paths were specified, but destination %r is not a directory."
                 % out_file
             )
-            out_basedir = os.path.dirname(out_file)
+            out_basedir = os.path.dirname(out_file) or os.curdir
 
-        with open(in_file, "r") as in_:
-            for line in in_:
-                if line.startswith("#"):
-                    new.append(line)
-                    continue
-                has_newline = line.endswith("\n")
-                line = line.rstrip()
-                absline = os.path.abspath(os.path.join(in_basedir, line))
-                line = absline
-                if not args.absolute:
-                    relline = os.path.relpath(line, out_basedir)
-                    line = relline
-                new.append(line + ("\n" if has_newline else ""))
-
-        try:
-            with open(out_file, "r") as out_orig:
-                orig_text = out_orig.read()
-        except Exception:
-            orig_text = ""
+        playlist = m3u.read(in_file)
+        for line in playlist.lines:
+            if line.path is None:
+                new.append(line.raw)
+                continue
+            text = m3u.entry(line.path, None if args.absolute else out_basedir)
+            new.append(text + ("\n" if line.raw.endswith("\n") else ""))
 
         new_text = "".join(new)
 
-        if new_text != orig_text:
-            with open(out_file, "w") as out_:
-                out_.write(new_text)
+        if m3u.differs(out_file, new_text, playlist.encoding):
+            m3u.write(out_file, new_text, playlist.encoding)
 
     sys.exit(0)
@@ -8,31 +8,143 @@ import typing
 import concurrent.futures
 import os
 
-from musictoolbox.cache import FileMetadataCache, OnDiskMetadataCache
-from musictoolbox.files import all_files
+from musictoolbox.cache import (
+    TagSnapshot,
+    add_cache_arguments,
+    report_stats,
+    tag_snapshot_cache,
+)
+from musictoolbox.files import walk_files
 from musictoolbox.logging import basicConfig
-from mutagen._file import File
-from rgain3.lib.albumid import get_album_id # type: ignore
 from rgain3.lib import rgio, GainData # type: ignore
 
 
 _LOGGER = logging.getLogger(__name__)
-_MAPPER = rgio.BaseFormatsMap()
-
-CACHE_VERSION = 6
 
 TM = typing.TypeVar("TM", bound="AlbumIdentifier")
 
 
+# The extensions of the MP4 files rgain3 reads ReplayGain information from.
+_MP4_EXTENSIONS = (".m4a", ".mp4")
+
+
+def get_album_id(ff: str, snapshot: TagSnapshot) -> str | None:
+    """
+    Determine an album identifier from the tag snapshot of a file.
+
+    This follows the logic of rgain3's get_album_id: the MusicBrainz album ID
+    if present, otherwise the album combined with the first of the MusicBrainz
+    album artist ID, the album artist or the artist, otherwise None.  Like
+    rgain3, which looks MP4 tags up by names MP4 files do not use, this finds
+    no identifier for MP4 files.
+    """
+    if os.path.splitext(ff)[1].lower() in _MP4_EXTENSIONS:
+        return None
+    album_id = snapshot.first("musicbrainz_albumid", "TXXX:MUSICBRAINZ_ALBUMID")
+    if album_id is not None:
+        return album_id
+    album = snapshot.first("album")
+    if album is None:
+        return None
+    artist_part = snapshot.first(
+        "musicbrainz_albumartistid",
+        "TXXX:MUSICBRAINZ_ALBUMARTISTID",
+        "TXXX:albumartist",
+        "TXXX:QuodLibet::albumartist",
+        "TXXX:ALBUM ARTIST",
+        "albumartist",
+        "artist",
+    )
+    if artist_part is None:
+        return album
+    return "{} - {}".format(artist_part, album)
+
+
+def _read_gain_data(
+    snapshot: TagSnapshot, gain_key: str, peak_key: str
+) -> GainData | None:
+    gain = snapshot.first(gain_key)
+    if gain is None:
+        return None
+    parsed_gain = rgio.parse_db(gain)
+    if parsed_gain is None:
+        return None
+    gaindata = GainData(parsed_gain)
+    peak = snapshot.first(peak_key)
+    if peak is not None:
+        parsed_peak = rgio.parse_peak(peak)
+        if parsed_peak is not None:
+            gaindata.peak = parsed_peak
+    return gaindata
+
+
+def _read_gains(
+    snapshot: TagSnapshot, prefix: str, ref_loudness_keys: list[str]
+) -> tuple[GainData | None, GainData | None]:
+    trackgain = _read_gain_data(
+        snapshot, prefix + "replaygain_track_gain", prefix + "replaygain_track_peak"
+    )
+    albumgain = _read_gain_data(
+        snapshot, prefix + "replaygain_album_gain", prefix + "replaygain_album_peak"
+    )
+    for key in ref_loudness_keys:
+        ref_level = snapshot.first(key)
+        parsed_ref_level = rgio.parse_db(ref_level) if ref_level is not None else None
+        if parsed_ref_level is not None:
+            for gaindata in (trackgain, albumgain):
+                if gaindata:
+                    gaindata.ref_level = parsed_ref_level
+            break
+    return trackgain, albumgain
+
+
+def read_gain(
+    ff: str, snapshot: TagSnapshot
+) -> tuple[GainData | None, GainData | None]:
+    """
+    Return the track and album ReplayGain information in a tag snapshot.
+
+    This reads the same tags rgain3 reads for each file type, with MP3 files
+    using its default format: both replaygain.org TXXX frames and legacy RVA2
+    frames must be present and agree, or no gain information is returned.
+    Raises rgio.UnknownFiletype for file types rgain3 does not support.
+    """
+    ext = os.path.splitext(ff)[1].lower()
+    if ext == ".mp3":
+        rgorg = _read_gains(
+            snapshot, "TXXX:", ["TXXX:replaygain_reference_loudness"]
+        )
+        rva2 = _read_gains(
+            snapshot,
+            "",
+            [
+                "TXXX:replaygain_reference_loudness",
+                "TXXX:QuodLibet::replaygain_reference_loudness",
+            ],
+        )
+        if rgorg[0] is None or rva2[0] is None:
+            return None, None
+        if not rgio.gaindata_almost_equal(
+            rgorg[0], rva2[0]
+        ) or not rgio.gaindata_almost_equal(rgorg[1], rva2[1]):
+            return None, None
+        return rgorg
+    if ext in (".ogg", ".oga", ".flac", ".wv"):
+        return _read_gains(snapshot, "", ["replaygain_reference_loudness"])
+    if ext in (".m4a", ".mp4"):
+        return _read_gains(snapshot, "", [])
+    raise rgio.UnknownFiletype(ext)
+
+
 class AlbumIdentifier(object):
-    identifier: str
+    identifier: str | None
     albumgain: GainData | None
     trackgain: GainData | None
 
     def __init__(
         self,
         valid: bool,
-        identifier: str,
+        identifier: str | None,
         albumgain: GainData | None,
         trackgain: GainData | None,
     ) -> None:
@@ -42,18 +154,12 @@ class AlbumIdentifier(object):
         self.trackgain = trackgain
 
     @classmethod
-    def from_file(klass: typing.Type[TM], ff: str) -> TM:
-        from_disk_metadata = None
-        try:
-            from_disk_metadata = File(ff)
-        except Exception as exc:
-            _LOGGER.error("Error identifying %s: %s:", ff, exc)
-            return klass(False, "", None, None)
-        if from_disk_metadata is None:
+    def from_snapshot(klass: typing.Type[TM], ff: str, snapshot: TagSnapshot) -> TM:
+        if not snapshot.valid:
             return klass(False, "", None, None)
-        album_id = get_album_id(from_disk_metadata)
+        album_id = get_album_id(ff, snapshot)
         try:
-            trackgain, albumgain = _MAPPER.read_gain(ff)
+            trackgain, albumgain = read_gain(ff, snapshot)
         except Exception as exc:
             # The file is not supported.  We return invalid.
             _LOGGER.error("Cannot read ReplayGain from %s: %s>", ff, exc)
@@ -112,6 +218,7 @@ def main() -> None:
         help="how many replaygain processes to run at once (default %(default)s)",
         default=os.cpu_count(),
     )
+    add_cache_arguments(p)
     p.add_argument(
         "-v",
         "--verbose",
@@ -124,21 +231,38 @@ def main() -> None:
         main_module_name=__name__, level=logging.DEBUG if args.verbose else logging.INFO
     )
 
-    allfiles = all_files(args.FILE, recursive=args.recursive)
+    # In quick mode most files are not examined, so do not stat them here.
+    entries = list(
+        walk_files(
+            args.FILE, recursive=args.recursive, want_stat=not args.quick, jobs=args.jobs
+        )
+    )
+    allfiles = [e.path for e in entries]
+    statuses = {e.path: e.stat for e in entries if e.stat is not None}
 
-    with OnDiskMetadataCache(
-        "doreplaygain.pickle",
-        CACHE_VERSION,
-        lambda: FileMetadataCache(AlbumIdentifier.from_file),
-    ) as tags:
-        tags.update_metadata_for(allfiles)
+    cache = tag_snapshot_cache()
+    with report_stats(args, cache.stats), cache as snapshots:
+        snapshots.update_metadata_for(
+            allfiles,
+            jobs=args.jobs,
+            trust_directory_mtimes=args.quick,
+            statuses=statuses,
+        )
+        evicted = snapshots.evict_missing(args.FILE, allfiles)
+        if evicted:
+            _LOGGER.debug("Evicted %s cache entries of files now gone", evicted)
 
-        album_files: dict[str, list[str]] = collections.defaultdict(list)
+        tags: dict[str, AlbumIdentifier] = {}
+        album_files: dict[str | None, list[str]] = collections.defaultdict(list)
 
         for f in allfiles:
-            id_ = tags.get(f)
-            if not id_ or not id_.valid:
+            snapshot = snapshots.get(f)
+            if not snapshot:
+                continue
+            id_ = AlbumIdentifier.from_snapshot(f, snapshot)
+            if not id_.valid:
                 continue
+            tags[f] = id_
             album_files[id_.identifier].append(f)
 
         ret = 0
@@ -244,7 +368,7 @@ def main() -> None:
                 batch = future_to_result[future]
                 ret = future.result()
                 if ret == 0:
-                    tags.update_metadata_for(batch)
+                    snapshots.update_metadata_for(batch)
                 else:
                     _LOGGER.error("Batch %s failed", batch)
                     for future in future_to_result:
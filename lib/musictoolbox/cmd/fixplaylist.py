@@ -6,6 +6,8 @@ import sys
 import typing
 
 from difflib import SequenceMatcher as SM
+from musictoolbox import m3u
+from musictoolbox.files import walk_files
 from musictoolbox.logging import basicConfig
 
 TOKENIZER = re.compile("[^0-9a-zA-Z]+")
@@ -22,15 +24,15 @@ def scan(
     filename_to_fullpath: dict[str, list[str]] = collections.defaultdict(list)
     filename_basedir_to_fullpath: dict[str, list[str]] = collections.defaultdict(list)
 
-    for base, dirs, files in os.walk(tree_path):
-        for fn in files:
-            name_without_ext, ext = os.path.splitext(fn)
-            if ext in [".mood", ".nfo"]:
-                continue
-            fullpath = os.path.join(base, fn)
-            filename_to_fullpath[name_without_ext].append(fullpath)
-            filename_basedir = os.path.join(os.path.basename(base), name_without_ext)
-            filename_basedir_to_fullpath[filename_basedir].append(fullpath)
+    for entry in walk_files([tree_path]):
+        fullpath = entry.path
+        base, fn = os.path.split(fullpath)
+        name_without_ext, ext = os.path.splitext(fn)
+        if ext in [".mood", ".nfo"]:
+            continue
+        filename_to_fullpath[name_without_ext].append(fullpath)
+        filename_basedir = os.path.join(os.path.basename(base), name_without_ext)
+        filename_basedir_to_fullpath[filename_basedir].append(fullpath)
 
     filename_tokenized_to_fullpath = {
         TOKENIZER.sub(" ", k).lower(): v for k, v in filename_to_fullpath.items()
@@ -136,14 +138,15 @@ def main() -> None:
     for fn in sys.argv[2:]:
         didchange = False
 
-        f = open(fn, "r")
-        d = os.path.dirname(os.path.realpath(fn))
-        lines = [x.strip() for x in f.readlines() if x.strip()]
+        playlist = m3u.read(fn)
+        d = playlist.directory
 
         newlines = []
-        for line in lines:
-            fullpath = os.path.abspath(os.path.join(d, line))
-            if line.startswith("#"):
+        for entry in playlist.lines:
+            line, fullpath = entry.text, entry.path
+            if not line:
+                continue
+            if fullpath is None:
                 newlines.append(line)
             elif not os.path.exists(fullpath):
                 if fullpath in replacements:
@@ -191,9 +194,6 @@ def main() -> None:
                 newlines.append(line)
 
         if didchange:
-            f = open(fn, "w")
-            f.write("\n".join(newlines))
-            f.flush()
-            f.close()
+            m3u.write(fn, "\n".join(newlines), playlist.encoding)
 
     sys.exit(0)
@@ -1,13 +1,11 @@
 import argparse
-import collections
-import errno
 import fnmatch
 import os
-import stat
 import sys
-import tempfile
 import textwrap
-import urllib.parse
+
+from musictoolbox import m3u
+from musictoolbox.files import walk_files
 
 
 def get_parser() -> argparse.ArgumentParser:
@@ -69,112 +67,35 @@ unlistable directories will be skipped without displaying any errors.
     return parser
 
 
-def get_umask() -> int:
-    umask = os.umask(0o77)
-    os.umask(umask)
-    return umask
-
-
-class OutputWriter(object):
-    """Writes to a regular file or a special file, varying its behavior
-    depending on the type of file."""
-
-    def __init__(self, filename: str) -> None:
-        self.name = filename
-
-        try:
-            mode = os.stat(filename).st_mode
-            if stat.S_ISBLK(mode) or stat.S_ISCHR(mode) or stat.S_ISFIFO(mode):
-                self.fobject = open(filename, "w")
-        except OSError:
-            pass
-
-        if not self.fobject:
-            directory, prefix = os.path.split(filename)
-            if not directory:
-                directory = os.path.curdir
-            if not prefix:
-                raise OSError(
-                    errno.EISDIR,
-                    os.strerror(errno.EISDIR) + ": " + repr(filename),
-                )
-            t = tempfile.NamedTemporaryFile(
-                mode="w+",
-                prefix=prefix,
-                dir=directory,
-                delete=False,
-            )
-            t.close()
-            self.fobject = open(t.name, "w")
-
-    def write(self, text: str) -> None:
-        self.fobject.write(text)
-
-    def flush(self) -> None:
-        self.fobject.flush()
-
-    def close(self) -> None:
-        try:
-            if self.name != self.fobject.name:
-                try:
-                    oldmode = os.stat(self.name).st_mode
-                    os.chmod(self.fobject.name, oldmode)
-                except OSError as e:
-                    if e.errno != errno.ENOENT:
-                        raise
-                    umask = get_umask()
-                    newmode = ~umask & 0o666
-                    os.chmod(self.fobject.name, newmode)
-                os.rename(self.fobject.name, self.name)
-        finally:
-            try:
-                self.fobject.close()
-            except OSError as e:
-                if e.errno != errno.ENOENT:
-                    raise
-
-
 def main() -> None:
     parser = get_parser()
     args = parser.parse_args()
     playlist = args.playlist
     excludes = args.exclude
     includes = args.include
-    playlistdir = os.path.dirname(playlist)
-    playlistfile = OutputWriter(playlist)
-    playlistcontents = collections.OrderedDict()
-    for path in args.paths:
-        for basepath, dirs, files in os.walk(path, topdown=True):
-            for d in dirs[:]:
-                # Do not walk any directories that match exclusion patterns.
-                if excludes and any(fnmatch.fnmatch(d, pat) for pat in excludes):
-                    dirs.remove(d)
-            for filename in files:
-                # If includes were specified, do not include files that do
-                # not match the inclusion patterns.
-                if includes and not any(
-                    fnmatch.fnmatch(filename, pat) for pat in includes
-                ):
-                    continue
-                # Do not include any files that match exclusion patterns.
-                if excludes and any(fnmatch.fnmatch(filename, pat) for pat in excludes):
-                    continue
-                joined = os.path.join(basepath, filename)
-                if not os.path.isfile(joined):
-                    continue
-                if any(ord(x) < 32 for x in joined):
-                    joined = os.path.abspath(joined)
-                    p = "file://" + "".join(
-                        x if x >= 32 and x < 128 else urllib.parse.quote(x)
-                        for x in joined
-                    )
-                else:
-                    p = os.path.relpath(joined, playlistdir)
-                if p in playlistcontents:
-                    continue
-                playlistfile.write(p + "\n")
-                playlistcontents[p] = True
-    playlistfile.flush()
-    playlistfile.close()
+    playlistdir = os.path.dirname(playlist) or os.curdir
+    playlistcontents: dict[str, bool] = {}
+
+    def excluded(path: str) -> bool:
+        name = os.path.basename(path)
+        return bool(excludes) and any(fnmatch.fnmatch(name, pat) for pat in excludes)
+
+    # Do not walk any directories that match exclusion patterns.  Paths that
+    # are not directories have never been listed.
+    for entry in walk_files(
+        [path for path in args.paths if os.path.isdir(path)], skip_directory=excluded
+    ):
+        filename = os.path.basename(entry.path)
+        # If includes were specified, do not include files that do
+        # not match the inclusion patterns.
+        if includes and not any(fnmatch.fnmatch(filename, pat) for pat in includes):
+            continue
+        # Do not include any files that match exclusion patterns.
+        if excluded(filename):
+            continue
+        if not entry.is_file:
+            continue
+        playlistcontents[m3u.entry(entry.path, playlistdir)] = True
+    m3u.write(playlist, "".join(p + "\n" for p in playlistcontents))
 
     sys.exit(0)
@@ -7,8 +7,13 @@ import os
 import sys
 import typing
 from musictoolbox.logging import basicConfig
-from musictoolbox.cache import FileMetadataCache, OnDiskMetadataCache
-from musictoolbox.files import all_files
+from musictoolbox.cache import (
+    TagSnapshot,
+    add_cache_arguments,
+    report_stats,
+    tag_snapshot_cache,
+)
+from musictoolbox.files import walk_files
 
 from mutagen._file import File
 
@@ -17,7 +22,6 @@ _LOGGER = logging.getLogger(__name__)
 KEY_ALBUM = "album"
 KEY_ALBUMARTIST = "albumartist"
 KEY_ARTIST = "artist"
-CACHE_VERSION = 3
 
 TM = typing.TypeVar("TM", bound="TrackMetadata")
 
@@ -30,9 +34,9 @@ class TrackMetadata(object):
     def __init__(
         self,
         valid: bool,
-        album: list[str],
-        artist: list[str],
-        albumartist: list[str],
+        album: list[str] | None,
+        artist: list[str] | None,
+        albumartist: list[str] | None,
     ) -> None:
         self.valid = valid
         self.album = album
@@ -40,19 +44,14 @@ class TrackMetadata(object):
         self.artist = artist
 
     @classmethod
-    def from_file(klass: typing.Type[TM], ff: str) -> TM:
-        try:
-            from_disk_metadata = File(ff, easy=True)
-        except Exception as exc:
-            _LOGGER.error("Error identifying %s: %s:", ff, exc)
-            from_disk_metadata = None
-        if from_disk_metadata is None:
+    def from_snapshot(klass: typing.Type[TM], snapshot: TagSnapshot) -> TM:
+        if not snapshot.valid:
             return klass(False, [], [], [])
         return klass(
             True,
-            album=from_disk_metadata.get(KEY_ALBUM),
-            artist=from_disk_metadata.get(KEY_ARTIST),
-            albumartist=from_disk_metadata.get(KEY_ALBUMARTIST),
+            album=snapshot.get(KEY_ALBUM),
+            artist=snapshot.get(KEY_ARTIST),
+            albumartist=snapshot.get(KEY_ALBUMARTIST),
         )
 
 
@@ -75,6 +74,7 @@ def main() -> None:
         " from the most popular artist among the album",
         default="Various artists",
     )
+    add_cache_arguments(p)
     p.add_argument(
         "-v",
         "--verbose",
@@ -88,14 +88,26 @@ def main() -> None:
         level=(logging.DEBUG if args.verbose else logging.INFO),
     )
 
-    allfiles = all_files(args.FILE, recursive=True)
-
-    with OnDiskMetadataCache(
-        "scanalbumartists.pickle",
-        CACHE_VERSION,
-        lambda: FileMetadataCache(TrackMetadata.from_file),
-    ) as tags:
-        tags.update_metadata_for(allfiles)
+    # In quick mode most files are not examined, so do not stat them here.
+    entries = list(
+        walk_files(
+            args.FILE, recursive=True, want_stat=not args.quick, jobs=args.jobs
+        )
+    )
+    allfiles = [e.path for e in entries]
+    statuses = {e.path: e.stat for e in entries if e.stat is not None}
+
+    cache = tag_snapshot_cache()
+    with report_stats(args, cache.stats), cache as snapshots:
+        snapshots.update_metadata_for(
+            allfiles,
+            jobs=args.jobs,
+            trust_directory_mtimes=args.quick,
+            statuses=statuses,
+        )
+        evicted = snapshots.evict_missing(args.FILE, allfiles)
+        if evicted:
+            _LOGGER.debug("Evicted %s cache entries of files now gone", evicted)
 
         album_tree: dict[
             str, dict[str | None, dict[str | None, dict[str | None, list[str]]]]
@@ -106,9 +118,10 @@ def main() -> None:
         )
 
         for fn in allfiles:
-            tag = tags.get(fn)
-            if not tag:
+            snapshot = snapshots.get(fn)
+            if not snapshot:
                 continue
+            tag = TrackMetadata.from_snapshot(snapshot)
 
             folder = os.path.dirname(fn)
             album = tag.album[0] if tag.album else None
@@ -188,7 +201,7 @@ def main() -> None:
                             savetag = File(f, easy=True)
                             savetag[KEY_ALBUMARTIST] = [va_text]
                             savetag.save()
-                        tags.update_metadata_for(files_to_fix)
+                        snapshots.update_metadata_for(files_to_fix)
                         dumpfiles("Files fixed")
                     else:
                         dumpfiles("Files to fix")
@@ -0,0 +1,100 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+from musictoolbox.cache import tag_snapshot_cache
+from musictoolbox.files import walk_files
+from musictoolbox.inotify import TreeWatcher
+from musictoolbox.logging import basicConfig
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def refresh(changed: set[str], removed: set[str], jobs: int) -> None:
+    """Update the cache entries of changed files and evict those of removed ones."""
+    entries = [
+        e for e in walk_files(sorted(changed), want_stat=True, jobs=jobs) if e.is_file
+    ]
+    files = [e.path for e in entries]
+    statuses = {e.path: e.stat for e in entries if e.stat is not None}
+    with tag_snapshot_cache() as snapshots:
+        snapshots.update_metadata_for(files, jobs=jobs, statuses=statuses)
+        evicted = snapshots.evict_missing(sorted(removed), files)
+    _LOGGER.info(
+        "Refreshed %s files, evicted %s cache entries of files now gone",
+        len(files),
+        evicted,
+    )
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(
+        description="Keep the metadata cache of doreplaygain and scanalbumartists"
+        " warm, refreshing it as files in the watched folders change.",
+        epilog="This program scans the folders once, then runs until interrupted,"
+        " watching the folders for changes.  Runs of doreplaygain and"
+        " scanalbumartists on those folders will then find the metadata of every"
+        " file already cached.",
+    )
+    p.add_argument("FOLDER", type=str, nargs="+", help="folder to watch")
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="how many processes to use to read metadata from files that are"
+        " not yet cached (default %(default)s)",
+        default=os.cpu_count() or 1,
+    )
+    p.add_argument(
+        "-s",
+        "--settle",
+        type=float,
+        help="how many seconds to wait for changes to stop before refreshing"
+        " the cache (default %(default)s)",
+        default=2.0,
+    )
+    p.add_argument(
+        "-m",
+        "--max-delay",
+        type=float,
+        help="refresh the cache at least this often, in seconds, while changes"
+        " keep coming (default %(default)s)",
+        default=60.0,
+    )
+    p.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="enable verbose operation",
+    )
+    args = p.parse_args()
+    basicConfig(
+        main_module_name=__name__, level=logging.DEBUG if args.verbose else logging.INFO
+    )
+
+    for folder in args.FOLDER:
+        if not os.path.isdir(folder):
+            p.error("%s is not a folder" % folder)
+
+    try:
+        # Watch before the first scan, so changes made during it are seen.
+        with TreeWatcher(args.FOLDER) as watcher:
+            refresh(set(watcher.roots), set(watcher.roots), args.jobs)
+            pending_since = 0.0
+            while True:
+                if not watcher.pending():
+                    watcher.read(None)
+                    pending_since = time.monotonic()
+                    continue
+                got_events = watcher.read(args.settle)
+                if got_events and time.monotonic() - pending_since < args.max_delay:
+                    continue
+                changed, removed = watcher.take()
+                refresh(changed, removed, args.jobs)
+    except KeyboardInterrupt:
+        pass
+
+    sys.exit(0)
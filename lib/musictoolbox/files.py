@@ -1,4 +1,8 @@
+import collections.abc
+import concurrent.futures
+import hashlib
 import os
+import stat
 import typing
 import contextlib
 from pathlib import Path
@@ -15,17 +19,12 @@ def Absolutize(p: typing.Union[Path, str]) -> AbsolutePath:
     return pp
 
 
-_dir_lock = Lock()
-
-
 def ensure_directories_exist(dirs: typing.List[str]) -> None:
-    global _dir_lock
-    with _dir_lock:
-        for t in dirs:
-            if not t:
-                continue
-            if not os.path.exists(t):
-                os.makedirs(t)
+    for t in dirs:
+        if not t:
+            continue
+        if not os.path.exists(t):
+            os.makedirs(t, exist_ok=True)
 
 
 def ensure_files_gone(files: typing.List[str]) -> None:
@@ -51,30 +50,255 @@ def remover() -> typing.Generator[typing.List[str], None, None]:
         ensure_files_gone(files)
 
 
+def _existing_directory(directory: str) -> str:
+    existing = os.path.abspath(directory)
+    while not os.path.isdir(existing):
+        existing = os.path.dirname(existing)
+    return existing
+
+
 def shorten_to_name_max(directory: str, name: str, strip_extra_chars: int) -> str:
-    pathconf_directory = os.path.abspath(directory)
-    while not os.path.isdir(pathconf_directory):
-        pathconf_directory = os.path.dirname(pathconf_directory)
-    maxfilenamelen = os.pathconf(pathconf_directory, "PC_NAME_MAX")
+    maxfilenamelen = os.pathconf(_existing_directory(directory), "PC_NAME_MAX")
     name = name[: maxfilenamelen - strip_extra_chars]
     return name
 
 
+class FilesystemMemo(object):
+    """
+    Remembers, for the duration of one run, which directories exist and how
+    long file names may be in them.
+
+    ensure_directories_exist() and shorten_to_name_max() do the same as the
+    functions of the same name, but examine each directory only once, and
+    look up the file name limit only once per file system.  Threads only
+    wait for one another when creating the very same directory.  Directories
+    removed by others after they were created are not created again, so
+    instances should not outlive the operation they serve.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__created: typing.Set[str] = set()
+        self.__creating: typing.Dict[str, Lock] = {}
+        self.__name_max: typing.Dict[str, int] = {}
+        self.__name_max_by_device: typing.Dict[int, int] = {}
+
+    def ensure_directories_exist(self, dirs: typing.List[str]) -> None:
+        for t in dirs:
+            if not t or t in self.__created:
+                continue
+            with self.__lock:
+                creating = self.__creating.setdefault(t, Lock())
+            with creating:
+                if t in self.__created:
+                    continue
+                if not os.path.exists(t):
+                    os.makedirs(t, exist_ok=True)
+                self.__created.add(t)
+
+    def name_max(self, directory: str) -> int:
+        """Return the longest file name allowed in the directory."""
+        try:
+            return self.__name_max[directory]
+        except KeyError:
+            pass
+        existing = _existing_directory(directory)
+        device = os.stat(existing).st_dev
+        try:
+            name_max = self.__name_max_by_device[device]
+        except KeyError:
+            name_max = os.pathconf(existing, "PC_NAME_MAX")
+            self.__name_max_by_device[device] = name_max
+        if existing == os.path.abspath(directory):
+            # Do not remember the limit of directories that do not exist
+            # yet; they may end up on another file system.
+            self.__name_max[directory] = name_max
+        return name_max
+
+    def shorten_to_name_max(
+        self, directory: str, name: str, strip_extra_chars: int
+    ) -> str:
+        return name[: self.name_max(directory) - strip_extra_chars]
+
+
+class FileEntry(typing.NamedTuple):
+    """A file found by walk_files()."""
+
+    path: str
+    # Whether the path is a regular file (following symbolic links), as
+    # os.path.isfile() would say.
+    is_file: bool
+    # The status of the file (following symbolic links), if requested and
+    # available.
+    stat: os.stat_result | None
+
+
+def _stat_entry(entry: os.DirEntry[str]) -> os.stat_result | None:
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
+
+def _is_file(entry: os.DirEntry[str]) -> bool:
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def _file_entry(path: str, want_stat: bool) -> FileEntry:
+    try:
+        st: os.stat_result | None = os.stat(path)
+    except OSError:
+        st = None
+    return FileEntry(
+        path,
+        st is not None and stat.S_ISREG(st.st_mode),
+        st if want_stat else None,
+    )
+
+
+def walk_files(
+    paths: collections.abc.Iterable[str],
+    recursive: bool = True,
+    want_stat: bool = False,
+    jobs: int = 1,
+    skip_directory: collections.abc.Callable[[str], bool] | None = None,
+) -> collections.abc.Iterator[FileEntry]:
+    """
+    Yield the files in the paths, as they are found.
+
+    Paths that are directories are listed (recursively, if recursive is
+    True), while other paths are yielded as they are.  Like os.walk(),
+    directories are listed top-down, the files of a directory are yielded
+    before those of its subdirectories, symbolic links to directories are
+    not followed, and directories that cannot be listed are skipped.  If
+    skip_directory is passed, subdirectories for whose path it returns
+    True are not listed.
+
+    Directories are listed with os.scandir(), so the type of each entry is
+    known without examining it on most file systems.  If want_stat is True,
+    every file yielded carries its status; with jobs greater than one, the
+    files of each directory are examined by that many threads at once,
+    which is much faster on network file systems.
+    """
+    with contextlib.ExitStack() as stack:
+        executor = (
+            stack.enter_context(concurrent.futures.ThreadPoolExecutor(jobs))
+            if want_stat and jobs > 1
+            else None
+        )
+        for path in paths:
+            if not os.path.isdir(path):
+                yield _file_entry(path, want_stat)
+                continue
+            pending = [path]
+            while pending:
+                directory = pending.pop()
+                try:
+                    with os.scandir(directory) as it:
+                        entries = list(it)
+                except OSError:
+                    continue
+                files = []
+                subdirectories = []
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        files.append(entry)
+                    elif recursive and not entry.is_symlink():
+                        if skip_directory is None or not skip_directory(entry.path):
+                            subdirectories.append(entry.path)
+                stats: collections.abc.Iterable[os.stat_result | None]
+                if not want_stat:
+                    stats = (None for _ in files)
+                elif executor is not None and len(files) > 1:
+                    stats = executor.map(_stat_entry, files)
+                else:
+                    stats = (_stat_entry(entry) for entry in files)
+                for entry, st in zip(files, stats):
+                    yield FileEntry(
+                        entry.path,
+                        stat.S_ISREG(st.st_mode) if st is not None else _is_file(entry),
+                        st,
+                    )
+                pending.extend(reversed(subdirectories))
+
+
+_P = typing.TypeVar("_P", bound=typing.Union[str, "os.PathLike[str]"])
+
+
+_R = typing.TypeVar("_R")
+
+
+def _examine_all(
+    examine: collections.abc.Callable[[_P], _R | None],
+    paths: collections.abc.Iterable[_P],
+    jobs: int,
+) -> dict[_P, _R]:
+    paths = list(paths)
+    if jobs > 1 and len(paths) > 1:
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            results = list(executor.map(examine, paths))
+    else:
+        results = [examine(path) for path in paths]
+    return {path: r for path, r in zip(paths, results) if r is not None}
+
+
+def stat_files(
+    paths: collections.abc.Iterable[_P], jobs: int = 1
+) -> dict[_P, os.stat_result]:
+    """
+    Return the status of each of the paths (following symbolic links),
+    examining up to jobs of them at once.  Paths that cannot be examined
+    are left out.
+    """
+
+    def examine(path: _P) -> os.stat_result | None:
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+    return _examine_all(examine, paths, jobs)
+
+
+def file_hash(f: typing.BinaryIO) -> str:
+    """Return a hash of the contents of an open file, read from its start."""
+    h = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    while True:
+        chunk = f.read(1048576)
+        if not chunk:
+            break
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def content_hash(path: typing.Union[str, "os.PathLike[str]"]) -> str:
+    """Return a hash of the contents of a file."""
+    with open(path, "rb") as f:
+        return file_hash(f)
+
+
+def hash_files(paths: collections.abc.Iterable[_P], jobs: int = 1) -> dict[_P, str]:
+    """
+    Return the content_hash() of each of the paths, reading up to jobs of
+    them at once.  Paths that cannot be read are left out.
+    """
+
+    def examine(path: _P) -> str | None:
+        try:
+            return content_hash(path)
+        except OSError:
+            return None
+
+    return _examine_all(examine, paths, jobs)
+
+
 def all_files(paths: list[str], recursive: bool = True) -> list[str]:
-    allfiles: list[str] = []
-    for f in paths:
-        if os.path.isdir(f):
-            if recursive:
-                files = [
-                    os.path.join(root, x) for root, _, fs in os.walk(f) for x in fs
-                ]
-            else:
-                files = [
-                    os.path.join(f, x)
-                    for x in os.listdir(f)
-                    if not os.path.isdir(os.path.join(f, x))
-                ]
-        else:
-            files = [f]
-        allfiles.extend(files)
-    return allfiles
+    return [entry.path for entry in walk_files(paths, recursive=recursive)]
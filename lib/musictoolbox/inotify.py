@@ -0,0 +1,240 @@
+"""
+Minimal access to the Linux inotify API, through the C library.
+"""
+
+import ctypes
+import errno
+import logging
+import os
+import select
+import struct
+import time
+import typing
+
+
+_LOGGER = logging.getLogger(__name__)
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.inotify_init1.argtypes = [ctypes.c_int]
+_libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+_libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+def _check(result: int, path: str | None = None) -> int:
+    if result < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+    return result
+
+
+class Event(typing.NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify(object):
+    """
+    An inotify instance.
+
+    Use it as a context manager, or call close() when done with it.
+    """
+
+    def __init__(self) -> None:
+        self.fd = _check(_libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch a path for the events in mask, and return the watch descriptor."""
+        return _check(
+            _libc.inotify_add_watch(self.fd, os.fsencode(path), mask), path
+        )
+
+    def rm_watch(self, wd: int) -> None:
+        """Stop watching a watch descriptor."""
+        _check(_libc.inotify_rm_watch(self.fd, wd))
+
+    def read(self, timeout: float | None = None) -> list[Event]:
+        """
+        Return the pending events, waiting up to timeout seconds (forever if
+        timeout is None) for some to arrive.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *unused_args: typing.Any) -> None:
+        self.close()
+
+
+# Events that tell us a file may have new contents or a new modification time.
+_CHANGED = IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_MOVED_TO
+# Events that tell us a file or directory is gone.
+_REMOVED = IN_DELETE | IN_MOVED_FROM
+
+WATCH_MASK = _CHANGED | _REMOVED | IN_ONLYDIR
+
+
+class TreeWatcher(object):
+    """
+    Watches directory trees for files that change or disappear.
+
+    Every directory beneath the roots is watched, including directories
+    created or moved into the trees later.  read() accumulates the paths
+    of changed and removed files until take() returns and forgets them.
+    Changed paths may include directories, when a whole directory appears
+    at once; callers should examine all the files beneath those.  If the
+    kernel drops events, the roots themselves are reported as both changed
+    and removed, so callers examine everything again.
+
+    If the system limit of watches is reached, no more directories are
+    watched, and the roots are reported that way every poll_interval
+    seconds instead.
+    """
+
+    # How often, in seconds, to report everything as changed once not all
+    # directories can be watched.
+    poll_interval = 600.0
+
+    def __init__(self, roots: list[str]) -> None:
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.changed: set[str] = set()
+        self.removed: set[str] = set()
+        # Whether every directory beneath the roots is watched.
+        self.complete = True
+        self.__next_poll = 0.0
+        self.__inotify = Inotify()
+        self.__paths: dict[int, str] = {}
+        for root in self.roots:
+            self.__watch_tree(root)
+
+    def __watch_tree(self, root: str) -> None:
+        if not self.complete:
+            return
+        for dirpath, _, _ in os.walk(root):
+            try:
+                wd = self.__inotify.add_watch(dirpath, WATCH_MASK)
+            except OSError as exc:
+                if exc.errno == errno.ENOSPC:
+                    _LOGGER.error(
+                        "Cannot watch %s and further folders, as the limit of"
+                        " inotify watches was reached; raise it with sysctl"
+                        " fs.inotify.max_user_watches.  Until then, everything"
+                        " will be rescanned every %s seconds.",
+                        dirpath,
+                        self.poll_interval,
+                    )
+                    self.complete = False
+                    self.__next_poll = time.monotonic() + self.poll_interval
+                    return
+                _LOGGER.error("Cannot watch %s: %s", dirpath, exc)
+                continue
+            self.__paths[wd] = dirpath
+
+    def __unwatch_tree(self, root: str) -> None:
+        prefix = os.path.join(root, "")
+        for wd, path in list(self.__paths.items()):
+            if path == root or path.startswith(prefix):
+                del self.__paths[wd]
+                try:
+                    self.__inotify.rm_watch(wd)
+                except OSError:
+                    # The kernel removed the watch already.
+                    pass
+
+    def pending(self) -> bool:
+        """Return whether there are changes not yet taken."""
+        return bool(self.changed or self.removed)
+
+    def read(self, timeout: float | None = None) -> bool:
+        """
+        Wait up to timeout seconds (forever if None) for events, and record
+        the changes they report.  Returns whether any event was read.
+        """
+        if not self.complete:
+            if time.monotonic() >= self.__next_poll:
+                _LOGGER.info("Rescanning everything, as not all folders are watched")
+                self.changed.update(self.roots)
+                self.removed.update(self.roots)
+                self.__next_poll = time.monotonic() + self.poll_interval
+                return True
+            wait = self.__next_poll - time.monotonic()
+            timeout = wait if timeout is None else min(timeout, wait)
+        events = self.__inotify.read(timeout)
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                _LOGGER.warning("Too many changes at once, rescanning everything")
+                self.changed.update(self.roots)
+                self.removed.update(self.roots)
+                continue
+            directory = self.__paths.get(event.wd)
+            if directory is None:
+                continue
+            if event.mask & IN_IGNORED:
+                del self.__paths[event.wd]
+                continue
+            path = os.path.join(directory, event.name)
+            if _LOGGER.level <= logging.DEBUG:
+                _LOGGER.debug("Event %#x on %s", event.mask, path)
+            if event.mask & _REMOVED:
+                self.changed.discard(path)
+                self.removed.add(path)
+                if event.mask & IN_ISDIR:
+                    self.__unwatch_tree(path)
+            elif event.mask & IN_ISDIR:
+                if event.mask & (IN_CREATE | IN_MOVED_TO):
+                    self.changed.add(path)
+                    self.__watch_tree(path)
+            elif event.mask & _CHANGED:
+                self.changed.add(path)
+        return bool(events)
+
+    def take(self) -> tuple[set[str], set[str]]:
+        """Return the changed and the removed paths, and forget them."""
+        changed, removed = self.changed, self.removed
+        self.changed, self.removed = set(), set()
+        return changed, removed
+
+    def close(self) -> None:
+        self.__inotify.close()
+
+    def __enter__(self) -> "TreeWatcher":
+        return self
+
+    def __exit__(self, *unused_args: typing.Any) -> None:
+        self.close()
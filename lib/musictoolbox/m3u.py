@@ -0,0 +1,191 @@
+"""
+Reading and writing of M3U and M3U8 playlists.
+
+Playlists are read in one go and split into lines, each of which is kept
+exactly as it was read, so that tools rewriting a playlist can preserve
+whatever they do not understand.  Entries (lines that are neither blank
+nor comments) carry the absolute, normalised path of the file they name,
+resolved against the real directory of the playlist, and the #EXTINF
+line right before them, if any.
+"""
+
+import functools
+import io
+import logging
+import os
+import stat
+import tempfile
+import typing
+import urllib.parse
+
+
+_LOGGER = logging.getLogger(__name__)
+
+EXTM3U = "#EXTM3U"
+EXTINF = "#EXTINF:"
+
+
+def _read_umask() -> int:
+    umask = os.umask(0o22)
+    os.umask(umask)
+    return umask
+
+
+# The umask of the process, which can only be read by setting it, so it is
+# read once, rather than while other threads may be creating files.
+_UMASK = _read_umask()
+
+
+class Line(typing.NamedTuple):
+    """A line of a playlist."""
+
+    # The line as read, with its line break (if any) translated to \n.
+    raw: str
+    # The line without surrounding whitespace.
+    text: str
+    # For entries, the absolute path of the file they name; else None.
+    path: str | None
+    # For entries, the text of the #EXTINF line before them; else None.
+    info: str | None = None
+
+
+class Playlist(typing.NamedTuple):
+    """A playlist read by read()."""
+
+    path: str
+    # The directory entries are relative to: that of the real playlist file,
+    # once symbolic links to it are followed.
+    directory: str
+    # The encoding the playlist was read with, which write() should use too.
+    encoding: str
+    lines: list[Line]
+
+    @property
+    def paths(self) -> list[str]:
+        return [line.path for line in self.lines if line.path is not None]
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_directory(directory: str, subdirectory: str) -> str:
+    return os.path.normpath(os.path.join(directory, subdirectory))
+
+
+def resolve(directory: str, entry: str) -> str:
+    """
+    Return the absolute path an entry of a playlist in directory names.
+
+    The directory must be absolute.  Like os.path.abspath(), the result is
+    normalised, but the directories of entries are normalised only once
+    for all the entries they hold.
+    """
+    if entry.startswith("file://"):
+        entry = urllib.parse.unquote(entry[7:])
+    subdirectory, name = os.path.split(entry)
+    if name in ("", os.curdir, os.pardir):
+        return os.path.normpath(os.path.join(directory, entry))
+    return os.path.join(_resolve_directory(directory, subdirectory), name)
+
+
+def entry(path: str, directory: str | None = None) -> str:
+    """
+    Return the playlist entry naming path, relative to directory if one is
+    passed.  Paths with control characters cannot be written as they are,
+    so they are written as file:// URLs instead.
+    """
+    if any(ord(x) < 32 for x in path):
+        return "file://" + "".join(
+            x if 32 <= ord(x) < 128 else urllib.parse.quote(x)
+            for x in os.path.abspath(path)
+        )
+    if directory is None:
+        return os.path.abspath(path)
+    return os.path.relpath(path, directory)
+
+
+def decode(data: bytes, path: str) -> tuple[str, str]:
+    """
+    Decode the contents of a playlist, and return them with the encoding
+    used.  Playlists are UTF-8, but M3U playlists that are not UTF-8 are
+    taken to be Latin-1.
+    """
+    encoding = "utf-8-sig" if data.startswith(b"\xef\xbb\xbf") else "utf-8"
+    try:
+        return data.decode(encoding), encoding
+    except UnicodeDecodeError:
+        if os.path.splitext(path)[1].lower() != ".m3u":
+            raise
+    _LOGGER.warning("Playlist %s is not UTF-8, reading it as Latin-1", path)
+    return data.decode("latin-1"), "latin-1"
+
+
+def parse(text: str, directory: str) -> typing.Iterator[Line]:
+    """Yield the lines of a playlist whose entries are relative to directory."""
+    info = None
+    for raw in io.StringIO(text, newline=None):
+        stripped = raw.strip()
+        if not stripped or stripped.startswith("#"):
+            if stripped.startswith(EXTINF):
+                info = stripped[len(EXTINF) :]
+            yield Line(raw, stripped, None)
+            continue
+        yield Line(raw, stripped, resolve(directory, stripped), info)
+        info = None
+
+
+def read(path: str) -> Playlist:
+    """Read a playlist, following symbolic links to it."""
+    realpath = os.path.realpath(path)
+    with open(realpath, "rb") as f:
+        text, encoding = decode(f.read(), realpath)
+    directory = os.path.dirname(realpath)
+    return Playlist(path, directory, encoding, list(parse(text, directory)))
+
+
+def differs(path: str, text: str, encoding: str = "utf-8") -> bool:
+    """Return whether the file at path does not hold exactly text."""
+    try:
+        with open(path, "rb") as f:
+            return f.read() != text.encode(encoding)
+    except FileNotFoundError:
+        return True
+
+
+def write(path: str, text: str, encoding: str = "utf-8") -> None:
+    """
+    Write text to a playlist at path, atomically: readers see either the
+    old playlist or the new one, never part of it.  The new playlist gets
+    the permissions of the old one, or the default ones if there was none.
+    Symbolic links are followed, and devices and named pipes are simply
+    written to.
+    """
+    data = text.encode(encoding)
+    try:
+        st: os.stat_result | None = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if st is not None and not stat.S_ISREG(st.st_mode):
+        with open(path, "wb") as f:
+            f.write(data)
+        return
+
+    directory, name = os.path.split(os.path.realpath(path))
+    with tempfile.NamedTemporaryFile(
+        prefix="." + name + ".", dir=directory, delete=False
+    ) as t:
+        try:
+            t.write(data)
+            t.flush()
+            mode = stat.S_IMODE(st.st_mode) if st is not None else ~_UMASK & 0o666
+            try:
+                os.fchmod(t.fileno(), mode)
+            except PermissionError:
+                # File systems without permissions, like VFAT, refuse this.
+                pass
+        except BaseException:
+            os.unlink(t.name)
+            raise
+    try:
+        os.replace(t.name, os.path.join(directory, name))
+    except BaseException:
+        os.unlink(t.name)
+        raise
@@ -5,6 +5,7 @@ Created on Aug 11, 2012
 """
 
 import collections
+import errno
 import logging
 import os
 import pathlib
@@ -33,6 +34,29 @@ def within(path: AbsolutePath, subpath: AbsolutePath) -> bool:
     return subpath.is_relative_to(path)
 
 
+class ExclusionIndex(object):
+    """
+    An index of directories, which tells whether a path is within any of
+    them in the time it takes to look up the path and its ancestors,
+    however many directories there are.
+    """
+
+    def __init__(self, roots: typing.Iterable[AbsolutePath]) -> None:
+        self.roots = set(r.as_posix() for r in roots)
+
+    def __contains__(self, path: AbsolutePath) -> bool:
+        if not self.roots:
+            return False
+        p = path.as_posix()
+        while True:
+            if p in self.roots:
+                return True
+            slash = p.rfind("/")
+            if slash <= 0:
+                return slash == 0 and "/" in self.roots
+            p = p[:slash]
+
+
 def delete_ignoring_notfound(f: pathlib.Path) -> None:
     try:
         os.unlink(f.as_posix())
@@ -40,10 +64,23 @@ def delete_ignoring_notfound(f: pathlib.Path) -> None:
         pass
 
 
+VFAT_ILLEGAL = str.maketrans(dict((c, "_") for c in '?<>\\:*|"^'))
+
+
+def vfatprotect_name(name: str, directory: bool = False) -> str:
+    """
+    Replace illegal characters in a VFAT file system path component, and,
+    if it names a directory, remove trailing dots and spaces.
+    """
+    name = name.translate(VFAT_ILLEGAL)
+    if directory:
+        name = name.rstrip(". ")
+    return name
+
+
 def vfatprotect(f: str) -> str:
     """Replace illegal characters in VFAT file system paths."""
-    for illegal in '?<>\\:*|"^':
-        f = f.replace(illegal, "_")
+    f = f.translate(VFAT_ILLEGAL)
     while "./" in f:
         f = f.replace("./", "/")
     while " /" in f:
@@ -61,36 +98,118 @@ def get_mptypes() -> typing.Dict[str, str]:
     return ret
 
 
+class MountTable(object):
+    """
+    The mount points of the system and their file system types, which
+    resolves the mount point of a path once per directory.
+
+    The mount points are taken not to change while the table is in use.
+    """
+
+    def __init__(self, mptypes: typing.Dict[str, str]) -> None:
+        self.mptypes = mptypes
+        self.resolved: typing.Dict[str, typing.Tuple[str, AbsolutePath]] = {}
+
+    def resolve_directory(self, directory: str) -> typing.Tuple[str, AbsolutePath]:
+        """Return the file system type and mount point of a directory."""
+        unresolved = []
+        d = directory
+        while d not in self.resolved:
+            if d in self.mptypes:
+                self.resolved[d] = (self.mptypes[d], AbsolutePath(pathlib.Path(d)))
+                break
+            unresolved.append(d)
+            parent = os.path.dirname(d)
+            if parent == d:
+                raise KeyError(d)
+            d = parent
+        for u in unresolved:
+            self.resolved[u] = self.resolved[d]
+        return self.resolved[d]
+
+    def resolve(self, p: AbsolutePath) -> typing.Tuple[str, AbsolutePath]:
+        """Return the file system type and mount point of a path."""
+        assert os.name != "nt"
+        return self.resolve_directory(os.path.dirname(p.as_posix()))
+
+
 def get_fstype(
     p: AbsolutePath, mptypes: typing.Dict[str, str]
 ) -> typing.Tuple[str, AbsolutePath]:
     """Return the file system type and mount point corresponding to a path."""
-    assert os.name != "nt"
-    for deepest_mountpoint in p.parents:
-        if deepest_mountpoint.as_posix() in mptypes:
-            break
-    return mptypes[deepest_mountpoint.as_posix()], deepest_mountpoint
+    return MountTable(mptypes).resolve(p)
+
+
+def posix_join(directory: str, name: str) -> str:
+    return directory + name if directory.endswith("/") else directory + "/" + name
 
 
 class FilesystemPathMapper(object):
+    """
+    Maps paths in VFAT and NTFS file systems to paths these can hold.
+
+    Illegal characters are replaced, trailing dots and spaces are removed
+    from directory names, and, as these file systems ignore case, paths
+    differing only in case are mapped to the first one seen, component by
+    component.  Directories are mapped once, however many files they have.
+    """
+
     def __init__(self, target_dir: AbsolutePath) -> None:  # @UnusedVariable
         self.mptypes = get_mptypes()
-        self.paths_seen: typing.Dict[AbsolutePath, AbsolutePath] = {}
+        # The first path seen, by the case-folded path.
+        self.paths_seen: typing.Dict[str, str] = {}
+        # Directories mapped, by their unmapped path, with their mapped
+        # path and its case-folded form.
+        self.directories: typing.Dict[str, typing.Tuple[str, str]] = {}
+
+    @property
+    def mptypes(self) -> typing.Dict[str, str]:
+        return self.mounts.mptypes
+
+    @mptypes.setter
+    def mptypes(self, mptypes: typing.Dict[str, str]) -> None:
+        self.mounts = MountTable(mptypes)
+        self.directories = {}
+
+    def map_directory(
+        self, directory: str, mountpoint: str
+    ) -> typing.Tuple[str, str]:
+        try:
+            return self.directories[directory]
+        except KeyError:
+            pass
+        if directory == mountpoint:
+            mapped = (directory, directory)
+        else:
+            parent, name = os.path.split(directory)
+            parent_mapped, parent_folded = self.map_directory(parent, mountpoint)
+            name = vfatprotect_name(name, directory=True)
+            if name:
+                folded = posix_join(parent_folded, name.lower())
+                seen = self.paths_seen.setdefault(
+                    folded, posix_join(parent_mapped, name)
+                )
+                mapped = (seen, folded)
+            else:
+                mapped = (parent_mapped, parent_folded)
+        self.directories[directory] = mapped
+        return mapped
 
     def map(self, path: AbsolutePath) -> AbsolutePath:
-        fstype, deepest_mountpoint = get_fstype(path, self.mptypes)
+        fstype, deepest_mountpoint = self.mounts.resolve(path)
         if fstype not in ("vfat", "ntfs"):
             return path
 
-        head, tail = deepest_mountpoint, path.relative_to(deepest_mountpoint)
-        tailstr = pathlib.Path(vfatprotect(tail.as_posix()))
-        tailstr_lower = pathlib.Path(tailstr.as_posix().lower())
-        normalized_path = Absolutize(head / tailstr)
-        normalized_path_lower = Absolutize(head / tailstr_lower)
-
-        if normalized_path_lower not in self.paths_seen:
-            self.paths_seen[normalized_path_lower] = normalized_path
-        return self.paths_seen[normalized_path_lower]
+        directory, name = os.path.split(path.as_posix())
+        mapped, folded = self.map_directory(directory, deepest_mountpoint.as_posix())
+        name = vfatprotect_name(name)
+        return AbsolutePath(
+            pathlib.Path(
+                self.paths_seen.setdefault(
+                    posix_join(folded, name.lower()), posix_join(mapped, name)
+                )
+            )
+        )
 
 
 class ForceVFATPathMapper(FilesystemPathMapper):
@@ -118,24 +237,78 @@ class SourceAlwaysNewer(object):
         return 1
 
 
+class SomeSourcesNewer(object):
+    """
+    Takes some source files as newer than their targets, whatever their
+    modification times, and compares all others with another comparator.
+    """
+
+    def __init__(
+        self,
+        sources: typing.Collection[AbsolutePath],
+        comparator: PathComparisonProtocol,
+    ) -> None:
+        self.sources = sources
+        self.comparator = comparator
+
+    def compare(self, path1: AbsolutePath, path2: AbsolutePath) -> int:
+        if path1 in self.sources:
+            return 1
+        return self.comparator.compare(path1, path2)
+
+
 class ModTimestampComparer(object):
-    def __init__(self) -> None:
+    """
+    Compares files by modification time.
+
+    If stats is passed, the status of files found in it is taken from it
+    instead of examining the files again; it is meant to hold what scans of
+    the source and target files found.  If scanned is passed too, it is a
+    directory that was scanned completely, so files within it that stats
+    lacks do not exist, and are not examined either.
+    """
+
+    def __init__(
+        self,
+        stats: typing.Optional[typing.Mapping[AbsolutePath, os.stat_result]] = None,
+        scanned: typing.Optional[AbsolutePath] = None,
+    ) -> None:
         self.mptypes = get_mptypes()
+        self.stats = stats if stats is not None else {}
+        self.scanned = scanned
+
+    @property
+    def mptypes(self) -> typing.Dict[str, str]:
+        return self.mounts.mptypes
+
+    @mptypes.setter
+    def mptypes(self, mptypes: typing.Dict[str, str]) -> None:
+        self.mounts = MountTable(mptypes)
+
+    def stat(self, path: AbsolutePath) -> os.stat_result:
+        try:
+            return self.stats[path]
+        except KeyError:
+            if self.scanned is not None and within(self.scanned, path):
+                raise FileNotFoundError(
+                    errno.ENOENT, os.strerror(errno.ENOENT), str(path)
+                )
+            return path.stat()
 
     def compare(self, path1: AbsolutePath, path2: AbsolutePath) -> int:
         try:
-            st2 = path2.stat()
+            st2 = self.stat(path2)
         except FileNotFoundError:
             # The target file does not exist, so we always return the
             # source file as newer.
             return 1
 
-        fstypes = set(get_fstype(p, self.mptypes)[0] for p in [path1, path2])
+        fstypes = set(self.mounts.resolve(p)[0] for p in [path1, path2])
         if "vfat" in fstypes:
             comparator = vfatcompare
         else:
             comparator = default_timestamp_comparator
-        st1 = path1.stat()
+        st1 = self.stat(path1)
 
         try:
             t1 = st1.st_mtime_ns / 1000000000
@@ -187,6 +360,8 @@ def compute_synchronization(
     transcode_pather: TranscodingPathLookupProtocol,
     comparator: PathComparisonProtocol,
     exclude_beneath: typing.Optional[typing.List[AbsolutePath]] = None,
+    known: typing.Optional[typing.Dict[AbsolutePath, AbsolutePath]] = None,
+    pipelines: typing.Optional[typing.Dict[AbsolutePath, TranscodingPath]] = None,
 ) -> SyncRet:
     """
     Compute a synchronization schedule based on a dictionary of
@@ -216,6 +391,13 @@ def compute_synchronization(
     into consideration the time resolution of FAT32 file systems
     (greater than 2 seconds).
 
+    If known is passed, its keys are source files known to be synced
+    already to the targets they map to, which are neither mapped nor
+    compared again.
+
+    If pipelines is passed, the transcoding path looked up for each source
+    file found to be synced already (other than those known) is put in it.
+
     Return four values in a tuple:
         1. A dictionary {s:t} where s is the source file name, and
            t is the desired target file name after transfer.
@@ -225,7 +407,8 @@ def compute_synchronization(
            corresponding would-be targets that already were transferred,
         4. A list of files that will be deleted from the destination.
     """
-    exclude_beneath = exclude_beneath or []
+    excluded = ExclusionIndex(exclude_beneath or [])
+    known = known or {}
 
     will_transfer: typing.List[
         typing.Tuple[AbsolutePath, AbsolutePath, TranscodingPath]
@@ -242,7 +425,7 @@ def compute_synchronization(
         return f
 
     for t in target_files:
-        if any(within(exclude_root, t) for exclude_root in exclude_beneath):
+        if t in excluded:
             # Do not delete any files within the exclude dirs.
             pass
         else:
@@ -267,6 +450,13 @@ def compute_synchronization(
             continue
         already_processed[src] = True
 
+        if src in known:
+            tgt = known[src]
+            if tgt not in excluded:
+                already_transferred[src] = tgt
+                deleting[tgt] = False
+            continue
+
         try:
             src_mapped = multimap(src, source_mappers)
             tpath = transcode_pather.lookup(src)[0]
@@ -279,7 +469,7 @@ def compute_synchronization(
 
         tgt = multimap(absp, target_mappers)
 
-        if any(within(exclude_root, tgt) for exclude_root in exclude_beneath):
+        if tgt in excluded:
             # Do not sync any files within the exclude dirs.
             continue
 
@@ -291,6 +481,8 @@ def compute_synchronization(
                 already_foreseen[tgt] = src
             else:
                 already_transferred[src] = tgt
+                if pipelines is not None:
+                    pipelines[src] = tpath
         except Exception as e:
             cant_transfer[src] = e
         deleting[tgt] = False
@@ -34,6 +34,8 @@ class SynchronizationCLI:
         transcoding_mapper: TranscodingMapper,
         postprocessor: Postprocessor,
         force_vfat: bool,
+        rescan: bool = False,
+        compare_content: bool = False,
     ) -> None:
         self.synchronizer = Synchronizer(
             [Absolutize(p) for p in playlists],
@@ -42,10 +44,15 @@ class SynchronizationCLI:
             [Absolutize(p) for p in exclude_beneath],
             postprocessor,
             force_vfat,
+            compare_content,
         )
         self.dryrun = dryrun
         self.delete = delete
         self.concurrency = concurrency
+        # Deleting files not in the playlists needs a listing of the target.
+        self.rescan = rescan or delete
+        # Unless asked to rescan, trust the summary of the last sync.
+        self.trust_summary = not rescan
 
     def run(self) -> int:
         """Returns:
@@ -61,9 +68,18 @@ class SynchronizationCLI:
 
         If self.debug == True (see __init__), raises the exceptions
         that the transcoding / sync operations saw.
+
+        Returns 0 right away if nothing changed since the last sync that
+        completed without problems.
         """
+        if self.trust_summary and self.synchronizer.unchanged(self.delete):
+            logger.info("Nothing changed since the last sync")
+            return 0
+
         try:
-            sync_plan = self.synchronizer.compute_synchronization()
+            sync_plan = self.synchronizer.compute_synchronization(
+                rescan=self.rescan
+            )
         except Exception:
             logger.exception("Error scanning source material")
             return 2
@@ -134,6 +150,11 @@ class SynchronizationCLI:
             retval += 8
         if problems_deleting:
             retval += 16
+        if retval == 0 and not self.dryrun:
+            try:
+                self.synchronizer.summarize(sync_plan, self.delete)
+            except Exception as e:
+                logger.warning("Could not record a summary of this sync: %s", e)
         return retval
 
 
@@ -241,6 +262,26 @@ get copied as per the `copy` action specified in the configuration file.
         default=False,
         help="assume that the destination folder is stored on a FAT file system, and perform the path name conversions appropriate for the case -- useful to sync files to Android devices or other typical music players [default is to autodetect based on the destination mount point]",
     )
+    parser.add_argument(
+        "-r",
+        "--rescan",
+        dest="rescan",
+        action="store_true",
+        help="list all files in the destination directory, instead of only"
+        " checking the files the record of previous syncs kept there knows"
+        " about, to notice files added by other means; always done with"
+        " --delete"
+        " [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--compare-content",
+        dest="compare_content",
+        action="store_true",
+        help="record hashes of the contents of source files as they are synced,"
+        " and do not sync again source files whose modification time changed"
+        " but whose contents did not -- useful when tagging tools or copies"
+        " touch files without changing them [default: %(default)s]",
+    )
     parser.add_argument(
         "--concurrency",
         metavar="NUMPROCS",
@@ -284,6 +325,8 @@ def run_sync(
     configfile: typing.Optional[str] = None,
     profilefile: typing.Optional[str] = None,
     force_vfat: typing.Optional[bool] = False,
+    rescan: bool = False,
+    compare_content: bool = False,
 ) -> int:
     """Runs sync process.  Returns what SynchronizationCLIBackend.run() does."""
     cfg = config.load_transcoding_config(configfile)
@@ -303,6 +346,8 @@ def run_sync(
             tm,
             pp,
             force_vfat or False,
+            rescan,
+            compare_content,
         ).run()
 
     if profilefile:
@@ -345,6 +390,8 @@ def main(argv: typing.Optional[typing.List[str]] = None) -> None:
             configfile=args.config_file,
             profilefile=args.profile_file,
             force_vfat=args.force_vfat,
+            rescan=args.rescan,
+            compare_content=args.compare_content,
         )
     )
 
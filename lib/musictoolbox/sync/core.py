@@ -1,5 +1,9 @@
+import contextlib
+import hashlib
+import json
 import logging
 import os
+from pathlib import Path
 from queue import Queue
 from threading import Thread
 import typing
@@ -10,7 +14,13 @@ import concurrent.futures as fut
 import signal as _unused_signal  # noqa
 
 from . import algo
-from .. import files
+from .manifest import (
+    ManifestEntry,
+    SyncManifest,
+    manifest_directory,
+    source_fingerprint,
+)
+from .. import files, m3u
 from ..files import AbsolutePath, Absolutize
 from ..transcoding import registry as reg, transcoder
 from ..transcoding.interfaces import Postprocessor
@@ -23,6 +33,46 @@ from .interfaces import (
 logger = logging.getLogger(__name__)
 
 
+def read_playlists(
+    sources: typing.List[AbsolutePath],
+) -> typing.Tuple[
+    typing.Dict[AbsolutePath, m3u.Playlist],
+    typing.List[typing.Tuple[AbsolutePath, Exception]],
+]:
+    """
+    Read several playlists, and return a dictionary of the playlists read,
+    keyed by the paths in sources, and a list of (file, Exception) occurred
+    while reading.
+    """
+    playlists: typing.Dict[AbsolutePath, m3u.Playlist] = {}
+    excs: typing.List[typing.Tuple[AbsolutePath, Exception]] = []
+    for source in sources:
+        try:
+            playlists[source] = m3u.read(os.fspath(source))
+        except Exception as e:
+            excs.append((source, e))
+    return playlists, excs
+
+
+def index_playlists(
+    playlists: typing.Dict[AbsolutePath, m3u.Playlist],
+) -> typing.Dict[AbsolutePath, typing.List[AbsolutePath]]:
+    """
+    Return a dictionary of the absolute path names mentioned in the
+    playlists, each with the list of the playlists where it appeared.
+    """
+    sources_by_playlist: typing.Dict[AbsolutePath, typing.List[AbsolutePath]] = {}
+    by_name: typing.Dict[str, typing.List[AbsolutePath]] = {}
+    for source, playlist in playlists.items():
+        for path in playlist.paths:
+            try:
+                by_name[path].append(source)
+            except KeyError:
+                # Entries are absolute and normalised already.
+                by_name[path] = sources_by_playlist[AbsolutePath(Path(path))] = [source]
+    return sources_by_playlist
+
+
 def parse_playlists(
     sources: typing.List[AbsolutePath],
 ) -> typing.Tuple[
@@ -37,37 +87,54 @@ def parse_playlists(
     The list is a sequence of (file, Exception) occurred while parsing.
     Symlinked playlists are followed to their targets to extract paths.
     """
-    files: typing.Dict[AbsolutePath, typing.List[AbsolutePath]] = {}
-    excs: typing.List[typing.Tuple[AbsolutePath, Exception]] = []
-    for source in sources:
-        try:
-            realsource = Absolutize(os.path.realpath(source))
-            realsourcedir = realsource.parent
-            with open(realsource, "r") as sourcef:
-                thisbatch = [
-                    Absolutize(os.path.join(realsourcedir, x.strip()))
-                    for x in sourcef.readlines()
-                    if x.strip() and not x.strip().startswith("#")
-                ]
-                for path in thisbatch:
-                    if path not in files:
-                        n: typing.List[AbsolutePath] = []
-                        files[path] = n
-                    files[path].append(source)
-        except Exception as e:
-            excs.append((source, e))
-    return files, excs
+    playlists, excs = read_playlists(sources)
+    return index_playlists(playlists), excs
+
+
+def scan_files_recursively(
+    directory: AbsolutePath,
+    directories: typing.Optional[typing.List[str]] = None,
+) -> typing.Dict[AbsolutePath, typing.Optional[os.stat_result]]:
+    """
+    Return a dictionary of the absolute paths found recursively listing a
+    directory, with their status, or None for files that cannot be examined
+    (such as broken symbolic links).  If directories is passed, the paths
+    of the subdirectories listed are appended to it.
+    """
+    if not os.path.isdir(directory):
+        return {}
+
+    def listing(subdirectory: str) -> bool:
+        if directories is not None:
+            directories.append(subdirectory)
+        return False
+
+    return {
+        Absolutize(e.path): e.stat
+        for e in files.walk_files(
+            [directory.as_posix()], want_stat=True, skip_directory=listing
+        )
+    }
 
 
 def list_files_recursively(
     directory: AbsolutePath,
 ) -> typing.List[AbsolutePath]:
     """Return a list of absolute paths from recursively listing a directory"""
-    return [
-        Absolutize(os.path.join(base, f))
-        for base, _, files in os.walk(directory)
-        for f in files
-    ]
+    if not os.path.isdir(directory):
+        return []
+    return [Absolutize(e.path) for e in files.walk_files([directory.as_posix()])]
+
+
+def status_of(st: typing.Optional[os.stat_result]) -> typing.Optional[typing.List[int]]:
+    """Return the size and modification time of a file, as a list."""
+    return [st.st_size, st.st_mtime_ns] if st is not None else None
+
+
+def paths_state(paths: typing.List[str], jobs: int = 1) -> typing.List[typing.Any]:
+    """Return the paths, each with its size and modification time."""
+    stats = files.stat_files(paths, jobs)
+    return [[p, status_of(stats.get(p))] for p in paths]
 
 
 class CallerStopped(Exception):
@@ -92,10 +159,20 @@ class SyncPool(Thread):
         ],
         slave: transcoder.SingleItemSyncer,
         max_workers: typing.Optional[int] = None,
+        manifest: typing.Optional[SyncManifest] = None,
+        fingerprints: typing.Optional[typing.Dict[AbsolutePath, str]] = None,
+        configuration: str = "",
+        hash_content: bool = False,
+        to_hash: typing.Optional[typing.Dict[AbsolutePath, ManifestEntry]] = None,
     ):
         Thread.__init__(self, daemon=True)
         self.slave = slave
         self.to_sync = to_sync
+        self.manifest = manifest
+        self.fingerprints = fingerprints or {}
+        self.configuration = configuration
+        self.hash_content = hash_content
+        self.to_hash = to_hash or {}
         self.executor = fut.ThreadPoolExecutor(max_workers=max_workers)
         self.cancelled: typing.List[bool] = []
         self.results: Queue[typing.Union[SyncQueueItem, None]] = Queue()
@@ -109,30 +186,117 @@ class SyncPool(Thread):
             if r is None:
                 break
 
+    def sync(
+        self, src: AbsolutePath, dst: AbsolutePath, path: reg.TranscodingPath
+    ) -> str:
+        """
+        Sync a file, and return the hash of its contents if asked to.  The
+        hash is computed after transcoding, from the file opened before, so
+        that its contents, just read by the transcoder, are read from memory.
+        """
+        if not self.hash_content:
+            self.slave.sync(src, dst, path)
+            return ""
+        with open(src, "rb") as f:
+            self.slave.sync(src, dst, path)
+            return files.file_hash(f)
+
+    def hash_synced(
+        self, src: AbsolutePath, entry: ManifestEntry
+    ) -> typing.Optional[ManifestEntry]:
+        """
+        Return the manifest entry of a file synced already, with the hash of
+        its contents, or None if the file changed since it was recorded.
+        """
+        with open(src, "rb") as f:
+            content = files.file_hash(f)
+            if source_fingerprint(os.fstat(f.fileno())) != entry.fingerprint:
+                return None
+        return entry._replace(content=content)
+
+    def record(
+        self,
+        src: AbsolutePath,
+        dst: AbsolutePath,
+        path: reg.TranscodingPath,
+        content: str,
+    ) -> None:
+        """Record a file just synced in the manifest."""
+        assert self.manifest
+        try:
+            fingerprint = self.fingerprints.get(src) or source_fingerprint(src.stat())
+            st = dst.stat()
+        except OSError as e:
+            logger.debug("Not recording %s in the sync manifest: %s", src, e)
+            return
+        self.manifest.record(
+            src.as_posix(),
+            ManifestEntry(
+                fingerprint,
+                content,
+                dst.as_posix(),
+                str(path),
+                path.fingerprint(),
+                self.configuration,
+                st.st_size,
+                st.st_mtime_ns,
+            ),
+        )
+
     def run(self) -> None:
         try:
-            future_to_url = {
-                self.executor.submit(self.slave.sync, s, d, p): (s, d)
-                for s, d, p in self.to_sync
-            }
-            for future in fut.as_completed(future_to_url):
-                if self.cancelled:
-                    break
-                src, dst = future_to_url[future]
-                exc: typing.Union[None, Exception] = None
-                try:
-                    future.result()
-                except Exception as e:
-                    exc = e
-                self.results.put((src, dst, exc))
+            with self.manifest or contextlib.nullcontext():
+                future_to_url = {
+                    self.executor.submit(self.sync, s, d, p): (s, d, p)
+                    for s, d, p in self.to_sync
+                }
+                for future in fut.as_completed(future_to_url):
+                    if self.cancelled:
+                        break
+                    src, dst, path = future_to_url[future]
+                    exc: typing.Union[None, Exception] = None
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        exc = e
+                    if exc is None and self.manifest:
+                        self.record(src, dst, path, content)
+                    self.results.put((src, dst, exc))
+                if self.manifest and not self.cancelled:
+                    self.record_hashes()
         finally:
             # FIXME
             # [delete_ignoring_notfound(tmpd) for _, tmpd, d in series]
             self.results.put(None)
             self.executor.shutdown(wait=True, cancel_futures=True)
 
+    def record_hashes(self) -> None:
+        """
+        Hash the files synced already whose contents were never hashed,
+        after the files to sync, and record their hashes in the manifest.
+        """
+        assert self.manifest
+        future_to_src = {
+            self.executor.submit(self.hash_synced, s, e): s
+            for s, e in self.to_hash.items()
+        }
+        for future in fut.as_completed(future_to_src):
+            if self.cancelled:
+                break
+            src = future_to_src[future]
+            try:
+                entry = future.result()
+            except OSError as e:
+                logger.debug("Not hashing %s: %s", src, e)
+                continue
+            if entry is not None:
+                self.manifest.record(src.as_posix(), entry)
+
 
 class Synchronizer(object):
+    # How many source files to examine at once when computing the sync.
+    stat_jobs = 8
+
     def __init__(
         self,
         playlists: typing.List[AbsolutePath],
@@ -141,6 +305,7 @@ class Synchronizer(object):
         exclude_beneath: typing.List[AbsolutePath],
         postprocessor: Postprocessor,
         force_vfat: bool,
+        compare_content: bool = False,
     ) -> None:
         self.playlists = playlists
         self.target_directory = target_directory
@@ -155,29 +320,164 @@ class Synchronizer(object):
         )
 
         self.exclude_beneath = exclude_beneath
-
-    def compute_synchronization(self, unconditional: bool = False) -> algo.SyncRet:
-        """Computes synchronization between sources and target."""
+        # Whether to record hashes of the contents of source files synced,
+        # and take source files whose modification time changed since as
+        # synced if their contents did not.
+        self.compare_content = compare_content
+        # Playlists read by compute_synchronization(), so that
+        # synchronize_playlists() need not read them again.
+        self.parsed_playlists: typing.Dict[AbsolutePath, m3u.Playlist] = {}
+        # The sync manifest of the target, and what compute_synchronization()
+        # learned for it: the fingerprint of the transcoding configuration,
+        # the status of source files, and the files found to be synced
+        # already, which the manifest did not know about or knew about
+        # under another configuration.
+        self.manifest: typing.Optional[SyncManifest] = None
+        self.configuration = ""
+        self.source_stats: typing.Dict[AbsolutePath, os.stat_result] = {}
+        self.manifest_updates: typing.Dict[AbsolutePath, ManifestEntry] = {}
+        # The files synced already whose contents were never hashed, if
+        # comparing contents, to hash as the sync happens.
+        self.unhashed: typing.Dict[AbsolutePath, ManifestEntry] = {}
+        # What summarize() needs to know about the sync: the state of the
+        # playlists before reading them, the source files, and the target
+        # subdirectories, if the target was listed.
+        self.playlists_state: typing.List[typing.Any] = []
+        self.source_files: typing.List[AbsolutePath] = []
+        self.target_directories: typing.List[str] = []
+
+    def compute_synchronization(
+        self, unconditional: bool = False, rescan: bool = False
+    ) -> algo.SyncRet:
+        """
+        Computes synchronization between sources and target.
+
+        Source files that the sync manifest of the target records as synced,
+        and that did not change since, are taken as synced without being
+        examined any further, as long as their targets are still as
+        recorded.  The target directory is then only listed if rescan is
+        True, or if the manifest has no record of previous syncs; otherwise
+        only the targets the manifest records are examined, so files added
+        to the target by other means go unnoticed, and only the files the
+        manifest records are candidates for deletion.
+
+        Source files synced under another transcoding configuration are
+        synced again if the transcoding path chosen for them, or the
+        settings of its transcoders, changed since.
+
+        If comparing contents, source files whose modification time
+        changed are hashed, and taken as synced if their contents are
+        still the ones recorded in the manifest.  Files synced already whose
+        contents were never hashed are hashed by synchronize(), after the
+        files to sync.
+        """
 
         logger.debug("Parsing %s playlists", len(self.playlists))
-        source_files, excs = parse_playlists(self.playlists)
+        self.playlists_state = self.get_playlists_state()
+        self.parsed_playlists, excs = read_playlists(self.playlists)
+        source_files = index_playlists(self.parsed_playlists)
+        self.source_files = list(source_files)
         logger.debug("Discovered %s source files", len(source_files))
         if excs:
             for pl, e in excs:
                 logger.error("Cannot scan playlist %s: %s", pl, e)
             raise e
 
-        logger.debug("Scanning target directory %s", self.target_directory)
-        try:
-            target_files = list_files_recursively(self.target_directory)
-            logger.debug("Discovered %s target files", len(target_files))
-        except Exception as e:
-            logger.error("Cannot scan target directory: %s", e)
-            raise e
-
         source_basedir = Absolutize(
             os.path.commonprefix([s.parent for s in source_files])
         )
+        self.manifest = SyncManifest(
+            self.target_directory.as_posix(),
+            "\n".join(
+                [source_basedir.as_posix(), type(self.filesystem_path_mapper).__name__]
+            ),
+        )
+        recorded = {} if unconditional else self.manifest.load()
+        self.configuration = self.transcoding_mapper.fingerprint()
+        logger.debug("Sync manifest records %s synced files", len(recorded))
+
+        # Examine all source files at once, instead of each one in turn.
+        logger.debug("Examining %s source files", len(source_files))
+        self.source_stats = (
+            {} if unconditional else files.stat_files(source_files, self.stat_jobs)
+        )
+
+        target_stats: typing.Dict[AbsolutePath, typing.Optional[os.stat_result]]
+        scanned = rescan or not recorded
+        self.target_directories = []
+        if scanned:
+            logger.debug("Scanning target directory %s", self.target_directory)
+            try:
+                target_stats = scan_files_recursively(
+                    self.target_directory, self.target_directories
+                )
+                logger.debug("Discovered %s target files", len(target_stats))
+            except Exception as e:
+                logger.error("Cannot scan target directory: %s", e)
+                raise e
+            target_files = list(target_stats)
+        else:
+            # Examine the targets recorded, which is much cheaper than
+            # listing the target directory, to notice those changed or
+            # removed by other means.
+            logger.debug("Examining %s recorded target files", len(recorded))
+            target_stats = dict(
+                files.stat_files(
+                    [AbsolutePath(Path(e.target)) for e in recorded.values()],
+                    self.stat_jobs,
+                )
+            )
+            target_files = list(target_stats)
+
+        known: typing.Dict[AbsolutePath, AbsolutePath] = {}
+        outdated: typing.Set[AbsolutePath] = set()
+        rehash: typing.Dict[AbsolutePath, ManifestEntry] = {}
+        self.manifest_updates = {}
+        for src in source_files:
+            entry = recorded.get(src.as_posix())
+            if entry is None:
+                continue
+            if entry.configuration != self.configuration:
+                # Only files whose transcoding changed need be synced again.
+                try:
+                    pipeline = self.transcoding_mapper.lookup(src)[0]
+                except Exception:
+                    # Failing lookups are reported when computing the sync.
+                    continue
+                if pipeline.fingerprint() != entry.pipeline:
+                    outdated.add(src)
+                    continue
+                entry = entry._replace(configuration=self.configuration)
+                self.manifest_updates[src] = entry
+            st = self.source_stats.get(src)
+            if st is None:
+                continue
+            tgt = AbsolutePath(Path(entry.target))
+            tst = target_stats.get(tgt)
+            if tst is None or not entry.matches(tst):
+                continue
+            if entry.fingerprint == source_fingerprint(st):
+                known[src] = tgt
+            elif self.compare_content and entry.content and entry.same_size(st):
+                rehash[src] = entry
+        if rehash:
+            logger.debug(
+                "Hashing %s source files whose modification time changed",
+                len(rehash),
+            )
+            hashes = files.hash_files(rehash, self.stat_jobs)
+            for src, entry in rehash.items():
+                if hashes.get(src) == entry.content:
+                    known[src] = AbsolutePath(Path(entry.target))
+                    self.manifest_updates[src] = entry._replace(
+                        fingerprint=source_fingerprint(self.source_stats[src])
+                    )
+        logger.debug("%s source files unchanged since last synced", len(known))
+        if outdated:
+            logger.info(
+                "%s source files to sync again, as their transcoding changed",
+                len(outdated),
+            )
 
         class AbsoluteMapperAdapter(object):
             def __init__(self, mapper: transcoder.TranscodingMapper):
@@ -192,16 +492,38 @@ class Synchronizer(object):
         target_mappers: typing.List[PathMappingProtocol] = [self.filesystem_path_mapper]
         transcode_pather = self.transcoding_mapper
 
-        comparator: PathComparisonProtocol = algo.ModTimestampComparer()
+        stats: typing.Dict[AbsolutePath, os.stat_result] = {}
+        comparator: PathComparisonProtocol
         if unconditional:
             comparator = algo.SourceAlwaysNewer()
-
-        # Also exclude from deletion all playlists that will be synced.
+        else:
+            # Reuse what the scans found, instead of examining each pair of
+            # files in turn.
+            stats.update(self.source_stats)
+            for path, tst in target_stats.items():
+                if tst is not None:
+                    stats[path] = tst
+            # When the target was scanned, its files the scan did not find
+            # do not exist, and need not be examined.
+            comparator = algo.ModTimestampComparer(
+                stats, self.target_directory if scanned else None
+            )
+            if outdated:
+                comparator = algo.SomeSourcesNewer(outdated, comparator)
+
+        # Also exclude from deletion all playlists that will be synced,
+        # and the sync manifest.
         exclude_beneath = self.exclude_beneath + [
             self.target_playlist_dir / p.name for p in self.playlists
         ]
+        exclude_beneath.append(
+            AbsolutePath(
+                Path(manifest_directory(self.target_directory.as_posix()))
+            )
+        )
 
-        return algo.compute_synchronization(
+        pipelines: typing.Dict[AbsolutePath, reg.TranscodingPath] = {}
+        plan = algo.compute_synchronization(
             list(source_files),
             source_basedir,
             target_files,
@@ -211,8 +533,178 @@ class Synchronizer(object):
             transcode_pather,
             comparator,
             exclude_beneath,
+            known,
+            pipelines,
+        )
+
+        # Record the files found to be synced already, which the manifest
+        # did not know about, when the sync happens.
+        for src, tgt in plan[2].items():
+            if src in known or src not in stats or tgt not in stats:
+                continue
+            tst = stats[tgt]
+            pipeline = pipelines[src]
+            self.manifest_updates[src] = ManifestEntry(
+                source_fingerprint(stats[src]),
+                "",
+                tgt.as_posix(),
+                str(pipeline),
+                pipeline.fingerprint(),
+                self.configuration,
+                tst.st_size,
+                tst.st_mtime_ns,
+            )
+
+        self.unhashed = {}
+        if self.compare_content:
+            for src in plan[2]:
+                entry = self.manifest_updates.get(src)
+                if entry is None and src in known:
+                    entry = recorded[src.as_posix()]
+                if entry is not None and not entry.content:
+                    self.unhashed[src] = entry
+        return plan
+
+    def get_playlists_state(self) -> typing.List[typing.Any]:
+        """Return the state of the playlists, and of their symbolic links."""
+        stats = files.stat_files(self.playlists)
+        state = []
+        for p in self.playlists:
+            try:
+                link = status_of(os.lstat(p))
+            except OSError:
+                link = None
+            state.append([p.as_posix(), status_of(stats.get(p)), link])
+        return state
+
+    def summary_digest(
+        self,
+        playlists_state: typing.List[typing.Any],
+        sources_state: typing.List[typing.Any],
+        targets_state: typing.List[typing.Any],
+        directories_state: typing.Optional[typing.List[typing.Any]],
+    ) -> str:
+        data = json.dumps(
+            [
+                self.configuration,
+                type(self.filesystem_path_mapper).__name__,
+                [p.as_posix() for p in self.exclude_beneath],
+                playlists_state,
+                sources_state,
+                targets_state,
+                directories_state,
+            ]
+        )
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def unchanged(self, directories: bool = False) -> bool:
+        """
+        Return whether nothing changed since the last successful sync, as
+        recorded by summarize(): neither the playlists, nor the source
+        files, nor the transcoding configuration, nor the files synced to
+        the target directory and, if directories is True, its directories
+        (so no other files were added to or removed from it).  Files synced
+        to the target must all still be there.
+        """
+        summary = SyncManifest(self.target_directory.as_posix(), "").summary()
+        if summary is None:
+            return False
+        try:
+            recorded = json.loads(summary)
+            digest = str(recorded["digest"])
+            sources = recorded["sources"]
+            targets = recorded["targets"]
+            dirs = recorded["directories"]
+        except (ValueError, KeyError, TypeError):
+            return False
+        if directories != (dirs is not None):
+            return False
+
+        targets_state = paths_state(targets, self.stat_jobs)
+        if any(status is None for _, status in targets_state):
+            return False
+
+        self.configuration = self.transcoding_mapper.fingerprint()
+        return digest == self.summary_digest(
+            self.get_playlists_state(),
+            paths_state(sources, self.stat_jobs),
+            targets_state,
+            paths_state(dirs, self.stat_jobs) if dirs is not None else None,
         )
 
+    def summarize(self, sync_plan: algo.SyncRet, directories: bool = False) -> None:
+        """
+        Record a summary of a sync that completed successfully, for
+        unchanged() to compare the next sync with.  Directories must only
+        be True if the target directory was listed to compute the sync.
+
+        Sources and playlists are summarized as they were before the sync,
+        so changes made to them while syncing are noticed next time.  No
+        summary is recorded unless the files synced to the target are all
+        there, as the manifest records them.
+        """
+        if self.manifest is None:
+            return
+        will_sync, _, already_synced, __ = sync_plan
+        synced = [(s, d) for s, d, _ in will_sync] + list(already_synced.items())
+        recorded = self.manifest.load()
+        synced_stats = files.stat_files([d for _, d in synced], self.stat_jobs)
+        for src, dst in synced:
+            entry = recorded.get(src.as_posix())
+            st = synced_stats.get(dst)
+            if entry is None or st is None or not entry.matches(st):
+                logger.debug("Not summarizing this sync: %s is not as recorded", dst)
+                return
+        sources = [p.as_posix() for p in self.source_files]
+        sources_state = [
+            [p.as_posix(), status_of(self.source_stats.get(p))]
+            for p in self.source_files
+        ]
+        targets = sorted(
+            set(
+                [d.as_posix() for _, d, __ in will_sync]
+                + [d.as_posix() for d in already_synced.values()]
+                + [
+                    (self.target_playlist_dir / p.name).as_posix()
+                    for p in self.playlists
+                ]
+            )
+        )
+        dirs: typing.Optional[typing.List[str]] = None
+        if directories:
+            # Directories where other files do not matter are left out, and
+            # so is the manifest, which changes as the summary is recorded.
+            ignored = [p.as_posix() for p in self.exclude_beneath] + [
+                manifest_directory(self.target_directory.as_posix())
+            ]
+            top = self.target_directory.as_posix()
+            found = set([top])
+            found.update(self.target_directories)
+            for t in targets:
+                parent = os.path.dirname(t)
+                while parent not in found and parent.startswith(top + os.sep):
+                    found.add(parent)
+                    parent = os.path.dirname(parent)
+            dirs = sorted(
+                d
+                for d in found
+                if not any(d == i or d.startswith(i + os.sep) for i in ignored)
+            )
+
+        summary = {
+            "digest": self.summary_digest(
+                self.playlists_state,
+                sources_state,
+                paths_state(targets, self.stat_jobs),
+                paths_state(dirs, self.stat_jobs) if dirs is not None else None,
+            ),
+            "sources": sources,
+            "targets": targets,
+            "directories": dirs,
+        }
+        with self.manifest as manifest:
+            manifest.summarize(json.dumps(summary))
+
     def synchronize(
         self,
         sync_plan: algo.SyncRet,
@@ -243,7 +735,23 @@ class Synchronizer(object):
             max_workers if max_workers else "automatic number of",
         )
         slave = transcoder.SingleItemSyncer(self.postprocessor)
-        t = SyncPool(to_sync, slave, max_workers=max_workers)
+        fingerprints = dict(
+            (src, source_fingerprint(st)) for src, st in self.source_stats.items()
+        )
+        if self.manifest and self.manifest_updates:
+            with self.manifest as manifest:
+                for src, entry in self.manifest_updates.items():
+                    manifest.record(src.as_posix(), entry)
+        t = SyncPool(
+            to_sync,
+            slave,
+            max_workers=max_workers,
+            manifest=self.manifest,
+            fingerprints=fingerprints,
+            configuration=self.configuration,
+            hash_content=self.compare_content,
+            to_hash=self.unhashed,
+        )
         t.start()
 
         return t.results, t.cancel
@@ -271,62 +779,52 @@ class Synchronizer(object):
         """
         # FIXME if adding params to the following call, add them above too
         will_sync_list, wont_sync, already_synced, _ = sync_plan
-        will_sync = dict((s, d) for s, d, _ in will_sync_list)
+        # The entries of synced files, by the paths the playlists name them.
+        target_dir = self.target_playlist_dir.as_posix()
+        targets: typing.Dict[str, str] = {}
+        for s, d, _ in will_sync_list:
+            targets[s.as_posix()] = os.path.relpath(d.as_posix(), target_dir)
+        for s, d in already_synced.items():
+            targets[s.as_posix()] = os.path.relpath(d.as_posix(), target_dir)
+        reasons = dict((s.as_posix(), e) for s, e in wont_sync.items())
 
         if not dryrun:
             try:
-                files.ensure_directories_exist([self.target_playlist_dir.as_posix()])
+                files.ensure_directories_exist([target_dir])
             except Exception as e:
                 yield (self.target_playlist_dir, self.target_playlist_dir, e)
                 return
 
-        for p in self.playlists:
-            newp = self.target_playlist_dir / p.name
-            oldp, p = p, Absolutize(os.path.realpath(p))
+        for oldp in self.playlists:
+            newp = self.target_playlist_dir / oldp.name
             try:
-                pdir = p.parent
-                with p.open("r") as pf:
-                    pfl = pf.readlines()
+                playlist = self.parsed_playlists.get(oldp) or m3u.read(
+                    oldp.as_posix()
+                )
                 newpfl = []
-                for ln in pfl:
-                    if ln.startswith("#") or not ln.strip():
-                        newpfl.append(ln)
+                for line in playlist.lines:
+                    if line.path is None:
+                        newpfl.append(line.raw)
                         continue
-                    cr = ln.endswith("\n")
-                    orgl = "# was: " + ln.strip() + "\n"
-                    newpfl.append(orgl)
-                    ln = ln.strip()
-                    truel = Absolutize(os.path.join(pdir, ln))
-                    if truel in will_sync:
-                        ln = will_sync[truel].as_posix()
-                        ln = os.path.relpath(ln, self.target_playlist_dir.as_posix())
-                    elif truel in already_synced:
-                        ln = already_synced[truel].as_posix()
-                        ln = os.path.relpath(ln, self.target_playlist_dir.as_posix())
-                    elif truel in wont_sync:
-                        ln = "# not synced because of %s" % wont_sync[truel]
+                    newpfl.append("# was: " + line.text + "\n")
+                    if line.path in targets:
+                        ln = targets[line.path]
+                    elif line.path in reasons:
+                        ln = "# not synced because of %s" % reasons[line.path]
                     else:
-                        assert 0, (ln, truel)
-                    if cr:
+                        assert 0, (line.text, line.path)
+                    if line.raw.endswith("\n"):
                         ln += "\n"
                     newpfl.append(ln)
                 # Insert provenance comment.
                 newpfl.insert(
-                    1 if (newpfl and newpfl[0].startswith("#EXTM3U")) else 0,
+                    1 if (newpfl and newpfl[0].startswith(m3u.EXTM3U)) else 0,
                     "# from: %s\n" % oldp,
                 )
-                sync = True
-                try:
-                    with newp.open("r") as oldpfl:
-                        if oldpfl.read() == "".join(newpfl):
-                            sync = False
-                except FileNotFoundError:
-                    pass
-                if sync:
+                text = "".join(newpfl)
+                if m3u.differs(newp.as_posix(), text, playlist.encoding):
                     if not dryrun:
-                        with newp.open("w") as newpf:
-                            newpf.writelines(newpfl)
-                            newpf.flush()
+                        m3u.write(newp.as_posix(), text, playlist.encoding)
                     yield (oldp, newp, None)
             except Exception as e:
                 yield (oldp, newp, e)
@@ -348,13 +846,19 @@ class Synchronizer(object):
         """
         _, __, ___, deleting = sync_plan
 
+        deleted = []
         for t in deleting:
             try:
                 if not dryrun:
                     t.unlink(True)
+                    deleted.append(t.as_posix())
                 yield (t, None)
             except Exception as e:
                 yield (t, e)
 
+        if deleted and self.manifest:
+            with self.manifest as manifest:
+                manifest.forget(deleted)
+
 
 # =================== end synchronizer code ========================
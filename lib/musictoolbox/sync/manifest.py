@@ -0,0 +1,254 @@
+"""
+The sync manifest: a record, kept in the target directory, of the files
+synced to it.
+
+For each source file synced, the manifest records the fingerprint the
+source had when it was synced (and, if asked to, a hash of its contents,
+so that files whose contents did not change are known to be synced even
+if their modification time did), the target it was synced to, the
+transcoding path used, fingerprints of that path (with the settings of
+its transcoders) and of the whole transcoding configuration, and the
+size and modification time of the target right after.  When neither the
+source, nor the target, nor the transcoding configuration changed since,
+the next sync can take the file as synced without examining it any
+further, and, unless it has to delete files, without listing the target
+at all.  When only the configuration changed, the file need only be
+transcoded again if the path it would be transcoded with changed.
+
+Target paths also depend on the whole set of files synced (their common
+base directory) and on how paths are mapped for the target file system,
+so the manifest is recorded for a context describing those, and its
+entries only count when the context has not changed.
+
+The manifest also keeps a summary of the last successful sync, which
+lets the next one tell that nothing changed at all without even reading
+the playlists.  What the summary holds is up to the synchronizer.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import typing
+
+
+_LOGGER = logging.getLogger(__name__)
+
+MANIFEST_DIRECTORY = ".syncplaylists"
+MANIFEST_NAME = "manifest.sqlite"
+MANIFEST_VERSION = 3
+
+SQLITE_BUSY_TIMEOUT = 60.0
+
+
+def source_fingerprint(st: os.stat_result) -> str:
+    """Return a fingerprint of a source file, which changes when it does."""
+    return "%s:%s" % (st.st_size, st.st_mtime_ns)
+
+
+class ManifestEntry(typing.NamedTuple):
+    """What the manifest knows about a source file."""
+
+    fingerprint: str
+    content: str
+    target: str
+    transcoding: str
+    pipeline: str
+    configuration: str
+    target_size: int
+    target_mtime_ns: int
+
+    def same_size(self, st: os.stat_result) -> bool:
+        """Return whether the source has the size recorded."""
+        return self.fingerprint.split(":", 1)[0] == str(st.st_size)
+
+    def matches(self, st: os.stat_result) -> bool:
+        """Return whether the status of the target is as recorded."""
+        return (
+            st.st_size == self.target_size
+            and st.st_mtime_ns == self.target_mtime_ns
+        )
+
+
+def manifest_directory(target_directory: str) -> str:
+    return os.path.join(target_directory, MANIFEST_DIRECTORY)
+
+
+class SyncManifest(object):
+    """
+    The manifest of a target directory.
+
+    load() reads all of it at once.  To change it, use it as a context
+    manager: record() and forget() may then be called from any thread,
+    and changes are saved in batches, and when the scope of the context
+    manager ends.  Failing to open the manifest is never an error (syncs
+    then happen without it), but failing to save it will raise the
+    appropriate exception.
+    """
+
+    # How many changes to save at once.
+    batch_size = 200
+
+    def __init__(self, target_directory: str, context: str) -> None:
+        self.path = os.path.join(manifest_directory(target_directory), MANIFEST_NAME)
+        self.context = context
+        self.__conn: sqlite3.Connection | None = None
+        self.__lock = threading.Lock()
+        self.__recorded: dict[str, ManifestEntry] = {}
+
+    def __meta(self, conn: sqlite3.Connection) -> dict[str, str]:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+
+    def __current(self, conn: sqlite3.Connection) -> bool:
+        meta = self.__meta(conn)
+        return (
+            meta.get("version") == str(MANIFEST_VERSION)
+            and meta.get("context") == self.context
+        )
+
+    def load(self) -> dict[str, ManifestEntry]:
+        """
+        Return the entries of the manifest, by source path, or nothing if
+        there is no manifest, or it was recorded for another context.
+        """
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+            try:
+                if not self.__current(conn):
+                    _LOGGER.debug("Sync manifest %s is out of date", self.path)
+                    return {}
+                return {
+                    row[0]: ManifestEntry(*row[1:])
+                    for row in conn.execute(
+                        "SELECT source, fingerprint, content, target, transcoding,"
+                        " pipeline, configuration, target_size, target_mtime_ns"
+                        " FROM entries"
+                    )
+                }
+            finally:
+                conn.close()
+        except sqlite3.Error as exc:
+            _LOGGER.error("Error reading sync manifest %s: %s", self.path, exc)
+            return {}
+
+    def summary(self) -> str | None:
+        """Return the summary of the last successful sync, if any."""
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+            try:
+                meta = self.__meta(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as exc:
+            _LOGGER.error("Error reading sync manifest %s: %s", self.path, exc)
+            return None
+        if meta.get("version") != str(MANIFEST_VERSION):
+            return None
+        return meta.get("summary")
+
+    def __open(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False
+        )
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta"
+                    " (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                current = self.__current(conn)
+                if not current:
+                    # Entries of other versions may not even have the same
+                    # columns.
+                    conn.execute("DROP TABLE IF EXISTS entries")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries (source TEXT PRIMARY KEY,"
+                    " fingerprint TEXT NOT NULL, content TEXT NOT NULL,"
+                    " target TEXT NOT NULL,"
+                    " transcoding TEXT NOT NULL, pipeline TEXT NOT NULL,"
+                    " configuration TEXT NOT NULL, target_size INTEGER NOT NULL,"
+                    " target_mtime_ns INTEGER NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS entries_target ON entries (target)"
+                )
+                if not current:
+                    conn.execute("DELETE FROM meta WHERE key = 'summary'")
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        [
+                            ("version", str(MANIFEST_VERSION)),
+                            ("context", self.context),
+                        ],
+                    )
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def __enter__(self) -> "SyncManifest":
+        try:
+            self.__conn = self.__open()
+        except (OSError, sqlite3.Error) as exc:
+            _LOGGER.warning("Cannot open sync manifest %s: %s", self.path, exc)
+        return self
+
+    def record(self, source: str, entry: ManifestEntry) -> None:
+        """Record that a source file was synced."""
+        with self.__lock:
+            self.__recorded[source] = entry
+            if len(self.__recorded) >= self.batch_size:
+                self.__flush()
+
+    def forget(self, targets: typing.Iterable[str]) -> None:
+        """Forget the source files synced to targets, which are gone."""
+        targets = set(targets)
+        with self.__lock:
+            self.__flush()
+            if self.__conn is None or not targets:
+                return
+            with self.__conn:
+                self.__conn.executemany(
+                    "DELETE FROM entries WHERE target = ?", [(t,) for t in targets]
+                )
+
+    def summarize(self, summary: str) -> None:
+        """Record the summary of a successful sync, once all of it is."""
+        with self.__lock:
+            self.__flush()
+            if self.__conn is None:
+                return
+            with self.__conn:
+                self.__conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    ("summary", summary),
+                )
+
+    def __flush(self) -> None:
+        if self.__conn is None:
+            self.__recorded.clear()
+            return
+        if not self.__recorded:
+            return
+        with self.__conn:
+            self.__conn.executemany(
+                "INSERT OR REPLACE INTO entries (source, fingerprint, content,"
+                " target, transcoding, pipeline, configuration, target_size,"
+                " target_mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(source, *entry) for source, entry in self.__recorded.items()],
+            )
+        self.__recorded.clear()
+
+    def __exit__(self, *unused_args: typing.Any) -> None:
+        with self.__lock:
+            try:
+                self.__flush()
+            finally:
+                if self.__conn is not None:
+                    self.__conn.close()
+                    self.__conn = None
@@ -46,6 +46,22 @@ def abl(x: typing.List[str]) -> typing.List[AbsolutePath]:
     return typing.cast(typing.List[AbsolutePath], ab(x))
 
 
+class TestMountTable(unittest.TestCase):
+    def test_resolve(self) -> None:
+        mptypes = {"/mnt/d": "vfat", "/": "ext4"}
+        t = mod.MountTable(mptypes)
+        for path, want in [
+            ("/mnt/d/a/b.mp3", ("vfat", "/mnt/d")),
+            ("/mnt/d/a/c.mp3", ("vfat", "/mnt/d")),
+            ("/mnt/d", ("ext4", "/")),
+            ("/mnt/db/a.mp3", ("ext4", "/")),
+            ("/a.mp3", ("ext4", "/")),
+        ]:
+            self.assertEqual(t.resolve(abp(path)), (want[0], abp(want[1])), path)
+        self.assertEqual(t.resolved["/mnt/d/a"], ("vfat", abp("/mnt/d")))
+        self.assertRaises(KeyError, mod.MountTable({}).resolve, abp("/a/b"))
+
+
 class TestFilesystemPathMapper(unittest.TestCase):
     def test_base_case(self) -> None:
         c = mod.FilesystemPathMapper(abp("/mnt/d"))
@@ -109,6 +125,27 @@ class TestFilesystemPathMapper(unittest.TestCase):
         assert got == want, f"got: {got}, want: {want}"
 
 
+    def test_vfat_directories(self) -> None:
+        c = mod.FilesystemPathMapper(abp("/mnt/d"))
+        c.mptypes = {"/mnt/d": "vfat", "/": "ext4"}
+
+        # Verify that directories are mapped to the case first seen,
+        # whatever the file in them.
+        gots = [
+            c.map(abp(p))
+            for p in ["/mnt/d/Artist/Album./a.mp3", "/mnt/d/artist/ALBUM/b.mp3"]
+        ]
+        wants = abl(["/mnt/d/Artist/Album/a.mp3", "/mnt/d/Artist/Album/b.mp3"])
+        assert gots == wants, f"got: {gots}, want: {wants}"
+
+        # Verify that directory names made of dots and spaces do not
+        # take paths out of the mount point.
+        in_ = abp("/mnt/d/ /.. /x.mp3")
+        want = abp("/mnt/d/x.mp3")
+        got = c.map(in_)
+        assert got == want, f"got: {got}, want: {want}"
+
+
 class TestVfatProtect(unittest.TestCase):
     def test_noendingdots(self) -> None:
         p = mod.vfatprotect("/some/path/with./dots")
@@ -189,6 +226,21 @@ class TestComputeSynchronization(unittest.TestCase):
         )
         self.assertEqual(got, want)
 
+        pipelines: typing.Dict[AbsolutePath, TranscodingPath] = {}
+        mod.compute_synchronization(
+            abl(["/a", "/b"]),
+            abp("/"),
+            abl(["/target/a"]),
+            abp("/target"),
+            [],
+            [],
+            DummyTranscodingPather,
+            AlwaysEqual,
+            known=abd({"/b": "/target/b"}),
+            pipelines=pipelines,
+        )
+        self.assertEqual(pipelines, {abp("/a"): DummyTranscodingPath})
+
     def test_source_is_newer_than_target(self) -> None:
         got = mod.compute_synchronization(
             abl(["/a"]),
@@ -412,6 +464,60 @@ class TestModTimestampComparer(unittest.TestCase):
             assert c.compare(f1, f2) == 0
 
 
+    def test_known_stats(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            f1 = Absolutize(d) / "f1"
+            f2 = Absolutize(d) / "f2"
+            with open(f1, "w") as f1o:
+                f1o.write("x")
+            st = f1.stat()
+            os.utime(f1, (st.st_mtime + 10, st.st_mtime + 10))
+            newer = f1.stat()
+            os.utime(f1, (st.st_mtime, st.st_mtime))
+            # The target is never examined if its status is known.
+            c = mod.ModTimestampComparer({f2: newer})
+            assert c.compare(f1, f2) == -1
+            c = mod.ModTimestampComparer({f1: st, f2: st})
+            os.unlink(f1)
+            assert c.compare(f1, f2) == 0
+            # Files not known are examined.
+            c = mod.ModTimestampComparer({f1: st})
+            assert c.compare(f1, f2) == 1
+            # Unless they are within a directory scanned completely.
+            with open(f1, "w"):
+                pass
+            c = mod.ModTimestampComparer({f2: st}, Absolutize(d))
+            assert c.compare(f2, f1) == 1
+            with self.assertRaises(FileNotFoundError):
+                c.stat(f1)
+            assert mod.ModTimestampComparer({f2: st}).compare(f2, f1) != 1
+
+
+class TestSomeSourcesNewer(unittest.TestCase):
+    def test_some_sources(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            f1 = Absolutize(d) / "f1"
+            f2 = Absolutize(d) / "f2"
+            with open(f1, "w") as f1o:
+                f1o.write("x")
+            st = f1.stat()
+            c = mod.ModTimestampComparer({f1: st, f2: st})
+            assert mod.SomeSourcesNewer([], c).compare(f1, f2) == 0
+            assert mod.SomeSourcesNewer([f1], c).compare(f1, f2) == 1
+
+
+class TestExclusionIndex(unittest.TestCase):
+    def test_same_as_within(self) -> None:
+        roots = abl(["/a/b", "/c"])
+        index = mod.ExclusionIndex(roots)
+        for path in abl(["/a/b", "/a/b/c/d", "/a", "/a/bc", "/c/d", "/d", "/"]):
+            self.assertEqual(
+                path in index, any(mod.within(r, path) for r in roots), path
+            )
+        self.assertFalse(abp("/a") in mod.ExclusionIndex([]))
+        self.assertTrue(abp("/a") in mod.ExclusionIndex([abp("/")]))
+
+
 class TestWithin(unittest.TestCase):
     def test_same_matches(self) -> None:
         assert mod.within(Absolutize("/a"), Absolutize("/a/"))
@@ -18,10 +18,11 @@ import unittest
 
 from . import core as mod
 from ..files import AbsolutePath, Absolutize as A
-from ..files import ensure_directories_exist
+from ..files import content_hash, ensure_directories_exist
 from ..transcoding import policies, registry, settings, transcoder
 from ..transcoding.interfaces import TranscoderName, FileType
 from ..transcoding.test_registry import DummyLookup
+from .manifest import source_fingerprint
 
 
 # FIXME: test musictoolbox.synccli
@@ -229,6 +230,7 @@ class TestSynchronizer(unittest.TestCase):
         forced_policy: typing.Optional[policies.TranscoderPolicy] = None,
         allow_fallback: bool = True,
         force_vfat: bool = False,
+        compare_content: bool = False,
     ) -> mod.Synchronizer:
         ts = settings.TranscoderSettings({})
         tr = registry.TranscoderRegistry(ts)
@@ -245,7 +247,13 @@ class TestSynchronizer(unittest.TestCase):
         )
         tm = transcoder.TranscodingMapper(tr, ps)
         s = mod.Synchronizer(
-            playlists, target_dir, tm, [], donothing_postpro, force_vfat
+            playlists,
+            target_dir,
+            tm,
+            [],
+            donothing_postpro,
+            force_vfat,
+            compare_content,
         )
         return s
 
@@ -288,6 +296,162 @@ class TestSynchronizer(unittest.TestCase):
         for _, v, __ in want:
             assert os.path.exists(v), v
 
+    def test_manifest(self) -> None:
+        songs = ["Albums/Good/A-Ha/Take on me.mp3", "Albums/Good/A-Ha/Hunting.mp3"]
+        in_ = (self.td, songs, [songs])
+        take, hunting = [self.td / p for p in in_[1]]
+        take_to, hunting_to = [self.td / "output" / p.name for p in (take, hunting)]
+        playlists = syncplaylists_fixtures(*in_)
+        s = self._makeStack(playlists, self.td / "output")
+        plan = s.compute_synchronization()
+        self.assertEqual(len(plan[0]), 2)
+        consume(s.synchronize(plan, 1)[0])
+
+        # Synced files are recorded, and not compared again.
+        s = self._makeStack(playlists, self.td / "output")
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [])
+        self.assertEqual(plan[2], {take: take_to, hunting: hunting_to})
+
+        # Unless their targets were removed by other means...
+        os.unlink(take_to)
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [(take, take_to, copypath("mp3"))])
+        self.assertEqual(plan[2], {hunting: hunting_to})
+        plan = s.compute_synchronization(rescan=True)
+        self.assertEqual(plan[0], [(take, take_to, copypath("mp3"))])
+
+        # ...or their sources changed.
+        consume(s.synchronize(plan, 1)[0])
+        mtime_ns = hunting.stat().st_mtime_ns + 10000000000
+        os.utime(hunting, ns=(mtime_ns, mtime_ns))
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [(hunting, hunting_to, copypath("mp3"))])
+
+    def test_manifest_configuration(self) -> None:
+        songs = ["Albums/Good/A-Ha/Take on me.mp3"]
+        in_ = (self.td, songs, [songs])
+        take = self.td / songs[0]
+        take_to = self.td / "output" / take.name
+        playlists = syncplaylists_fixtures(*in_)
+        s = self._makeStack(playlists, self.td / "output")
+        consume(s.synchronize(s.compute_synchronization(), 1)[0])
+
+        # Files whose transcoding did not change are not synced again.
+        s = self._makeStack(playlists, self.td / "output", allow_fallback=False)
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [])
+        consume(s.synchronize(plan, 1)[0])
+        assert s.manifest
+        entry = s.manifest.load()[take.as_posix()]
+        self.assertEqual(entry.configuration, s.configuration)
+
+        # Files whose transcoding did are.
+        s = self._makeStack(playlists, self.td / "output")
+        copy = s.transcoding_mapper.transcoder_registry.get_transcoder(
+            TranscoderName("copy")
+        )
+        setattr(copy, "settings", {"changed": True})
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [(take, take_to, copypath("mp3"))])
+
+    def test_compare_content(self) -> None:
+        songs = ["Albums/Good/A-Ha/Take on me.mp3"]
+        in_ = (self.td, songs, [songs])
+        take = self.td / songs[0]
+        take_to = self.td / "output" / take.name
+        playlists = syncplaylists_fixtures(*in_)
+        s = self._makeStack(playlists, self.td / "output", compare_content=True)
+        consume(s.synchronize(s.compute_synchronization(), 1)[0])
+        assert s.manifest
+        self.assertTrue(s.manifest.load()[take.as_posix()].content)
+
+        # Files touched without changing their contents are not synced again.
+        st = take.stat()
+        os.utime(take, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        s = self._makeStack(playlists, self.td / "output", compare_content=True)
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [])
+        self.assertEqual(plan[2], {take: take_to})
+        consume(s.synchronize(plan, 1)[0])
+        assert s.manifest
+        entry = s.manifest.load()[take.as_posix()]
+        self.assertEqual(entry.fingerprint, source_fingerprint(take.stat()))
+
+        # Unless contents are not compared.
+        os.utime(take, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+        s = self._makeStack(playlists, self.td / "output")
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [(take, take_to, copypath("mp3"))])
+
+        # Files whose contents changed are, even if their size did not.
+        with take.open("w") as f:
+            f.write("Not a fake song")
+        s = self._makeStack(playlists, self.td / "output", compare_content=True)
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [(take, take_to, copypath("mp3"))])
+
+        # Files synced without comparing contents are hashed as the next
+        # sync that does happens, without being synced again.
+        s = self._makeStack(playlists, self.td / "output")
+        consume(s.synchronize(s.compute_synchronization(), 1)[0])
+        s = self._makeStack(playlists, self.td / "output", compare_content=True)
+        plan = s.compute_synchronization()
+        self.assertEqual(plan[0], [])
+        assert s.manifest
+        self.assertEqual(s.manifest.load()[take.as_posix()].content, "")
+        consume(s.synchronize(plan, 1)[0])
+        self.assertEqual(
+            s.manifest.load()[take.as_posix()].content, content_hash(take)
+        )
+
+    def test_summary(self) -> None:
+        songs = ["Albums/Good/A-Ha/Take on me.mp3"]
+        in_ = (self.td, songs, [songs])
+        take = self.td / songs[0]
+        playlists = syncplaylists_fixtures(*in_)
+
+        def sync(directories: bool) -> mod.Synchronizer:
+            s = self._makeStack(playlists, self.td / "output")
+            plan = s.compute_synchronization(rescan=directories)
+            consume(s.synchronize(plan, 1)[0])
+            list(s.synchronize_playlists(plan))
+            s.summarize(plan, directories)
+            return s
+
+        s = self._makeStack(playlists, self.td / "output")
+        self.assertFalse(s.unchanged())
+        sync(False)
+        self.assertTrue(s.unchanged())
+        self.assertFalse(s.unchanged(True))
+        st = take.stat()
+        os.utime(take, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertFalse(s.unchanged())
+        os.utime(take, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertTrue(s.unchanged())
+
+        # Files added to the target are noticed if asked to.
+        sync(True)
+        self.assertTrue(s.unchanged(True))
+        with open(self.td / "output" / "Playlists" / "stray.m3u", "w"):
+            pass
+        self.assertFalse(s.unchanged(True))
+
+        # Files removed from the target are noticed, and no summary is
+        # recorded of a sync whose files are not all there.
+        take_to = self.td / "output" / take.name
+        os.unlink(take_to)
+        self.assertFalse(s.unchanged(True))
+        s = sync(False)
+        self.assertTrue(s.unchanged())
+        assert s.manifest
+        summary = s.manifest.summary()
+        plan = s.compute_synchronization()
+        os.unlink(take_to)
+        s.summarize(plan)
+        self.assertEqual(s.manifest.summary(), summary)
+        self.assertFalse(s.unchanged())
+
     def test_vfat(self) -> None:
         in_ = (
             self.td,
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from . import manifest as mod
+
+
+def entry(target: str, size: int = 1) -> mod.ManifestEntry:
+    return mod.ManifestEntry("1:2", "", target, "< copy >", "abc", "def", size, 3)
+
+
+class TestSyncManifest(unittest.TestCase):
+    def test_record_and_load(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            m = mod.SyncManifest(d, "context")
+            self.assertEqual(m.load(), {})
+            with m as writer:
+                writer.batch_size = 2
+                for n in range(5):
+                    writer.record("/src/%s" % n, entry("/dst/%s" % n))
+                # Saved in batches before the end.
+                self.assertEqual(len(m.load()), 4)
+            loaded = m.load()
+            self.assertEqual(loaded["/src/3"], entry("/dst/3"))
+            self.assertEqual(len(loaded), 5)
+
+            with m as writer:
+                writer.record("/src/0", entry("/dst/0", 2))
+                writer.forget(["/dst/1", "/dst/2"])
+            self.assertEqual(
+                m.load(),
+                {
+                    "/src/0": entry("/dst/0", 2),
+                    "/src/3": entry("/dst/3"),
+                    "/src/4": entry("/dst/4"),
+                },
+            )
+
+    def test_summary(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            m = mod.SyncManifest(d, "context")
+            self.assertIsNone(m.summary())
+            with m as writer:
+                writer.record("/src/0", entry("/dst/0"))
+                writer.summarize("summary")
+            self.assertEqual(m.summary(), "summary")
+            # The summary does not depend on the context...
+            self.assertEqual(mod.SyncManifest(d, "other").summary(), "summary")
+            # ...but it goes with the entries when the context changes.
+            with mod.SyncManifest(d, "other"):
+                pass
+            self.assertIsNone(m.summary())
+
+    def test_other_context(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            with mod.SyncManifest(d, "context") as writer:
+                writer.record("/src/0", entry("/dst/0"))
+            other = mod.SyncManifest(d, "other context")
+            self.assertEqual(other.load(), {})
+            with other as writer:
+                writer.record("/src/1", entry("/dst/1"))
+            self.assertEqual(other.load(), {"/src/1": entry("/dst/1")})
+            self.assertEqual(mod.SyncManifest(d, "context").load(), {})
+
+    def test_other_version(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            os.mkdir(mod.manifest_directory(d))
+            conn = sqlite3.connect(
+                os.path.join(mod.manifest_directory(d), mod.MANIFEST_NAME)
+            )
+            with conn:
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("CREATE TABLE entries (source TEXT PRIMARY KEY)")
+                conn.execute("INSERT INTO meta VALUES ('version', '0')")
+                conn.execute("INSERT INTO meta VALUES ('context', 'context')")
+                conn.execute("INSERT INTO entries VALUES ('/src/0')")
+            conn.close()
+            m = mod.SyncManifest(d, "context")
+            self.assertEqual(m.load(), {})
+            with m as writer:
+                writer.record("/src/1", entry("/dst/1"))
+            self.assertEqual(m.load(), {"/src/1": entry("/dst/1")})
+
+    def test_unwritable(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            target = os.path.join(d, "file")
+            with open(target, "w"):
+                pass
+            # The manifest cannot be created beneath a file.
+            with mod.SyncManifest(target, "context") as writer:
+                writer.record("/src/0", entry("/dst/0"))
+                writer.forget(["/dst/0"])
+            self.assertEqual(mod.SyncManifest(target, "context").load(), {})
+
+    def test_matches(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            st = os.stat(d)
+            e = mod.ManifestEntry("", "", d, "", "", "", st.st_size, st.st_mtime_ns)
+            self.assertTrue(e.matches(st))
+            self.assertFalse(e._replace(target_size=st.st_size + 1).matches(st))
+            e = e._replace(fingerprint=mod.source_fingerprint(st))
+            self.assertTrue(e.same_size(st))
+            other = e._replace(fingerprint="1" + e.fingerprint)
+            self.assertFalse(other.same_size(st))
+            self.assertEqual(
+                mod.source_fingerprint(st), "%s:%s" % (st.st_size, st.st_mtime_ns)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
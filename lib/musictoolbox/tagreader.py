@@ -0,0 +1,312 @@
+"""
+Fast readers of the tags of common audio file formats.
+
+mutagen parses the whole container of a file, including its embedded
+pictures and the headers of its audio stream.  The readers in this module
+map the file into memory and look only at the blocks that hold tags:
+ID3v2 frames in MP3 files, Vorbis comments in FLAC and Ogg files, and
+ilst items in MP4 files.  Pictures, cover art and audio data are skipped
+without being read.
+
+The readers are deliberately strict: anything they do not expect raises
+Unsupported, and callers should then read the file with mutagen.
+"""
+
+import io
+import mmap
+import os
+import struct
+import typing
+
+from mutagen.id3 import ID3
+
+
+class Unsupported(Exception):
+    """The file is not in a form these readers can handle."""
+
+
+# The kinds of tags returned by read_tags().
+ID3_TAGS = "id3"
+MP4_TAGS = "mp4"
+VORBIS_TAGS = "vorbis"
+
+# ID3 frames kept from MP3 files; all others (pictures included) are skipped.
+ID3_FRAMES = frozenset((b"TALB", b"TPE1", b"TPE2", b"TXXX", b"RVA2"))
+
+_OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+
+
+def _syncsafe(data: bytes) -> int:
+    if any(b & 0x80 for b in data):
+        raise Unsupported("invalid synchsafe integer")
+    size = 0
+    for b in data:
+        size = (size << 7) | b
+    return size
+
+
+def _to_syncsafe(size: int) -> bytes:
+    return bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def _read_id3(m: mmap.mmap, keys: frozenset[str]) -> tuple[str, typing.Any]:
+    if m[:3] != b"ID3":
+        raise Unsupported("no ID3v2 tag at the start of the file")
+    major, flags = m[3], m[5]
+    tag_end = 10 + _syncsafe(m[6:10])
+    audio = tag_end + (10 if flags & 0x10 else 0)
+    if audio + 2 > len(m) or m[audio] != 0xFF or m[audio + 1] & 0xE0 != 0xE0:
+        raise Unsupported("no MPEG audio right after the ID3v2 tag")
+
+    if major not in (3, 4) or flags & 0xC0:
+        # Unsynchronised tags, extended headers and ID3v2.2 tags are left
+        # to mutagen, but still without parsing the audio stream.
+        tag = m[:tag_end]
+    else:
+        frames = []
+        pos = 10
+        while pos + 10 <= tag_end:
+            frame_id = m[pos : pos + 4]
+            if frame_id[0] == 0:
+                break  # Padding.
+            if not all(48 <= c <= 57 or 65 <= c <= 90 for c in frame_id):
+                raise Unsupported("invalid ID3 frame %r" % frame_id)
+            size_bytes = m[pos + 4 : pos + 8]
+            frame_size = (
+                _syncsafe(size_bytes)
+                if major == 4
+                else struct.unpack(">I", size_bytes)[0]
+            )
+            frame_end = pos + 10 + frame_size
+            if frame_end > tag_end:
+                raise Unsupported("ID3 frame %r overflows the tag" % frame_id)
+            if frame_id in ID3_FRAMES:
+                frames.append(m[pos:frame_end])
+            pos = frame_end
+        body = b"".join(frames)
+        tag = m[:5] + bytes((flags & ~0x10,)) + _to_syncsafe(len(body)) + body
+
+    # mutagen merges an ID3v1 tag at the end of the file into the ID3v2 tag.
+    v1 = m[-128:] if len(m) >= audio + 128 and m[-128:-125] == b"TAG" else b""
+    return ID3_TAGS, ID3(io.BytesIO(tag + v1))
+
+
+def _parse_vorbis_comment(
+    data: bytes, keys: frozenset[str]
+) -> dict[str, list[str]]:
+    """Return the comments named in keys (lowercase) of a Vorbis comment."""
+    comments: dict[str, list[str]] = {}
+    (vendor_length,) = struct.unpack_from("<I", data, 0)
+    pos = 4 + vendor_length
+    (count,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    for _ in range(count):
+        (length,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        end = pos + length
+        if end > len(data):
+            raise Unsupported("truncated Vorbis comment")
+        equals = data.find(b"=", pos, end)
+        if equals != -1:
+            key = data[pos:equals].decode("ascii", "replace").lower()
+            if key in keys:
+                value = data[equals + 1 : end].decode("utf-8", "replace")
+                comments.setdefault(key, []).append(value)
+        pos = end
+    return comments
+
+
+def _read_flac(m: mmap.mmap, keys: frozenset[str]) -> tuple[str, typing.Any]:
+    if m[:4] != b"fLaC":
+        raise Unsupported("no FLAC stream marker at the start of the file")
+    comments: dict[str, list[str]] = {}
+    pos = 4
+    first = True
+    while True:
+        if pos + 4 > len(m):
+            raise Unsupported("truncated FLAC metadata")
+        header = m[pos]
+        block_type = header & 0x7F
+        length = int.from_bytes(m[pos + 1 : pos + 4], "big")
+        if (first and block_type != 0) or block_type == 127:
+            raise Unsupported("invalid FLAC metadata block %s" % block_type)
+        first = False
+        pos += 4
+        if pos + length > len(m):
+            raise Unsupported("truncated FLAC metadata block")
+        if block_type == 4:
+            comments = _parse_vorbis_comment(m[pos : pos + length], keys)
+        pos += length
+        if header & 0x80:
+            return VORBIS_TAGS, comments
+
+
+def _ogg_packets(m: mmap.mmap, count: int) -> list[bytes]:
+    """Return the first packets of the first logical stream of an Ogg file."""
+    packets: list[bytes] = []
+    partial: list[bytes] = []
+    serial = None
+    pos = 0
+    while len(packets) < count:
+        if pos + _OGG_PAGE_HEADER.size > len(m):
+            raise Unsupported("truncated Ogg stream")
+        capture, version, _, _, page_serial, _, _, segments = (
+            _OGG_PAGE_HEADER.unpack_from(m, pos)
+        )
+        if capture != b"OggS" or version != 0:
+            raise Unsupported("invalid Ogg page")
+        lacing = m[pos + 27 : pos + 27 + segments]
+        pos += 27 + segments
+        if serial is None:
+            serial = page_serial
+        if page_serial != serial:
+            pos += sum(lacing)
+            continue
+        for lace in lacing:
+            partial.append(m[pos : pos + lace])
+            pos += lace
+            if lace < 255:
+                packets.append(b"".join(partial))
+                partial = []
+        if pos > len(m):
+            raise Unsupported("truncated Ogg page")
+    return packets[:count]
+
+
+def _read_ogg(m: mmap.mmap, keys: frozenset[str]) -> tuple[str, typing.Any]:
+    if m[:4] != b"OggS":
+        raise Unsupported("no Ogg page at the start of the file")
+    identification, comment = _ogg_packets(m, 2)
+    if identification.startswith(b"\x01vorbis") and comment.startswith(
+        b"\x03vorbis"
+    ):
+        return VORBIS_TAGS, _parse_vorbis_comment(comment[7:], keys)
+    if identification.startswith(b"OpusHead") and comment.startswith(b"OpusTags"):
+        return VORBIS_TAGS, _parse_vorbis_comment(comment[8:], keys)
+    raise Unsupported("Ogg stream is neither Vorbis nor Opus")
+
+
+def _mp4_atoms(
+    m: mmap.mmap, start: int, end: int
+) -> typing.Iterator[tuple[bytes, int, int]]:
+    """Yield the name, data start and end of the atoms between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        size, name = struct.unpack_from(">I4s", m, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise Unsupported("truncated MP4 atom")
+            (size,) = struct.unpack_from(">Q", m, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise Unsupported("invalid MP4 atom %r" % name)
+        yield name, pos + header, pos + size
+        pos += size
+
+
+def _mp4_child(m: mmap.mmap, start: int, end: int, wanted: bytes) -> tuple[int, int]:
+    for name, data_start, data_end in _mp4_atoms(m, start, end):
+        if name == wanted:
+            return data_start, data_end
+    raise KeyError(wanted)
+
+
+def _mp4_data(m: mmap.mmap, start: int, end: int) -> list[tuple[int, bytes]]:
+    """Return the type and payload of the data atoms of an ilst item."""
+    values = []
+    for name, data_start, data_end in _mp4_atoms(m, start, end):
+        if name != b"data" or data_end - data_start < 8:
+            raise Unsupported("unexpected MP4 atom %r in ilst item" % name)
+        (flags,) = struct.unpack(">I", b"\x00" + m[data_start + 1 : data_start + 4])
+        values.append((flags, m[data_start + 8 : data_end]))
+    return values
+
+
+def _read_mp4(m: mmap.mmap, keys: frozenset[str]) -> tuple[str, typing.Any]:
+    if m[4:8] != b"ftyp":
+        raise Unsupported("no ftyp atom at the start of the file")
+    items: dict[str, list[typing.Any]] = {}
+    try:
+        start, end = _mp4_child(m, 0, len(m), b"moov")
+        start, end = _mp4_child(m, start, end, b"udta")
+        start, end = _mp4_child(m, start, end, b"meta")
+        # meta is a full atom, with a version and flags before its children.
+        start, end = _mp4_child(m, start + 4, end, b"ilst")
+    except KeyError:
+        return MP4_TAGS, items
+    for name, item_start, item_end in _mp4_atoms(m, start, end):
+        if name == b"----":
+            mean_start, mean_end = _mp4_child(m, item_start, item_end, b"mean")
+            name_start, name_end = _mp4_child(m, item_start, item_end, b"name")
+            key = "----:%s:%s" % (
+                m[mean_start + 4 : mean_end].decode("latin-1"),
+                m[name_start + 4 : name_end].decode("latin-1"),
+            )
+            values: list[typing.Any] = []
+            for atom, data_start, data_end in _mp4_atoms(m, item_start, item_end):
+                if atom == b"data" and data_end - data_start >= 8:
+                    values.append(m[data_start + 8 : data_end])
+                elif atom not in (b"mean", b"name"):
+                    raise Unsupported("unexpected MP4 atom %r in %r" % (atom, key))
+            items[key] = values
+        elif name.startswith(b"\xa9") or name == b"aART":
+            values = []
+            for flags, data in _mp4_data(m, item_start, item_end):
+                if flags not in (0, 1):
+                    raise Unsupported("MP4 text atom %r is not text" % name)
+                try:
+                    values.append(data.decode("utf-8"))
+                except UnicodeDecodeError:
+                    raise Unsupported("MP4 text atom %r is not UTF-8" % name)
+            items[name.decode("latin-1")] = values
+    return MP4_TAGS, items
+
+
+_READERS: dict[
+    str, typing.Callable[[mmap.mmap, frozenset[str]], tuple[str, typing.Any]]
+] = {
+    ".mp3": _read_id3,
+    ".flac": _read_flac,
+    ".ogg": _read_ogg,
+    ".oga": _read_ogg,
+    ".opus": _read_ogg,
+    ".m4a": _read_mp4,
+    ".mp4": _read_mp4,
+}
+
+
+def read_tags(
+    path: str, vorbis_keys: typing.Iterable[str]
+) -> tuple[str, typing.Any]:
+    """
+    Read the tags of an audio file without parsing the rest of it.
+
+    Returns the kind of tags found (ID3_TAGS, MP4_TAGS or VORBIS_TAGS) and
+    the tags themselves:
+
+    * for MP3 files, a mutagen ID3 object with only the album, artist and
+      album artist frames, the TXXX frames and the RVA2 frames;
+    * for MP4 files, a dictionary of the text items and the freeform items
+      of the file, named as mutagen's MP4Tags names them, where the values
+      of freeform items are bytes;
+    * for FLAC, Ogg Vorbis and Opus files, a dictionary of the Vorbis
+      comments named in vorbis_keys, with lowercase names.
+
+    Raises Unsupported if the file is not one of those, or is not laid out
+    as expected.
+    """
+    reader = _READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise Unsupported("unknown file type")
+    keys = frozenset(k.lower() for k in vorbis_keys)
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise Unsupported("empty file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            try:
+                return reader(m, keys)
+            except (struct.error, IndexError, ValueError) as exc:
+                raise Unsupported(str(exc))
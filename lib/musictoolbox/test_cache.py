@@ -0,0 +1,452 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import pickle
+import sqlite3
+import struct
+import sys
+import tempfile
+import typing
+import unittest
+from unittest import mock
+
+import xdg.BaseDirectory
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, RVA2, TALB, TPE1, TPE2, TXXX
+
+from . import cache as mod
+
+
+@contextlib.contextmanager
+def cache_home() -> typing.Generator[str, None, None]:
+    with tempfile.TemporaryDirectory() as d:
+        with mock.patch.object(xdg.BaseDirectory, "xdg_cache_home", d):
+            yield d
+
+
+class CountingFactory(object):
+    def __init__(self) -> None:
+        self.calls: typing.List[str] = []
+
+    def __call__(self, path: str) -> str:
+        self.calls.append(path)
+        with open(path, "r") as f:
+            return f.read()
+
+
+def read(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def fail(path: str) -> str:
+    raise ValueError(path)
+
+
+def write(path: str, text: str) -> str:
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def make_mp3(path: str) -> str:
+    """Write a silent MP3 file with a few ID3 frames."""
+    with open(path, "wb") as f:
+        f.write((b"\xff\xfb\x90\x64" + b"\x00" * 413) * 10)
+    tags = ID3()
+    tags.add(TALB(encoding=3, text=["Album"]))
+    tags.add(TPE1(encoding=3, text=["Artist"]))
+    tags.add(TPE2(encoding=3, text=["Album artist"]))
+    tags.add(TXXX(encoding=3, desc="replaygain_track_gain", text=["-3.00 dB"]))
+    tags.add(RVA2(desc="track", channel=1, gain=-3.0, peak=0.5))
+    tags.save(path)
+    return path
+
+
+def make_flac(path: str) -> str:
+    """Write a FLAC file with only a stream info block and Vorbis comments."""
+    streaminfo = (
+        struct.pack(">HH", 4096, 4096)
+        + b"\x00" * 6
+        + bytes([0x0A, 0xC4, 0x42, 0xF0])
+        + b"\x00" * 20
+    )
+    with open(path, "wb") as f:
+        f.write(b"fLaC\x80" + struct.pack(">I", len(streaminfo))[1:] + streaminfo)
+    flac = FLAC(path)
+    flac["ALBUM"] = ["Album"]
+    flac["Artist"] = ["Artist"]
+    flac["replaygain_track_gain"] = ["-1.00 dB"]
+    flac["title"] = ["Not kept"]
+    flac.save()
+    return path
+
+
+class TestTagSnapshot(unittest.TestCase):
+    def test_mp3(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            snapshot = mod.TagSnapshot.from_file(make_mp3(os.path.join(d, "a.mp3")))
+        self.assertTrue(snapshot.valid)
+        self.assertEqual(
+            snapshot.tags,
+            {
+                "album": ["Album"],
+                "artist": ["Artist"],
+                "albumartist": ["Album artist"],
+                "replaygain_track_gain": ["-3.000000 dB"],
+                "replaygain_track_peak": ["0.500000"],
+                "TXXX:replaygain_track_gain": ["-3.00 dB"],
+            },
+        )
+        self.assertEqual(snapshot.first("TXXX:albumartist", "albumartist"), "Album artist")
+
+    def test_flac(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            snapshot = mod.TagSnapshot.from_file(make_flac(os.path.join(d, "a.flac")))
+        self.assertTrue(snapshot.valid)
+        self.assertEqual(
+            snapshot.tags,
+            {
+                "album": ["Album"],
+                "artist": ["Artist"],
+                "replaygain_track_gain": ["-1.00 dB"],
+            },
+        )
+
+    def test_pickles_compactly(self) -> None:
+        snapshot = mod.TagSnapshot(True, {"album": ["".join(["Al", "bum"])]})
+        loaded = pickle.loads(pickle.dumps(snapshot))
+        self.assertTrue(loaded.valid)
+        self.assertEqual(loaded.tags, {"album": ["Album"]})
+        self.assertFalse(hasattr(loaded, "__dict__"))
+        album = loaded.first("album")
+        assert album is not None
+        self.assertIs(album, sys.intern("Album"))
+
+    def test_loads_version_1_pickles(self) -> None:
+        snapshot = mod.TagSnapshot.__new__(mod.TagSnapshot)
+        snapshot.__setstate__({"valid": True, "tags": {"album": ["Album"]}})
+        self.assertEqual(snapshot.tags, {"album": ["Album"]})
+
+    def test_not_audio(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            snapshot = mod.TagSnapshot.from_file(write(os.path.join(d, "a"), "text"))
+        self.assertFalse(snapshot.valid)
+        self.assertIsNone(snapshot.get("album"))
+
+
+class TestSQLiteMetadataCache(unittest.TestCase):
+    def test_roundtrip(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            b = write(os.path.join(d, "b"), "second")
+
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.update_metadata_for([a, b])
+                self.assertEqual(c[a], "first")
+            self.assertEqual(factory.calls, [a, b])
+
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.update_metadata_for([a, b])
+                self.assertEqual(c.get(b), "second")
+                self.assertTrue(c.has_key(a))
+            self.assertEqual(factory.calls, [])
+
+    def test_only_modified_entries_are_refreshed(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            b = write(os.path.join(d, "b"), "second")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                c.update_metadata_for([a, b])
+
+            write(b, "changed")
+            st = os.stat(b)
+            os.utime(b, (st.st_atime + 10, st.st_mtime + 10))
+
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.update_metadata_for([a, b])
+                self.assertEqual(c[b], "changed")
+            self.assertEqual(factory.calls, [b])
+
+    def test_parallel_update(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            paths = [write(os.path.join(d, str(n)), str(n)) for n in range(20)]
+            with mod.SQLiteMetadataCache("test.sqlite", 1, read) as c:
+                c.update_metadata_for(paths, jobs=4)
+                self.assertTrue(c.is_dirty())
+                self.assertEqual([c[p] for p in paths], [str(n) for n in range(20)])
+                self.assertEqual(list(c._store), paths)
+
+    def test_parallel_update_stops_on_errors(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            paths = [write(os.path.join(d, str(n)), str(n)) for n in range(20)]
+            shutdown = concurrent.futures.ProcessPoolExecutor.shutdown
+            with mock.patch.object(
+                concurrent.futures.ProcessPoolExecutor,
+                "shutdown",
+                autospec=True,
+                side_effect=shutdown,
+            ) as patched:
+                with mod.SQLiteMetadataCache("test.sqlite", 1, fail) as c:
+                    with self.assertRaises(ValueError):
+                        c.update_metadata_for(paths, jobs=4)
+            patched.assert_any_call(mock.ANY, wait=False, cancel_futures=True)
+
+    def test_unchanged_directories_are_trusted(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                c.update_metadata_for([a], trust_directory_mtimes=True)
+
+            # Modified in place: the directory is unchanged, so the file
+            # is not examined when directory mtimes are trusted.
+            write(a, "changed")
+            st = os.stat(a)
+            os.utime(a, (st.st_atime + 10, st.st_mtime + 10))
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                with mock.patch.object(os, "stat", wraps=os.stat) as stat:
+                    c.update_metadata_for([a], trust_directory_mtimes=True)
+                self.assertEqual([x.args[0] for x in stat.call_args_list], [d])
+                self.assertEqual(c[a], "first")
+                c.update_metadata_for([a])
+                self.assertEqual(c[a], "changed")
+
+            # A new file changes the directory, so its files are examined.
+            b = write(os.path.join(d, "b"), "second")
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.update_metadata_for([a, b], trust_directory_mtimes=True)
+            self.assertEqual(factory.calls, [b])
+
+    def test_checkpoints(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            paths = [write(os.path.join(d, str(n)), str(n)) for n in range(5)]
+            saved: list[int] = []
+
+            def factory(path: str) -> str:
+                conn = sqlite3.connect(mod.cache_path("test.sqlite"))
+                saved.append(conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0])
+                conn.close()
+                return read(path)
+
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.checkpoint_entries = 2
+                c.update_metadata_for(paths)
+            self.assertEqual(saved, [0, 0, 2, 2, 4])
+
+    def test_moved_files_keep_their_entries(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            os.mkdir(os.path.join(d, "old"))
+            a = write(os.path.join(d, "old", "a"), "first")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                c.update_metadata_for([a])
+
+            os.rename(os.path.join(d, "old"), os.path.join(d, "new"))
+            moved = os.path.join(d, "new", "a")
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.update_metadata_for([moved])
+                self.assertEqual(c.evict_missing([d], [moved]), 1)
+                self.assertEqual(c[moved], "first")
+                self.assertEqual(c.stats.hits, 1)
+            self.assertEqual(factory.calls, [])
+
+            # The entry under the new path is reused when it moves back.
+            os.rename(os.path.join(d, "new"), os.path.join(d, "old"))
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 1, factory) as c:
+                c.update_metadata_for([a])
+                self.assertEqual(c[a], "first")
+            self.assertEqual(factory.calls, [])
+
+    def test_version_change_discards_entries(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                c.update_metadata_for([a])
+
+            with mod.SQLiteMetadataCache("test.sqlite", 2, CountingFactory()) as c:
+                self.assertIsNone(c.get(a))
+
+
+class TestLegacyCaches(unittest.TestCase):
+    def test_removed_with_tag_snapshot_cache(self) -> None:
+        with cache_home():
+            for name in mod.LEGACY_CACHE_NAMES:
+                write(mod.cache_path(name), "old")
+            with mod.tag_snapshot_cache():
+                pass
+            self.assertEqual(os.listdir(mod.cache_directory()), ["tags.sqlite"])
+            self.assertEqual(mod.remove_legacy_caches(), [])
+
+
+class TestCacheStats(unittest.TestCase):
+    def test_counts(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            b = write(os.path.join(d, "b"), "second")
+            missing = os.path.join(d, "missing")
+            cache = mod.SQLiteMetadataCache("test.sqlite", 1, read)
+            with cache as c:
+                c.update_metadata_for([a, b, missing])
+                self.assertIs(c.stats, cache.stats)
+            self.assertEqual(
+                (cache.stats.hits, cache.stats.misses, cache.stats.errors), (0, 2, 1)
+            )
+            self.assertGreater(cache.stats.bytes_written, 0)
+
+            cache = mod.SQLiteMetadataCache("test.sqlite", 1, read)
+            stream = io.StringIO()
+            with cache.stats.reported("json", stream), cache as c:
+                c.update_metadata_for([a, b])
+            reported = json.loads(stream.getvalue())
+            self.assertEqual((reported["hits"], reported["misses"]), (2, 0))
+            self.assertGreater(reported["bytes_read"], 0)
+            self.assertEqual(reported["bytes_written"], 0)
+            self.assertIn("parse_seconds", reported)
+
+    def test_not_pickled(self) -> None:
+        c = mod.FileMetadataCache(read)
+        c.stats.hits = 3
+        self.assertEqual(pickle.loads(pickle.dumps(c)).stats.hits, 0)
+
+    def test_cache_arguments(self) -> None:
+        parser = argparse.ArgumentParser()
+        mod.add_cache_arguments(parser)
+        args = parser.parse_args(["-q", "-j", "3", "--stats-json"])
+        self.assertEqual((args.quick, args.jobs, args.stats), (True, 3, "json"))
+        stats = mod.CacheStats()
+        stats.hits = 2
+        with mock.patch.object(sys, "stderr", io.StringIO()) as stderr:
+            with mod.report_stats(args, stats):
+                pass
+            with mod.report_stats(parser.parse_args([]), stats):
+                pass
+        self.assertEqual(json.loads(stderr.getvalue())["hits"], 2)
+
+
+class TestMigrations(unittest.TestCase):
+    def test_sqlite_entries_are_upgraded(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            b = write(os.path.join(d, "b"), "second")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, read) as c:
+                c.update_metadata_for([a, b])
+
+            migrations = {
+                1: lambda item: None if item == "second" else item.upper(),
+                2: lambda item: item + "!",
+            }
+            factory = CountingFactory()
+            with mod.SQLiteMetadataCache("test.sqlite", 3, factory, migrations) as c:
+                c.update_metadata_for([a, b])
+                self.assertEqual(c[a], "FIRST!")
+                self.assertEqual(c[b], "second")
+            self.assertEqual(factory.calls, [b])
+
+    def test_sqlite_entries_without_migration_are_discarded(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, read) as c:
+                c.update_metadata_for([a])
+            migrations = {2: lambda item: item}
+            with mod.SQLiteMetadataCache("test.sqlite", 3, read, migrations) as c:
+                self.assertIsNone(c.get(a))
+
+    def test_pickled_cache_is_upgraded(self) -> None:
+        def upgrade(
+            cache: mod.FileMetadataCache[str],
+        ) -> mod.FileMetadataCache[str]:
+            for key, (mtime, item) in list(cache._store.items()):
+                cache._store[key] = (mtime, item.upper())
+            return cache
+
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            with mod.OnDiskMetadataCache(
+                "test.pickle", 1, lambda: mod.FileMetadataCache(read)
+            ) as c:
+                c.update_metadata_for([a])
+            with mod.OnDiskMetadataCache(
+                "test.pickle", 2, lambda: mod.FileMetadataCache(read), {1: upgrade}
+            ) as c:
+                self.assertEqual(c.get(a), "FIRST")
+
+
+class TestConcurrentUse(unittest.TestCase):
+    def test_newest_database_entry_wins(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, read) as c1:
+                c1.update_metadata_for([a])
+                write(a, "changed")
+                st = os.stat(a)
+                os.utime(a, (st.st_atime + 10, st.st_mtime + 10))
+                with mod.SQLiteMetadataCache("test.sqlite", 1, read) as c2:
+                    c2.update_metadata_for([a])
+
+            with mod.SQLiteMetadataCache("test.sqlite", 1, read) as c:
+                self.assertEqual(c.get(a), "changed")
+
+
+class TestEviction(unittest.TestCase):
+    def test_evict_missing(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            os.mkdir(os.path.join(d, "sub"))
+            a = write(os.path.join(d, "sub", "a"), "first")
+            b = write(os.path.join(d, "sub", "b"), "second")
+            outside = write(os.path.join(d, "outside"), "third")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                c.update_metadata_for([a, b, outside], trust_directory_mtimes=True)
+
+            os.unlink(b)
+            os.unlink(outside)
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                paths = [path for _, path in c._identities.values()]
+                self.assertIn(b, paths)
+                evicted = c.evict_missing([os.path.join(d, "sub")], [])
+                self.assertEqual(evicted, 1)
+                self.assertTrue(c.is_dirty())
+                # The identities of the files evicted go with them.
+                paths = [path for _, path in c._identities.values()]
+                self.assertNotIn(b, paths)
+                self.assertIn(a, paths)
+
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                self.assertEqual(c.get(a), "first")
+                self.assertIsNone(c.get(b))
+                self.assertEqual(c.get(outside), "third")
+
+            removed, _ = mod.compact_sqlite_cache("test.sqlite")
+            self.assertEqual(removed, 1)
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                self.assertIsNone(c.get(outside))
+                self.assertEqual(c.get(a), "first")
+
+
+class TestSQLiteMetadataStore(unittest.TestCase):
+    def test_lazy_store(self) -> None:
+        with cache_home(), tempfile.TemporaryDirectory() as d:
+            a = write(os.path.join(d, "a"), "first")
+            b = write(os.path.join(d, "b"), "second")
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                c.update_metadata_for([a, b])
+                store = c._store
+                assert isinstance(store, mod.SQLiteMetadataStore)
+                self.assertTrue(store.is_dirty())
+                store.flush()
+                self.assertFalse(store.is_dirty())
+                del store[a]
+                self.assertEqual(sorted(store), [b])
+                self.assertEqual(len(store), 1)
+
+            with mod.SQLiteMetadataCache("test.sqlite", 1, CountingFactory()) as c:
+                self.assertIsNone(c.get(a))
+                self.assertEqual(c.get(b), "second")
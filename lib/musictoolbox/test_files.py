@@ -0,0 +1,148 @@
+import concurrent.futures
+import os
+import tempfile
+import unittest
+
+from . import files as mod
+
+
+def touch(*parts: str) -> str:
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(path)
+    return path
+
+
+class TestWalkFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        d = self.d = self.tmp.name
+        self.a = touch(d, "a")
+        self.b = touch(d, "x", "b")
+        self.c = touch(d, "x", "y", "c")
+        self.e = touch(d, "z", "e")
+        os.symlink(os.path.join(d, "x"), os.path.join(d, "link"))
+        os.symlink(os.path.join(d, "missing"), os.path.join(d, "broken"))
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def paths(self, recursive: bool) -> list[str]:
+        return sorted(e.path for e in mod.walk_files([self.d], recursive=recursive))
+
+    def test_files_before_subdirectories(self) -> None:
+        entries = list(mod.walk_files([self.d]))
+        paths = [e.path for e in entries]
+        self.assertEqual(set(paths[:2]), {self.a, os.path.join(self.d, "broken")})
+        self.assertLess(paths.index(self.b), paths.index(self.c))
+        # Symbolic links to directories are not followed.
+        self.assertNotIn(os.path.join(self.d, "link", "b"), paths)
+        self.assertEqual(
+            {e.path for e in entries if e.is_file}, {self.a, self.b, self.c, self.e}
+        )
+        self.assertTrue(all(e.stat is None for e in entries))
+
+    def test_not_recursive(self) -> None:
+        self.assertEqual(
+            self.paths(recursive=False),
+            sorted([self.a, os.path.join(self.d, "broken")]),
+        )
+
+    def test_skip_directory(self) -> None:
+        entries = mod.walk_files(
+            [self.d], skip_directory=lambda p: os.path.basename(p) == "x"
+        )
+        self.assertEqual(
+            sorted(e.path for e in entries if e.is_file), [self.a, self.e]
+        )
+
+    def test_stat(self) -> None:
+        for jobs in (1, 4):
+            entries = {
+                e.path: e for e in mod.walk_files([self.d], want_stat=True, jobs=jobs)
+            }
+            for path in (self.a, self.b, self.c, self.e):
+                st = entries[path].stat
+                assert st is not None
+                self.assertEqual(st.st_ino, os.stat(path).st_ino)
+            self.assertIsNone(entries[os.path.join(self.d, "broken")].stat)
+            self.assertFalse(entries[os.path.join(self.d, "broken")].is_file)
+
+    def test_paths_that_are_files(self) -> None:
+        missing = os.path.join(self.d, "nothing")
+        self.assertEqual(
+            list(mod.walk_files([self.a, missing])),
+            [mod.FileEntry(self.a, True, None), mod.FileEntry(missing, False, None)],
+        )
+        self.assertEqual(mod.all_files([self.a, missing]), [self.a, missing])
+
+
+class TestStatFiles(unittest.TestCase):
+    def test_stat_files(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            paths = [touch(d, str(n)) for n in range(5)]
+            missing = os.path.join(d, "missing")
+            for jobs in (1, 3):
+                stats = mod.stat_files(paths + [missing], jobs)
+                self.assertEqual(list(stats), paths)
+                self.assertEqual(
+                    [st.st_ino for st in stats.values()],
+                    [os.stat(p).st_ino for p in paths],
+                )
+
+
+    def test_hash_files(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            paths = [touch(d, str(n)) for n in range(3)]
+            for path, data in zip(paths, ["a", "x" * 3000000, "a"]):
+                with open(path, "w") as f:
+                    f.write(data)
+            missing = os.path.join(d, "missing")
+            for jobs in (1, 3):
+                hashes = mod.hash_files(paths + [missing], jobs)
+                self.assertEqual(list(hashes), paths)
+                self.assertEqual(hashes[paths[0]], hashes[paths[2]])
+                self.assertNotEqual(hashes[paths[0]], hashes[paths[1]])
+                self.assertEqual(hashes[paths[1]], mod.content_hash(paths[1]))
+
+
+class TestFilesystemMemo(unittest.TestCase):
+    def test_directories_created_once(self) -> None:
+        memo = mod.FilesystemMemo()
+        with tempfile.TemporaryDirectory() as d:
+            target = os.path.join(d, "a", "b")
+            memo.ensure_directories_exist(["", target, target])
+            self.assertTrue(os.path.isdir(target))
+            # Remembered: a directory removed behind its back is not recreated.
+            os.rmdir(target)
+            memo.ensure_directories_exist([target])
+            self.assertFalse(os.path.exists(target))
+            mod.ensure_directories_exist([target])
+            self.assertTrue(os.path.isdir(target))
+
+    def test_concurrent_creation(self) -> None:
+        memo = mod.FilesystemMemo()
+        with tempfile.TemporaryDirectory() as d:
+            targets = [os.path.join(d, "x", str(n % 5)) for n in range(50)]
+            with concurrent.futures.ThreadPoolExecutor(8) as executor:
+                for t in targets:
+                    executor.submit(memo.ensure_directories_exist, [t])
+            self.assertEqual(sorted(os.listdir(os.path.join(d, "x"))), list("01234"))
+
+    def test_shorten_to_name_max(self) -> None:
+        memo = mod.FilesystemMemo()
+        with tempfile.TemporaryDirectory() as d:
+            name_max = os.pathconf(d, "PC_NAME_MAX")
+            name = "n" * (name_max + 10)
+            for directory in (d, os.path.join(d, "not", "yet")):
+                self.assertEqual(memo.name_max(directory), name_max)
+                self.assertEqual(
+                    memo.shorten_to_name_max(directory, name, 8),
+                    mod.shorten_to_name_max(directory, name, 8),
+                )
+            self.assertEqual(len(memo.shorten_to_name_max(d, name, 8)), name_max - 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
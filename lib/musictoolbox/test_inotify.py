@@ -0,0 +1,76 @@
+import errno
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from . import inotify as mod
+
+
+def write(path: str, text: str) -> str:
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+class TestTreeWatcher(unittest.TestCase):
+    def drain(self, watcher: mod.TreeWatcher) -> tuple[set[str], set[str]]:
+        while watcher.read(0.1):
+            pass
+        return watcher.take()
+
+    def test_changes(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            os.mkdir(os.path.join(d, "sub"))
+            with mod.TreeWatcher([d]) as watcher:
+                a = write(os.path.join(d, "sub", "a"), "first")
+                self.assertEqual(self.drain(watcher), ({a}, set()))
+
+                os.mkdir(os.path.join(d, "new"))
+                b = write(os.path.join(d, "new", "b"), "second")
+                # The file may be written before the new folder is watched,
+                # but the folder is reported, and all files in it with it.
+                changed, removed = self.drain(watcher)
+                self.assertIn(os.path.join(d, "new"), changed)
+                self.assertLessEqual(changed, {os.path.join(d, "new"), b})
+                self.assertEqual(removed, set())
+
+                os.rename(os.path.join(d, "new"), os.path.join(d, "renamed"))
+                os.unlink(a)
+                self.assertEqual(
+                    self.drain(watcher),
+                    ({os.path.join(d, "renamed")}, {os.path.join(d, "new"), a}),
+                )
+
+                c = write(os.path.join(d, "renamed", "c"), "third")
+                self.assertEqual(self.drain(watcher), ({c}, set()))
+                self.assertFalse(watcher.pending())
+
+    def test_watch_limit(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            for sub in ["a", "b", "c"]:
+                os.mkdir(os.path.join(d, sub))
+            add_watch = mod.Inotify.add_watch
+            calls: list[str] = []
+
+            def limited(inotify: mod.Inotify, path: str, mask: int) -> int:
+                calls.append(path)
+                if len(calls) > 2:
+                    raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+                return add_watch(inotify, path, mask)
+
+            with mock.patch.object(mod.Inotify, "add_watch", limited):
+                with self.assertLogs(mod._LOGGER, "ERROR") as logs:
+                    watcher = mod.TreeWatcher([d])
+            with watcher:
+                # The limit is reported once, and no more folders are tried.
+                self.assertEqual(len(logs.records), 1)
+                self.assertEqual(len(calls), 3)
+                self.assertFalse(watcher.complete)
+                # Everything is reported as changed once the poll is due.
+                self.assertFalse(watcher.read(0))
+                self.assertFalse(watcher.pending())
+                watcher.poll_interval = 0.0
+                with mock.patch("time.monotonic", lambda: 1e12):
+                    self.assertTrue(watcher.read(0))
+                self.assertEqual(watcher.take(), ({d}, {d}))
@@ -0,0 +1,135 @@
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from . import m3u as mod
+
+
+class TestResolve(unittest.TestCase):
+    def test_same_as_abspath(self) -> None:
+        for entry in [
+            "a.mp3",
+            "x/y/a.mp3",
+            "x//y/./a.mp3",
+            "../x/a.mp3",
+            "x/..",
+            "x/.",
+            "x/",
+            "/abs/../olute.mp3",
+            "//double.mp3",
+        ]:
+            self.assertEqual(
+                mod.resolve("/music/lists", entry),
+                os.path.abspath(os.path.join("/music/lists", entry)),
+                entry,
+            )
+
+    def test_file_urls(self) -> None:
+        path = "/music/new\nline é.mp3"
+        entry = mod.entry(path, "/music/lists")
+        self.assertEqual(entry, "file:///music/new%0Aline %C3%A9.mp3")
+        self.assertEqual(mod.resolve("/elsewhere", entry), path)
+
+    def test_entry(self) -> None:
+        self.assertEqual(mod.entry("/music/a/b.mp3", "/music/lists"), "../a/b.mp3")
+        self.assertEqual(mod.entry("/music/a/b.mp3"), "/music/a/b.mp3")
+
+
+class TestRead(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.d = self.tmp.name
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def playlist(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.d, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_lines(self) -> None:
+        path = self.playlist(
+            "a.m3u",
+            b"#EXTM3U\r\n#EXTINF:123,Artist - Title\r\n a/b.mp3 \r\n\r\nc.mp3",
+        )
+        playlist = mod.read(path)
+        self.assertEqual(playlist.encoding, "utf-8")
+        self.assertEqual(
+            playlist.lines,
+            [
+                mod.Line("#EXTM3U\n", "#EXTM3U", None),
+                mod.Line(
+                    "#EXTINF:123,Artist - Title\n", "#EXTINF:123,Artist - Title", None
+                ),
+                mod.Line(
+                    " a/b.mp3 \n",
+                    "a/b.mp3",
+                    os.path.join(self.d, "a", "b.mp3"),
+                    "123,Artist - Title",
+                ),
+                mod.Line("\n", "", None),
+                mod.Line("c.mp3", "c.mp3", os.path.join(self.d, "c.mp3")),
+            ],
+        )
+
+    def test_symlinked(self) -> None:
+        os.mkdir(os.path.join(self.d, "real"))
+        path = self.playlist(os.path.join("real", "a.m3u"), b"b.mp3\n")
+        link = os.path.join(self.d, "link.m3u")
+        os.symlink(path, link)
+        playlist = mod.read(link)
+        self.assertEqual(playlist.path, link)
+        self.assertEqual(playlist.paths, [os.path.join(self.d, "real", "b.mp3")])
+
+    def test_encodings(self) -> None:
+        latin = self.playlist("latin.m3u", "é.mp3\n".encode("latin-1"))
+        with self.assertLogs(mod._LOGGER, "WARNING"):
+            self.assertEqual(mod.read(latin).encoding, "latin-1")
+        self.assertEqual(mod.read(latin).paths, [os.path.join(self.d, "é.mp3")])
+        bom = self.playlist("bom.m3u8", "﻿é.mp3\n".encode("utf-8"))
+        self.assertEqual(mod.read(bom).encoding, "utf-8-sig")
+        self.assertEqual(mod.read(bom).paths, [os.path.join(self.d, "é.mp3")])
+        for name in ["broken.m3u8", "broken.txt"]:
+            broken = self.playlist(name, "é.mp3\n".encode("latin-1"))
+            with self.assertRaises(UnicodeDecodeError):
+                mod.read(broken)
+
+
+class TestWrite(unittest.TestCase):
+    def test_write(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.m3u")
+            self.assertTrue(mod.differs(path, "a.mp3\n"))
+            mod.write(path, "a.mp3\n")
+            self.assertFalse(mod.differs(path, "a.mp3\n"))
+            umask = os.umask(0o22)
+            os.umask(umask)
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), ~umask & 0o666)
+
+            os.chmod(path, 0o600)
+            link = os.path.join(d, "link.m3u")
+            os.symlink(path, link)
+            mod.write(link, "é.mp3\n", "latin-1")
+            self.assertTrue(os.path.islink(link))
+            self.assertFalse(mod.differs(path, "é.mp3\n", "latin-1"))
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+            self.assertEqual(sorted(os.listdir(d)), ["a.m3u", "link.m3u"])
+
+    def test_write_without_permissions(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.m3u")
+            with mock.patch.object(os, "fchmod", side_effect=PermissionError):
+                mod.write(path, "a.mp3\n")
+            self.assertFalse(mod.differs(path, "a.mp3\n"))
+
+    def test_write_device(self) -> None:
+        mod.write(os.devnull, "a.mp3\n")
+        self.assertTrue(os.path.exists(os.devnull))
+
+
+if __name__ == "__main__":
+    unittest.main()
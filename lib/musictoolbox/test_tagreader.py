@@ -0,0 +1,138 @@
+import os
+import struct
+import tempfile
+import typing
+import unittest
+
+from mutagen._file import File
+from mutagen._vorbis import VComment
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, ID3
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+from mutagen.ogg import OggPage
+
+from . import cache
+from . import tagreader as mod
+from .test_cache import make_flac, make_mp3
+
+
+def atom(name: bytes, data: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(data), name) + data
+
+
+def make_m4a(path: str) -> str:
+    """Write an MP4 file with no tracks, then tag it with mutagen."""
+    mvhd = atom(
+        b"mvhd", b"\x00" * 4 + struct.pack(">IIII", 0, 0, 1000, 0) + b"\x00" * 80
+    )
+    with open(path, "wb") as f:
+        f.write(
+            atom(b"ftyp", b"M4A \x00\x00\x00\x00M4A mp42isom")
+            + atom(b"moov", mvhd)
+            + atom(b"mdat", b"")
+        )
+    mp4 = MP4(path)
+    mp4["\xa9alb"] = ["Album"]
+    mp4["\xa9ART"] = ["Artist"]
+    mp4["trkn"] = [(1, 2)]
+    mp4["covr"] = [MP4Cover(b"\xff" * 1000)]
+    mp4["----:com.apple.iTunes:replaygain_track_gain"] = [MP4FreeForm(b"-2.00 dB")]
+    mp4["----:com.apple.iTunes:MusicBrainz Album Id"] = [MP4FreeForm(b"id")]
+    mp4.save()
+    return path
+
+
+def make_ogg(path: str) -> str:
+    """Write an Ogg Vorbis file whose comment packet spans several pages."""
+    ident = b"\x01vorbis" + struct.pack(
+        "<IBIiiiBB", 0, 2, 44100, 0, 128000, 0, 0xB8, 1
+    )
+    comment = VComment()
+    comment.vendor = "test"
+    comment.extend(
+        [
+            ("ALBUM", "Album"),
+            ("artist", "One"),
+            ("ARTIST", "Two"),
+            ("METADATA_BLOCK_PICTURE", "x" * 70000),
+        ]
+    )
+    first = OggPage()
+    first.packets = [ident]
+    first.serial = 1
+    first.first = True
+    pages = OggPage.from_packets([b"\x03vorbis" + comment.write(), b"\x05vorbis"], 1)
+    last = OggPage()
+    last.packets = [b"\x00" * 20]
+    last.serial = 1
+    last.sequence = len(pages) + 1
+    last.position = 1000
+    last.last = True
+    with open(path, "wb") as f:
+        f.write(first.write())
+        for page in pages:
+            page.serial = 1
+            f.write(page.write())
+        f.write(last.write())
+    return path
+
+
+def with_pictures(path: str) -> str:
+    if path.endswith(".mp3"):
+        tags = ID3(path)
+        tags.add(
+            APIC(encoding=3, mime="image/png", type=3, desc="", data=b"\x89" * 1000)
+        )
+        tags.save(path)
+    else:
+        flac = FLAC(path)
+        picture = Picture()
+        picture.data = b"\x89" * 1000
+        flac.add_picture(picture)
+        flac.save()
+    return path
+
+
+class TestReadTags(unittest.TestCase):
+    def assertSameAsMutagen(self, path: str) -> dict[str, list[str]]:
+        kind, raw = mod.read_tags(path, cache.SNAPSHOT_KEYS)
+        mutagen_file: typing.Any = File(path)
+        fast = cache._snapshot_tags(kind, raw)
+        self.assertEqual(fast, cache._snapshot_tags(kind, mutagen_file.tags))
+        self.assertTrue(fast)
+        return fast
+
+    def test_mp3(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = with_pictures(make_mp3(os.path.join(d, "a.mp3")))
+            self.assertSameAsMutagen(path)
+            _, raw = mod.read_tags(path, cache.SNAPSHOT_KEYS)
+            self.assertEqual(raw.getall("APIC"), [])
+
+    def test_flac(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = with_pictures(make_flac(os.path.join(d, "a.flac")))
+            self.assertSameAsMutagen(path)
+
+    def test_ogg(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            tags = self.assertSameAsMutagen(make_ogg(os.path.join(d, "a.ogg")))
+            self.assertEqual(tags["artist"], ["One", "Two"])
+
+    def test_mp4(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            tags = self.assertSameAsMutagen(make_m4a(os.path.join(d, "a.m4a")))
+            self.assertEqual(tags["musicbrainz_albumid"], ["id"])
+
+    def test_unsupported(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            for name, data in (
+                ("a.mp3", b"not an mp3"),
+                ("a.wav", b"RIFF"),
+                ("a.ogg", b""),
+            ):
+                path = os.path.join(d, name)
+                with open(path, "wb") as f:
+                    f.write(data)
+                with self.assertRaises(mod.Unsupported):
+                    mod.read_tags(path, cache.SNAPSHOT_KEYS)
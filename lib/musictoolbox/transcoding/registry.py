@@ -1,4 +1,6 @@
 import collections
+import hashlib
+import json
 import logging
 import os
 from pathlib import Path
@@ -70,6 +72,18 @@ class TranscodingPath(object):
     def __eq__(self, other: Any) -> bool:
         return str(self) == str(other)
 
+    def fingerprint(self) -> str:
+        """
+        Return a fingerprint of the steps of this path and of the settings
+        of their transcoders, which changes when either does.
+        """
+        steps = []
+        for step in self.steps:
+            transcoder = step.transcoder_db.get_transcoder(step.transcoder_name)
+            steps.append([str(step), getattr(transcoder, "settings", None)])
+        data = json.dumps(steps, sort_keys=True, default=repr)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
     @property
     def srctype(self) -> FileType:
         return self.steps[0].srctype
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Dict, List, Tuple
 import unittest
 
 from . import config as cfg
@@ -27,6 +27,18 @@ class DummyLookup(object):
         return DummyTranscoder({})
 
 
+class SettingsLookup(object):
+    def __init__(self, settings: Dict[str, Any]) -> None:
+        self.transcoder = DummyTranscoder({})
+        self.transcoder.settings = settings  # type: ignore
+
+    def get_transcoder(
+        self,
+        transcoder_name: TranscoderName,  # @UnusedVariable
+    ) -> TranscoderProtocol:
+        return self.transcoder
+
+
 def mp(cost: int, steps: List[Tuple[str, str, str]]) -> reg.TranscodingPath:
     return reg.TranscodingPath(
         cost,
@@ -62,3 +74,21 @@ class TestTranscoderRegistry(unittest.TestCase):
     def test_transcoder_settings_for_unknown_transcoder(self) -> None:
         c = set.TranscoderSettings({"unknown": {"a": "b"}})
         self.assertRaises(ValueError, reg.TranscoderRegistry, c)
+
+    def test_fingerprint(self) -> None:
+        steps = [
+            (FileType.by_name("mp3"), FileType.by_name("wav"), TranscoderName("x"))
+        ]
+        a = reg.TranscodingPath(1, SettingsLookup({"rate": 1}), steps)
+        self.assertEqual(
+            a.fingerprint(),
+            reg.TranscodingPath(2, SettingsLookup({"rate": 1}), steps).fingerprint(),
+        )
+        self.assertNotEqual(
+            a.fingerprint(),
+            reg.TranscodingPath(1, SettingsLookup({"rate": 2}), steps).fingerprint(),
+        )
+        self.assertNotEqual(
+            mp(1, [("mp3", "mp3", "copy")]).fingerprint(),
+            mp(1, [("mp3", "wav", "copy")]).fingerprint(),
+        )
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 import os
 from pathlib import Path
@@ -66,6 +68,26 @@ class TranscodingMapper(object):
     def lookup(self, path: Path) -> typing.List[reg.TranscodingPath]:
         return self._feed_cache(path)
 
+    def fingerprint(self) -> str:
+        """
+        Return a fingerprint of the transcoders, their settings and the
+        policies, which changes when the pipelines chosen for files may.
+        """
+        transcoders = self.transcoder_registry.transcoders
+        data = json.dumps(
+            [
+                [
+                    [name, getattr(transcoders[name], "settings", None)]
+                    for name in sorted(transcoders)
+                ],
+                str(self.pipeline_selector.policies),
+                self.pipeline_selector.allow_fallback,
+            ],
+            sort_keys=True,
+            default=repr,
+        )
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
     def lookup_with_graph(
         self,
         path: Path,
@@ -88,16 +110,17 @@ class TranscodingMapper(object):
 class SingleItemSyncer(object):
     def __init__(self, postprocessor: Postprocessor):
         self.postprocessor = postprocessor
+        self.memo = files.FilesystemMemo()
 
     def sync(self, src: Path, dst: Path, transcoding_path: reg.TranscodingPath) -> None:
         logger.debug("Beginning to transcode from %s", src)
-        files.ensure_directories_exist([dst.parent.as_posix()])
+        self.memo.ensure_directories_exist([dst.parent.as_posix()])
         in_fn = src.as_posix()
         with files.remover() as tmpfiles:
             for step in transcoding_path.steps:
                 prefix = ".tmp-" + step.transcoder_name + dst.stem
                 suffix = "." + step.dsttype
-                prefix = files.shorten_to_name_max(
+                prefix = self.memo.shorten_to_name_max(
                     dst.parent.as_posix(),
                     prefix,
                     8 + len(suffix),
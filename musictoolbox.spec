@@ -49,6 +49,7 @@ Summary:        %{summary}
 
 %files -n %{_name} -f %{pyproject_files}
 %doc README.md
+%{_bindir}/compactcaches
 %{_bindir}/cpm3u
 %{_bindir}/detect-broken-ape-tags
 %{_bindir}/detect-missing-ape-tags
@@ -62,6 +63,7 @@ Summary:        %{summary}
 %{_bindir}/syncplaylists
 %{_bindir}/viewmp3norm
 %{_bindir}/viewtargs
+%{_bindir}/warmcaches
 
 %changelog
 * Tue Aug 22 2023 Manuel Amador <rudd-o@rudd-o.com> 0.0.75-1